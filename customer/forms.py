@@ -1,5 +1,5 @@
 from django import forms
-from ticket.models import TicketType, TicketPriority
+from ticket.lookups import LookupChoiceField
 from authentication.models import User, UserInstance
 from django.contrib.auth.forms import PasswordChangeForm as DjangoPasswordChangeForm
 
@@ -8,8 +8,8 @@ class PublicTicketForm(forms.Form):
     email = forms.EmailField(label='Your Email', max_length=255)
     subject = forms.CharField(label='Subject', max_length=255)
     message = forms.CharField(label='Message', widget=forms.Textarea)
-    ticket_type = forms.ModelChoiceField(queryset=TicketType.objects.all(), label='Ticket Type')
-    ticket_priority = forms.ModelChoiceField(queryset=TicketPriority.objects.all(), label='Ticket Priority')
+    ticket_type = LookupChoiceField('ticket_types', label='Ticket Type')
+    ticket_priority = LookupChoiceField('priorities', label='Ticket Priority')
 
 
 class UserProfileForm(forms.ModelForm):
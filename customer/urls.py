@@ -21,6 +21,7 @@ urlpatterns = [
     path('dashboard/', views.authenticated_customer_dashboard, name='authenticated_customer_dashboard'),
     path('tickets/', views.customer_ticket_list, name='customer_ticket_list'),
     path('tickets/<int:ticket_id>/', views.customer_view_ticket, name='customer_view_ticket'),
+    path('tickets/<int:ticket_id>/threads/', views.customer_ticket_threads, name='customer_ticket_threads'),
     path('create-ticket-auth/', views.create_ticket_authenticated, name='create_ticket_authenticated'),
     path('profile/', views.customer_profile, name='customer_profile'),
 ]
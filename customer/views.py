@@ -4,6 +4,7 @@ from django.db.models import Q
 from authentication.decorators import customer_login_required
 from knowledgebase.models import Folder, SolutionCategory, Article
 from ticket.models import Ticket, TicketStatus
+from ticket.services import get_thread_window, thread_window_response
 from .forms import PublicTicketForm
 from django.contrib import messages
 from settings.models import WebsiteKnowledgebase
@@ -277,7 +278,6 @@ def customer_view_ticket(request, ticket_id):
     # View a specific ticket for the logged-in customer
     customer_user_instance = request.user.user_instances.first()
     ticket = get_object_or_404(Ticket, id=ticket_id, customer=customer_user_instance)
-    threads = ticket.threads.all().order_by('createdAt')
 
     # Handle reply form submission
     if request.method == 'POST':
@@ -296,12 +296,21 @@ def customer_view_ticket(request, ticket_id):
         else:
             messages.error(request, 'Reply message cannot be empty.')
 
+    threads, older_threads_cursor = get_thread_window(ticket)
     context = {
         'ticket': ticket,
-        'threads': threads
+        'threads': threads,
+        'older_threads_cursor': older_threads_cursor,
     }
     return render(request, 'customer/customer_view_ticket.html', context)
 
+@customer_login_required
+def customer_ticket_threads(request, ticket_id):
+    # Older conversation windows for the "Load older messages" button
+    customer_user_instance = request.user.user_instances.first()
+    ticket = get_object_or_404(Ticket, id=ticket_id, customer=customer_user_instance)
+    return thread_window_response(request, ticket, 'customer/customer_ticket_threads.html')
+
 @customer_login_required
 def create_ticket_authenticated(request):
     # Authenticated form for creating a ticket
@@ -1,93 +1,284 @@
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.core.cache import cache
 from django.core.mail.backends.smtp import EmailBackend
 from django.conf import settings
-from .models import UvEmailSettings, UvSwiftmailer
+from .models import UvEmailSettings, UvSwiftmailer, UvMailbox
+
+logger = logging.getLogger(__name__)
+
+# Resolved SMTP settings of a transport; also the key of its connection pool
+TransportConfig = namedtuple('TransportConfig', [
+    'host', 'port', 'username', 'password', 'use_tls', 'use_ssl', 'timeout', 'ssl_keyfile', 'ssl_certfile',
+])
+
+TRANSPORT_VERSION_KEY = 'uv_email_transport_version'
+
+# Transport settings read by this process: name -> (version, value)
+_transport_cache = {}
+# Idle authenticated connections of this process: TransportConfig -> [(connection, last used), ...]
+_pool = {}
+# Connections each transport may have in use at once: TransportConfig -> semaphore
+_slots = {}
+_pool_lock = threading.Lock()
+
+
+def _default_config():
+    return TransportConfig(
+        settings.EMAIL_HOST, settings.EMAIL_PORT, settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD,
+        settings.EMAIL_USE_TLS, settings.EMAIL_USE_SSL, settings.EMAIL_TIMEOUT,
+        settings.EMAIL_SSL_KEYFILE, settings.EMAIL_SSL_CERTFILE,
+    )
+
+
+def transport_config(swiftmailer):
+    """Returns the SMTP settings of a UvSwiftmailer, or Django's EMAIL_* settings when there is none."""
+    if swiftmailer is None:
+        return _default_config()
+    if swiftmailer.transport == 'gmail':
+        host, port, use_tls, use_ssl = 'smtp.gmail.com', 587, True, False
+    elif swiftmailer.transport == 'yahoo':
+        host, port, use_tls, use_ssl = 'smtp.mail.yahoo.com', 587, True, False
+    elif swiftmailer.transport == 'smtp':
+        host, port = swiftmailer.host, swiftmailer.port
+        use_tls, use_ssl = swiftmailer.encryption == 'tls', swiftmailer.encryption == 'ssl'
+    else:
+        logger.warning("Unknown transport type %r; falling back to the default Django settings.", swiftmailer.transport)
+        return _default_config()
+    return TransportConfig(host, port, swiftmailer.username, swiftmailer.password, use_tls, use_ssl, 10, None, None)
+
+
+def _transport_version():
+    version = cache.get(TRANSPORT_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(TRANSPORT_VERSION_KEY, version, timeout=None)
+        version = cache.get(TRANSPORT_VERSION_KEY, version)
+    return version
+
+
+def _cached(name, load):
+    version = _transport_version()
+    cached = _transport_cache.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    value = load()
+    _transport_cache[name] = (version, value)
+    return value
+
+
+def get_active_transport():
+    """
+    Returns the TransportConfig of the active UvSwiftmailer. It is read from
+    the database once per process and re-read only after a transport, a
+    mailbox or the email settings change, using the same cache version token
+    scheme as the ticket lookups.
+    """
+    def load():
+        email_settings = UvEmailSettings.objects.select_related('active_swiftmailer').first()
+        return transport_config(email_settings.active_swiftmailer if email_settings else None)
+    return _cached('active', load)
+
+
+def get_transport(swiftmailer_id=None):
+    """Returns the TransportConfig of a UvSwiftmailer, or of the active one when it is None or gone."""
+    if swiftmailer_id is None:
+        return get_active_transport()
+    swiftmailer = _cached(f'transport:{swiftmailer_id}', lambda: UvSwiftmailer.objects.filter(pk=swiftmailer_id).first())
+    return transport_config(swiftmailer) if swiftmailer else get_active_transport()
+
+
+def get_mailbox_transport_id(mailbox_email):
+    """
+    Returns the id of the outbound transport of the mailbox receiving at
+    ``mailbox_email``, or None when the active transport should be used.
+    """
+    if not mailbox_email:
+        return None
+    transports = _cached('mailboxes', lambda: {
+        email.lower(): transport_id
+        for email, transport_id in UvMailbox.objects.filter(outbound_transport__isnull=False).values_list('email', 'outbound_transport_id')
+    })
+    return transports.get(mailbox_email.lower())
+
+
+def invalidate_transports():
+    cache.set(TRANSPORT_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    _transport_cache.clear()
+    close_pooled_connections()
+
+
+def _quit(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+def _checkout(config):
+    """Returns an idle connection for ``config`` that still answers, or None."""
+    idle_timeout = getattr(settings, 'EMAIL_POOL_IDLE_TIMEOUT', 300)
+    noop_after = getattr(settings, 'EMAIL_POOL_NOOP_AFTER', 30)
+    while True:
+        with _pool_lock:
+            idle = _pool.get(config)
+            if not idle:
+                return None
+            connection, last_used = idle.pop()
+        idle_for = time.monotonic() - last_used
+        if idle_for > idle_timeout:
+            _quit(connection)
+            continue
+        if idle_for > noop_after:
+            # Servers drop idle sessions; check this one before handing it out
+            try:
+                if connection.noop()[0] != 250:
+                    raise smtplib.SMTPException("NOOP failed")
+            except (smtplib.SMTPException, OSError):
+                _quit(connection)
+                continue
+        return connection
+
+
+def _checkin(config, connection):
+    with _pool_lock:
+        idle = _pool.setdefault(config, [])
+        if len(idle) < getattr(settings, 'EMAIL_POOL_MAX_IDLE', 4):
+            idle.append((connection, time.monotonic()))
+            return
+    _quit(connection)
+
+
+def _slot(config):
+    with _pool_lock:
+        if config not in _slots:
+            _slots[config] = threading.BoundedSemaphore(getattr(settings, 'EMAIL_POOL_MAX_CONNECTIONS', 4))
+        return _slots[config]
+
+
+def close_pooled_connections():
+    with _pool_lock:
+        connections = [connection for idle in _pool.values() for connection, _ in idle]
+        _pool.clear()
+    for connection in connections:
+        _quit(connection)
 
 
 class UvSwiftmailerEmailBackend(EmailBackend):
-    def __init__(self, *args, **kwargs):
+    """
+    SMTP backend using the UvSwiftmailer given as ``transport_id``, or the
+    active one.
+
+    close() hands the authenticated connection back to a per-process pool
+    instead of quitting it, so consecutive sends, and every message of a
+    send_messages() batch, share one SMTP session. Each transport has its own
+    pool and at most EMAIL_POOL_MAX_CONNECTIONS connections in use at once,
+    so a busy transport does not hold up the others.
+    """
+
+    def __init__(self, *args, transport_id=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.connection = None # Ensure connection is not established prematurely by parent
+        self.transport_id = transport_id
+        self.config = None
+        self.slot = None
+        self.broken = False
+
+    def resolve_transport(self):
+        return get_transport(self.transport_id)
 
     def open(self):
         if self.connection:
-            return True
+            return False
 
         try:
-            email_settings = UvEmailSettings.objects.first()
-            if not email_settings or not email_settings.active_swiftmailer:
-                print("UvSwiftmailerEmailBackend: No active swiftmailer configured. Falling back to default Django settings.")
-                self.host = settings.EMAIL_HOST
-                self.port = settings.EMAIL_PORT
-                self.username = settings.EMAIL_HOST_USER
-                self.password = settings.EMAIL_HOST_PASSWORD
-                self.use_tls = settings.EMAIL_USE_TLS
-                self.use_ssl = settings.EMAIL_USE_SSL
-                self.timeout = settings.EMAIL_TIMEOUT
-                self.ssl_keyfile = settings.EMAIL_SSL_KEYFILE
-                self.ssl_certfile = settings.EMAIL_SSL_CERTFILE
-            else:
-                swiftmailer = email_settings.active_swiftmailer
-                print(f"UvSwiftmailerEmailBackend: Using swiftmailer '{swiftmailer.name}' (ID: {swiftmailer.pk})")
-
-                # Set common SMTP settings
-                self.username = swiftmailer.username
-                self.password = swiftmailer.password
-                self.timeout = 10 # Default timeout
-
-                # Handle different transport types
-                if swiftmailer.transport == 'gmail':
-                    self.host = 'smtp.gmail.com'
-                    self.port = 587
-                    self.use_tls = True
-                    self.use_ssl = False
-                elif swiftmailer.transport == 'yahoo':
-                    self.host = 'smtp.mail.yahoo.com'
-                    self.port = 587
-                    self.use_tls = True
-                    self.use_ssl = False
-                elif swiftmailer.transport == 'smtp':
-                    self.host = swiftmailer.host
-                    self.port = swiftmailer.port
-
-                    if swiftmailer.encryption == 'tls':
-                        self.use_tls = True
-                        self.use_ssl = False
-                    elif swiftmailer.encryption == 'ssl':
-                        self.use_tls = False
-                        self.use_ssl = True
-                    else: # 'null' or no encryption
-                        self.use_tls = False
-                        self.use_ssl = False
-                else:
-                    print(f"UvSwiftmailerEmailBackend: Unknown transport type '{swiftmailer.transport}'. Falling back to default Django settings.")
-                    # Fallback to default Django settings if transport type is unknown
-                    self.host = settings.EMAIL_HOST
-                    self.port = settings.EMAIL_PORT
-                    self.username = settings.EMAIL_HOST_USER
-                    self.password = settings.EMAIL_HOST_PASSWORD
-                    self.use_tls = settings.EMAIL_USE_TLS
-                    self.use_ssl = settings.EMAIL_USE_SSL
-
-            print(f"UvSwiftmailerEmailBackend: Attempting connection to {self.host}:{self.port} (TLS: {self.use_tls}, SSL: {self.use_ssl}) with user {self.username}")
-            print(f"UvSwiftmailerEmailBackend: self.fail_silently is {self.fail_silently}")
-            # Establish connection using the determined settings
-            # super().open() will set self.connection internally if successful
+            self.config = self.resolve_transport()
+            (self.host, self.port, self.username, self.password, self.use_tls, self.use_ssl,
+             self.timeout, self.ssl_keyfile, self.ssl_certfile) = self.config
+            self.broken = False
+
+            slot = _slot(self.config)
+            if not slot.acquire(timeout=getattr(settings, 'EMAIL_POOL_WAIT_TIMEOUT', 60)):
+                raise smtplib.SMTPException(f"No free connection to {self.host}:{self.port}.")
+            self.slot = slot
+
+            self.connection = _checkout(self.config)
+            if self.connection:
+                return True
+
+            # No idle connection for this transport: connect, start TLS and log in
             super().open()
-            print(f"UvSwiftmailerEmailBackend: super().open() completed. self.connection is now: {self.connection}")
             if self.connection:
-                print("UvSwiftmailerEmailBackend: Connection established successfully.")
-                return True # Return True to indicate successful opening
-            else:
-                print("UvSwiftmailerEmailBackend: Connection failed, but no exception was raised by super().open().")
-                # If super().open() returns False and fail_silently is False,
-                # it should have raised an exception. Explicitly raise one here
-                # to ensure the outer except block is hit.
-                if not self.fail_silently:
-                    raise smtplib.SMTPException("Failed to connect to SMTP server.")
-                return None
+                return True
+            self._release_slot()
+            if not self.fail_silently:
+                raise smtplib.SMTPException("Failed to connect to SMTP server.")
+            return None
 
-        except Exception as e:
-            print(f"UvSwiftmailerEmailBackend: CRITICAL ERROR - Failed to open email connection: {e}")
+        except Exception:
+            self._release_slot()
+            logger.exception("Failed to open email connection to %s:%s.", self.host, self.port)
             if not self.fail_silently:
                 raise
             return None
+
+    def _release_slot(self):
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        try:
+            if self.broken:
+                _quit(connection)
+            else:
+                _checkin(self.config, connection)
+        finally:
+            self._release_slot()
+
+    def _send(self, email_message):
+        if not email_message.recipients():
+            return False
+        try:
+            sent = super()._send(email_message)
+        except Exception:
+            self.broken = True
+            raise
+        if not sent:
+            # Failed silently; the session may be in an unknown state
+            self.broken = True
+        return sent
+
+    def send_messages(self, email_messages):
+        """
+        Sends ``email_messages`` over one pooled connection and returns how
+        many were sent. With fail_silently, a failed message replaces the
+        connection before the rest of the batch is sent.
+        """
+        if not email_messages:
+            return 0
+        with self._lock:
+            new_conn_created = self.open()
+            if not self.connection or new_conn_created is None:
+                return 0
+            num_sent = 0
+            try:
+                for message in email_messages:
+                    if self.broken:
+                        self.close()
+                        if self.open() is None or not self.connection:
+                            break
+                    if self._send(message):
+                        num_sent += 1
+            finally:
+                if new_conn_created:
+                    self.close()
+        return num_sent
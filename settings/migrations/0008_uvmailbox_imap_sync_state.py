@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('settings', '0007_uvswiftmailer_alter_emailtemplate_options_uvmailbox_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uvmailbox',
+            name='imap_last_uid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='uvmailbox',
+            name='imap_uidvalidity',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
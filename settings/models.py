@@ -123,6 +123,9 @@ class UvMailbox(models.Model):
     imap_username = models.CharField(max_length=191, verbose_name="IMAP Username")
     imap_password = models.CharField(max_length=255, verbose_name="IMAP Password") # Storing as CharField, encryption handled at app level
     outbound_transport = models.ForeignKey(UvSwiftmailer, on_delete=models.SET_NULL, null=True, blank=True, related_name='mailboxes', verbose_name="Outgoing Mail Transport")
+    # Sync state of fetch_emails: messages up to imap_last_uid of this UIDVALIDITY have been processed
+    imap_uidvalidity = models.BigIntegerField(null=True, blank=True, editable=False)
+    imap_last_uid = models.BigIntegerField(default=0, editable=False)
 
     class Meta:
         db_table = "uv_mailbox"
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from .email_backend import invalidate_transports
+from .models import UvSwiftmailer, UvMailbox, UvEmailSettings
+
+
+def invalidate_transport_cache(sender, **kwargs):
+    invalidate_transports()
+
+
+for transport_model in (UvSwiftmailer, UvMailbox, UvEmailSettings):
+    post_save.connect(invalidate_transport_cache, sender=transport_model, dispatch_uid=f'transport_save_{transport_model.__name__}')
+    post_delete.connect(invalidate_transport_cache, sender=transport_model, dispatch_uid=f'transport_delete_{transport_model.__name__}')
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from .constants import ATTACHMENT_DIR
+
+
+def attachment_path(digest):
+    """Path, relative to MEDIA_ROOT, of the stored file whose SHA-256 is ``digest``."""
+    return f'{ATTACHMENT_DIR}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+class AttachmentWriter:
+    """
+    Streams an attachment to a temporary file next to the attachment store
+    while hashing it. save() moves the file to its content-addressed path,
+    or drops it when the same content is already stored, so a file that
+    arrives many times takes up space once.
+    """
+
+    def __init__(self):
+        directory = os.path.join(settings.MEDIA_ROOT, ATTACHMENT_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix='.incoming-', delete=False)
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def save(self):
+        """Stores the file and returns its path relative to MEDIA_ROOT."""
+        self.file.close()
+        path = attachment_path(self.digest.hexdigest())
+        full_path = os.path.join(settings.MEDIA_ROOT, path)
+        if os.path.exists(full_path):
+            os.unlink(self.file.name)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # Atomic, so concurrent writers of the same content leave one complete file
+            os.replace(self.file.name, full_path)
+        return path
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
@@ -66,3 +66,98 @@ EMAIL_TEMPLATES = [
 PRIORITIES = ["low", "high", "medium", "urgent"]
 
 STATUSES = ["open", "pending", "answered", "resolved", "close", "spam"]
+
+TICKET_SIDEBAR_FILTERS = [
+    ("all", "All"),
+    ("new", "New"),
+    ("unassigned", "Unassigned"),
+    ("unanswered", "Unanswered"),
+    ("my_tickets", "My Tickets"),
+    ("starred", "Starred"),
+    ("trashed", "Trashed"),
+]
+
+# Sidebar counts are displayed as "1000+" past this value, so counting stops there
+TICKET_COUNT_THRESHOLD = 1000
+
+TICKET_CHANGE_TYPES = [
+    ("created", "New ticket"),
+    ("status", "Status change"),
+    ("assigned", "Assignment"),
+]
+
+# Ticket event stream timings, in seconds. Streams are closed after a while
+# and resumed by the browser from the last event id it received.
+TICKET_EVENT_POLL_INTERVAL = 2
+TICKET_EVENT_KEEPALIVE_INTERVAL = 15
+TICKET_EVENT_STREAM_DURATION = 300
+# TicketChange ids are taken at insert but become visible at commit, so the
+# stream re-reads skipped ids until they commit or fall this many ids behind;
+# more than a bulk action can write in one transaction
+TICKET_CHANGE_GAP_WINDOW = 5000
+
+# Bulk ticket actions and the privilege each one requires, matching the single-ticket endpoints
+TICKET_BULK_ACTIONS = {
+    "status": "ROLE_AGENT_UPDATE_TICKET_STATUS",
+    "priority": "ROLE_AGENT_UPDATE_TICKET_PRIORITY",
+    "type": "ROLE_AGENT_UPDATE_TICKET_TYPE",
+    "agent": "ROLE_AGENT_ASSIGN_TICKET",
+    "group": "ROLE_AGENT_ASSIGN_TICKET_GROUP",
+    "team": "ROLE_AGENT_ASSIGN_TICKET_GROUP",
+    "tag": "ROLE_AGENT_ADD_TAG",
+    "trash": "ROLE_AGENT_DELETE_TICKET",
+    "restore": "ROLE_AGENT_RESTORE_TICKET",
+}
+
+# Upper bound on the tickets a single bulk action may touch
+TICKET_BULK_ACTION_LIMIT = 1000
+
+# Ticket pages render the latest threads only; older ones are loaded on demand
+THREAD_WINDOW_SIZE = 50
+
+# Status of an email in the outbox; the thread mirrors it in Thread.deliveryStatus
+OUTBOX_STATUSES = [
+    ("pending", "Pending"),
+    ("sent", "Sent"),
+    ("failed", "Failed"),
+]
+
+# Outbox delivery: failed sends are retried after OUTBOX_RETRY_DELAY * 2^(attempt - 1)
+# seconds, capped at OUTBOX_MAX_RETRY_DELAY, and given up after OUTBOX_MAX_ATTEMPTS
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_MAX_RETRY_DELAY = 3600
+# A claimed message is retried after this many seconds if its worker dies mid-send
+OUTBOX_CLAIM_TIMEOUT = 300
+# Transports (mailbox relays) a single outbox batch sends through in parallel
+OUTBOX_MAX_WORKERS = 6
+
+# fetch_emails: messages fetched per batch (the mailbox's last processed UID is
+# saved after each), and how many of the latest messages to take from a mailbox
+# seen for the first time or whose UIDVALIDITY changed
+IMAP_FETCH_BATCH_SIZE = 50
+IMAP_INITIAL_MESSAGES = 10
+# Most bytes of message bodies fetch_emails holds in memory per fetch; a larger message is fetched on its own
+IMAP_FETCH_BATCH_BYTES = 20 * 1024 * 1024
+# Seconds a mailbox may take per fetch_emails run, and the IMAP socket timeout
+IMAP_MAILBOX_TIMEOUT = 120
+# fetch_emails --daemon: IDLE is re-issued before servers may drop it (RFC 2177 allows 29 minutes),
+# NOOP polling is used on servers without IDLE, and failed connections are retried with backoff
+IMAP_IDLE_TIMEOUT = 25 * 60
+IMAP_POLL_INTERVAL = 30
+IMAP_RECONNECT_DELAY = 5
+IMAP_MAX_RECONNECT_DELAY = 300
+IMAP_RELOAD_INTERVAL = 30
+# Incoming email attachments are stored under MEDIA_ROOT/ATTACHMENT_DIR by SHA-256,
+# and messages are parsed in lines of at most EMAIL_PARSE_CHUNK_SIZE bytes
+ATTACHMENT_DIR = 'attachments'
+EMAIL_PARSE_CHUNK_SIZE = 64 * 1024
+# Stages of email ingestion, in order; fetch_emails times each one, and a message
+# that fails in one is kept as a FailedEmail for the replay_failed_emails command
+INGESTION_STAGES = [
+    ("fetch", "Fetch"),
+    ("parse", "Parse"),
+    ("resolve", "Resolve"),
+    ("persist", "Persist"),
+    ("flag", "Flag"),
+]
@@ -0,0 +1,216 @@
+import binascii
+import re
+from collections import namedtuple
+from email.feedparser import BytesFeedParser
+from email.header import decode_header, make_header
+
+from .attachments import AttachmentWriter
+from .constants import EMAIL_PARSE_CHUNK_SIZE
+
+# An attachment written to the attachment store; the fields are those of the Attachment model
+StoredAttachment = namedtuple('StoredAttachment', ['name', 'path', 'contentType', 'size', 'contentId'])
+# The text and the stored attachments of a message body
+ParsedBody = namedtuple('ParsedBody', ['plain', 'html', 'attachments'])
+
+
+class _Lines:
+    """Lines of a binary file, each at most EMAIL_PARSE_CHUNK_SIZE bytes, with one line of push-back."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pushed = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pushed is not None:
+            line, self.pushed = self.pushed, None
+            return line
+        line = self.fp.readline(EMAIL_PARSE_CHUNK_SIZE)
+        if not line:
+            raise StopIteration
+        return line
+
+    def push(self, line):
+        self.pushed = line
+
+
+class _Base64Decoder:
+    """Decodes base64 fed in arbitrary pieces, holding back an incomplete quantum."""
+
+    def __init__(self):
+        self.pending = b''
+
+    def __call__(self, data):
+        data = self.pending + re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+        usable = len(data) // 4 * 4
+        self.pending = data[usable:]
+        try:
+            return binascii.a2b_base64(data[:usable])
+        except binascii.Error:
+            return b''
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        if not data:
+            return b''
+        try:
+            return binascii.a2b_base64(data + b'=' * (-len(data) % 4))
+        except binascii.Error:
+            return b''
+
+
+class _LineDecoder:
+    """Decodes quoted-printable whole lines, or passes 7bit, 8bit and binary data through."""
+
+    def __init__(self, quoted_printable):
+        self.quoted_printable = quoted_printable
+
+    def __call__(self, data):
+        return binascii.a2b_qp(data) if self.quoted_printable else data
+
+    def flush(self):
+        return b''
+
+
+def _read_headers(lines):
+    parser = BytesFeedParser()
+    for line in lines:
+        parser.feed(line)
+        if line in (b'\r\n', b'\n'):
+            break
+    return parser.close()
+
+
+def read_headers(fp):
+    """
+    Reads the header block at the current position of the binary file
+    ``fp`` and returns it as a Message without payload, leaving ``fp`` at the
+    start of the body for parse_body().
+    """
+    return _read_headers(_Lines(fp))
+
+
+def _delimiter(line, boundaries):
+    """Returns (index in ``boundaries``, closing) when ``line`` is a multipart delimiter, innermost first."""
+    if not line.startswith(b'--'):
+        return None
+    for index in range(len(boundaries) - 1, -1, -1):
+        if line.startswith(boundaries[index]):
+            rest = line[len(boundaries[index]):].rstrip()
+            if rest in (b'', b'--'):
+                return index, rest == b'--'
+    return None
+
+
+def _next_delimiter(lines, boundaries):
+    """Skips to the next delimiter; one of an enclosing multipart is pushed back for it to handle."""
+    for line in lines:
+        found = _delimiter(line, boundaries)
+        if found:
+            if found[0] < len(boundaries) - 1:
+                lines.push(line)
+            return found
+    return None
+
+
+def _read_payload(headers, lines, boundaries, write):
+    """
+    Decodes the payload of a single part into ``write``, in pieces of about
+    EMAIL_PARSE_CHUNK_SIZE bytes, and stops at the delimiter that ends it.
+    """
+    encoding = str(headers.get('Content-Transfer-Encoding', '')).strip().lower()
+    decode = _Base64Decoder() if encoding == 'base64' else _LineDecoder(encoding == 'quoted-printable')
+    chunk, chunk_size = [], 0
+    previous = None
+    for line in lines:
+        if boundaries and _delimiter(line, boundaries):
+            lines.push(line)
+            # The line break before a delimiter belongs to the delimiter
+            if previous is not None:
+                previous = previous.rstrip(b'\r\n')
+            break
+        if previous is not None:
+            chunk.append(previous)
+            chunk_size += len(previous)
+            if chunk_size >= EMAIL_PARSE_CHUNK_SIZE:
+                write(decode(b''.join(chunk)))
+                chunk, chunk_size = [], 0
+        previous = line
+    if previous is not None:
+        chunk.append(previous)
+    write(decode(b''.join(chunk)))
+    write(decode.flush())
+
+
+def _filename(headers):
+    name = headers.get_filename()
+    if not name:
+        return None
+    try:
+        return str(make_header(decode_header(name)))
+    except Exception:
+        return name
+
+
+def _read_part(headers, lines, boundaries, body):
+    content_type = headers.get_content_type()
+    if headers.get_content_maintype() == 'multipart' and headers.get_boundary():
+        _read_multipart(headers, lines, boundaries, body)
+        return
+
+    disposition = str(headers.get('Content-Disposition'))
+    if content_type in ('text/plain', 'text/html') and 'attachment' not in disposition:
+        chunks = []
+        _read_payload(headers, lines, boundaries, chunks.append)
+        data = b''.join(chunks)
+        try:
+            text = data.decode(headers.get_content_charset() or 'utf-8')
+        except (LookupError, UnicodeDecodeError):
+            text = data.decode('latin-1', errors='ignore')
+        body['html' if content_type == 'text/html' else 'plain'] = text
+        return
+
+    writer = AttachmentWriter()
+    try:
+        _read_payload(headers, lines, boundaries, writer.write)
+    except Exception:
+        writer.discard()
+        raise
+    if not writer.size:
+        writer.discard()
+        return
+    content_id = headers.get('Content-ID')
+    body['attachments'].append(StoredAttachment(
+        _filename(headers), writer.save(), content_type, writer.size,
+        str(content_id).strip().strip('<>') if content_id else None,
+    ))
+
+
+def _read_multipart(headers, lines, boundaries, body):
+    boundaries = boundaries + [b'--' + headers.get_boundary().encode('ascii', 'surrogateescape')]
+    depth = len(boundaries) - 1
+    found = _next_delimiter(lines, boundaries)  # Skips the preamble
+    while found == (depth, False):
+        _read_part(_read_headers(lines), lines, boundaries, body)
+        found = _next_delimiter(lines, boundaries)
+    if found == (depth, True) and depth:
+        # Skip the epilogue up to the next delimiter of an enclosing multipart
+        for line in lines:
+            if _delimiter(line, boundaries[:-1]):
+                lines.push(line)
+                break
+
+
+def parse_body(headers, fp):
+    """
+    Reads the body of a message from ``fp`` after read_headers() returned
+    its ``headers``. MIME parts are decoded as they are read: text parts are
+    returned, the last of each type winning, and every other part, or one
+    sent as an attachment, is streamed to the attachment store. Memory use
+    does not grow with the size of attachments.
+    """
+    body = {'plain': None, 'html': None, 'attachments': []}
+    _read_part(headers, _Lines(fp), [], body)
+    return ParsedBody(body['plain'], body['html'], body['attachments'])
@@ -3,7 +3,12 @@ from django.template.loader import render_to_string
 from django.conf import settings
 from django.urls import reverse
 from ticket.models import Thread # Import Thread model
-import uuid # Added this import
+from ticket.message_ids import get_reply_headers
+from ticket.outbox import queue_email
+
+# Emails are written to the outbox in the caller's transaction and delivered
+# by the process_outbox command, so a slow or unreachable SMTP server never
+# holds up a request or loses a reply whose thread was saved.
 
 def send_reply_email(ticket, thread, send_to_collaborators_cc_bcc=False):
     subject = f"Reply to your ticket #{ticket.id}: {ticket.subject}"
@@ -32,22 +37,8 @@ def send_reply_email(ticket, thread, send_to_collaborators_cc_bcc=False):
     bcc_recipients = list(set(bcc_recipients))
 
     # --- Threading Headers ---
-    headers = {}
-    # Get all message IDs for this ticket to build References header
-    all_thread_message_ids = [
-        t.messageId for t in ticket.threads.all().order_by('createdAt') if t.messageId
-    ]
-
-    # Find the Message-ID of the last incoming email to set In-Reply-To
-    last_incoming_thread = ticket.threads.filter(threadType='incoming_email').order_by('-createdAt').first()
-    if last_incoming_thread and last_incoming_thread.messageId:
-        headers['In-Reply-To'] = last_incoming_thread.messageId
-        # Ensure the last incoming message ID is in references
-        if last_incoming_thread.messageId not in all_thread_message_ids:
-            all_thread_message_ids.append(last_incoming_thread.messageId)
-
-    if all_thread_message_ids:
-        headers['References'] = ' '.join(all_thread_message_ids)
+    # The reply's own Message-ID was set on the thread when it was created
+    headers = get_reply_headers(ticket, thread.messageId)
     # --- End Threading Headers ---
 
     email = EmailMessage(
@@ -61,13 +52,7 @@ def send_reply_email(ticket, thread, send_to_collaborators_cc_bcc=False):
     )
     email.content_subtype = "html"
 
-    try:
-        email.send(fail_silently=False)
-        print(f"Email sent for ticket {ticket.id} to {to_recipients}, CC: {cc_recipients}, BCC: {bcc_recipients}")
-    except Exception as e:
-        print(f"Failed to send email for ticket {ticket.id}: {e}")
-
-        # Log the error or handle it appropriately
+    queue_email(thread, email)
 
 def send_forward_email(ticket, thread, to_email_addresses, subject):
     html_message = thread.message # The message from the forward form
@@ -82,12 +67,7 @@ def send_forward_email(ticket, thread, to_email_addresses, subject):
     )
     email.content_subtype = "html"
 
-    try:
-        email.send(fail_silently=False)
-        print(f"Forward email sent for ticket {ticket.id} to {to_recipients}")
-    except Exception as e:
-        print(f"Failed to send forward email for ticket {ticket.id}: {e}")
-        raise # Re-raise the exception so the view can catch it and display a message
+    queue_email(thread, email)
 
 def send_initial_ticket_email(ticket, initial_thread):
     subject = ticket.subject
@@ -95,8 +75,8 @@ def send_initial_ticket_email(ticket, initial_thread):
 
     to_recipients = [ticket.customer.user.email]
 
-    # Generate a unique Message-ID
-    message_id = f"<{uuid.uuid4()}@{settings.EMAIL_HOST.split(':')[-1]}>" # Use EMAIL_HOST for domain
+    # The Message-ID was generated when the thread was created
+    message_id = initial_thread.messageId
 
     headers = {'Message-ID': message_id}
 
@@ -109,10 +89,5 @@ def send_initial_ticket_email(ticket, initial_thread):
     )
     email.content_subtype = "html"
 
-    try:
-        email.send(fail_silently=False)
-        print(f"Initial ticket email sent for ticket {ticket.id} to {to_recipients} with Message-ID: {message_id}")
-        return message_id # Return the generated Message-ID
-    except Exception as e:
-        print(f"Failed to send initial ticket email for ticket {ticket.id}: {e}")
-        raise # Re-raise the exception so the view can catch it and display a message
+    queue_email(initial_thread, email)
+    return message_id # Return the generated Message-ID
@@ -1,6 +1,6 @@
 from django import forms
-from .models import Workflow, TicketType, Tag, SavedReplies, PreparedResponse, Thread, TicketStatus, TicketPriority, SupportLabel
-from authentication.models import SupportGroup, SupportTeam
+from .models import Workflow, TicketType, Tag, SavedReplies, PreparedResponse, Thread, SupportLabel
+from .lookups import LookupChoiceField, LookupMultipleChoiceField, use_lookup
 import re
 
 class WorkflowForm(forms.ModelForm):
@@ -66,14 +66,14 @@ class SupportLabelForm(forms.ModelForm):
         }
 
 class SavedReplyForm(forms.ModelForm):
-    groups = forms.ModelMultipleChoiceField(
-        queryset=SupportGroup.objects.all(),
+    groups = LookupMultipleChoiceField(
+        'groups',
         required=False,
         widget=forms.CheckboxSelectMultiple,
         label="Groups"
     )
-    teams = forms.ModelMultipleChoiceField(
-        queryset=SupportTeam.objects.all(),
+    teams = LookupMultipleChoiceField(
+        'teams',
         required=False,
         widget=forms.CheckboxSelectMultiple,
         label="Teams"
@@ -91,14 +91,14 @@ class SavedReplyForm(forms.ModelForm):
         }
 
 class PreparedResponseForm(forms.ModelForm):
-    groups = forms.ModelMultipleChoiceField(
-        queryset=SupportGroup.objects.all(),
+    groups = LookupMultipleChoiceField(
+        'groups',
         required=False,
         widget=forms.CheckboxSelectMultiple,
         label="Groups"
     )
-    teams = forms.ModelMultipleChoiceField(
-        queryset=SupportTeam.objects.all(),
+    teams = LookupMultipleChoiceField(
+        'teams',
         required=False,
         widget=forms.CheckboxSelectMultiple,
         label="Teams"
@@ -114,7 +114,7 @@ class PreparedResponseForm(forms.ModelForm):
         }
 
 class ThreadForm(forms.ModelForm):
-    status = forms.ModelChoiceField(queryset=TicketStatus.objects.all(), required=False)
+    status = LookupChoiceField('statuses', required=False)
     send_to_collaborators_cc_bcc = forms.BooleanField(
         label="Send to Collaborators (CC/BCC)",
         required=False,
@@ -129,7 +129,7 @@ class ThreadForm(forms.ModelForm):
         }
 
 class NoteForm(forms.ModelForm):
-    status = forms.ModelChoiceField(queryset=TicketStatus.objects.all(), required=False)
+    status = LookupChoiceField('statuses', required=False)
 
     class Meta:
         model = Thread
@@ -142,7 +142,7 @@ class ForwardForm(forms.Form):
     to = forms.EmailField(widget=forms.EmailInput(attrs={'class': 'form-control', 'placeholder': 'To'}))
     subject = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Subject'}))
     message = forms.CharField(widget=forms.Textarea(attrs={'class': 'form-control summernote', 'rows': 5, 'placeholder': 'Enter your message...'}))
-    status = forms.ModelChoiceField(queryset=TicketStatus.objects.all(), required=False)
+    status = LookupChoiceField('statuses', required=False)
 
 class CollaboratorForm(forms.Form):
     emails = forms.CharField(
@@ -169,7 +169,6 @@ class CollaboratorForm(forms.Form):
 
 
 from .models import Ticket # Import Ticket model
-from authentication.models import UserInstance, SupportGroup, SupportTeam, User # Import UserInstance for customer/agent selection
 
 class TicketForm(forms.ModelForm):
     # Custom field for customer email, as customer is a UserInstance
@@ -206,12 +205,12 @@ class TicketForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Populate choices for agent, status, priority, type, group, team
-        self.fields['agent'].queryset = UserInstance.objects.filter(supportRole__code='ROLE_AGENT')
-        self.fields['status'].queryset = TicketStatus.objects.all()
-        self.fields['priority'].queryset = TicketPriority.objects.all()
-        self.fields['type'].queryset = TicketType.objects.all()
-        self.fields['supportGroup'].queryset = SupportGroup.objects.all()
-        self.fields['supportTeam'].queryset = SupportTeam.objects.all()
+        use_lookup(self.fields['agent'], 'agents')
+        use_lookup(self.fields['status'], 'statuses')
+        use_lookup(self.fields['priority'], 'priorities')
+        use_lookup(self.fields['type'], 'ticket_types')
+        use_lookup(self.fields['supportGroup'], 'groups')
+        use_lookup(self.fields['supportTeam'], 'teams')
 
         # Make agent, group, team optional with a blank choice
         self.fields['agent'].empty_label = "Unassigned"
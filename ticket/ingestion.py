@@ -0,0 +1,90 @@
+import io
+import threading
+import time
+from contextlib import contextmanager
+
+from django.utils import timezone
+from .constants import INGESTION_STAGES
+from .email_parser import read_headers
+from .models import FailedEmail
+
+
+class StageFailed(Exception):
+    """A message could not be ingested; ``stage`` is where, and the cause is chained."""
+
+    def __init__(self, stage, error):
+        super().__init__(f'{stage} failed: {error}')
+        self.stage = stage
+        self.error = str(error) or error.__class__.__name__
+
+
+class IngestionStats:
+    """
+    Messages handled, failures and time spent per ingestion stage, added up
+    across the threads of one run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages = {stage: 0 for stage, _ in INGESTION_STAGES}
+        self.failures = {stage: 0 for stage, _ in INGESTION_STAGES}
+        self.seconds = {stage: 0.0 for stage, _ in INGESTION_STAGES}
+
+    @contextmanager
+    def stage(self, name, messages=1):
+        """Times the block as ``messages`` messages going through stage ``name``."""
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.add(name, messages, time.perf_counter() - started, failed)
+
+    def add(self, name, messages, seconds, failures=0):
+        """Records ``messages`` messages having taken ``seconds`` in stage ``name``."""
+        with self._lock:
+            self.messages[name] += messages
+            self.failures[name] += failures
+            self.seconds[name] += seconds
+
+    def report(self):
+        """Returns the lines of a table with the counts, total seconds and milliseconds per message of each stage."""
+        lines = [f'{"Stage":<10}{"Messages":>10}{"Failed":>8}{"Seconds":>10}{"ms/message":>12}']
+        for stage, _ in INGESTION_STAGES:
+            messages, seconds = self.messages[stage], self.seconds[stage]
+            per_message = f'{seconds * 1000 / messages:.2f}' if messages else '-'
+            lines.append(f'{stage:<10}{messages:>10}{self.failures[stage]:>8}{seconds:>10.2f}{per_message:>12}')
+        return lines
+
+
+def dead_letter(mailbox_email, raw_message, internaldate, failure, failed_email=None):
+    """
+    Keeps a message that failed ingestion, raw, as a FailedEmail, or records
+    another failed attempt on ``failed_email`` when it was being replayed.
+    """
+    if failed_email is not None:
+        failed_email.stage = failure.stage
+        failed_email.error = failure.error
+        failed_email.attempts += 1
+        failed_email.lastAttemptAt = timezone.now()
+        failed_email.save(update_fields=['stage', 'error', 'attempts', 'lastAttemptAt'])
+        return failed_email
+
+    try:
+        headers = read_headers(io.BytesIO(raw_message))
+        message_id, subject = headers['Message-ID'], headers['Subject']
+    except Exception:
+        # The headers may be what failed to parse
+        message_id = subject = None
+    return FailedEmail.objects.create(
+        mailboxEmail=mailbox_email,
+        messageId=str(message_id) if message_id else None,
+        subject=str(subject) if subject else None,
+        stage=failure.stage,
+        error=failure.error,
+        rawMessage=raw_message,
+        internalDate=internaldate.decode(errors='replace') if isinstance(internaldate, bytes) else internaldate,
+    )
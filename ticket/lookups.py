@@ -0,0 +1,111 @@
+import uuid
+
+from django import forms
+from django.core.cache import cache
+from authentication.models import User, UserInstance, SupportRole, SupportGroup, SupportTeam
+from .models import TicketStatus, TicketPriority, TicketType, Tag
+
+# Reference data that changes a few times a month but is read on almost every
+# page: name -> (queryset factory, models whose changes invalidate it)
+LOOKUPS = {
+    'statuses': (lambda: TicketStatus.objects.order_by('sortOrder', 'id'), [TicketStatus]),
+    'priorities': (lambda: TicketPriority.objects.order_by('id'), [TicketPriority]),
+    'ticket_types': (lambda: TicketType.objects.order_by('id'), [TicketType]),
+    'tags': (lambda: Tag.objects.order_by('id'), [Tag]),
+    'groups': (lambda: SupportGroup.objects.order_by('id'), [SupportGroup]),
+    'teams': (lambda: SupportTeam.objects.order_by('id'), [SupportTeam]),
+    'agents': (
+        lambda: UserInstance.objects.filter(supportRole__code='ROLE_AGENT').select_related('user').order_by('id'),
+        [UserInstance, User, SupportRole],
+    ),
+}
+
+# Rows cached by this process: name -> (version, rows)
+_local_cache = {}
+
+
+def _version_key(name):
+    return f'uv_lookup_version:{name}'
+
+
+def get_lookup(name):
+    """
+    Returns the rows of a lookup as a list, loading them from the database only
+    when another process (or this one) has changed the underlying tables.
+
+    Rows are kept in process memory. Freshness is checked against a version
+    token in the Django cache, so invalidation reaches every process that
+    shares the cache backend. The returned instances are shared: do not
+    modify them.
+    """
+    version = cache.get(_version_key(name))
+    if version is None:
+        # First use, or the token was evicted: start a new version
+        version = uuid.uuid4().hex
+        cache.add(_version_key(name), version, timeout=None)
+        version = cache.get(_version_key(name), version)
+    cached = _local_cache.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    rows = list(LOOKUPS[name][0]())
+    _local_cache[name] = (version, rows)
+    return rows
+
+
+def get_lookup_queryset(name):
+    return LOOKUPS[name][0]()
+
+
+def invalidate_lookup(name):
+    cache.set(_version_key(name), uuid.uuid4().hex, timeout=None)
+    _local_cache.pop(name, None)
+
+
+def invalidate_lookups_for(model):
+    for name, (_, models) in LOOKUPS.items():
+        if model in models:
+            invalidate_lookup(name)
+
+
+class LookupChoiceIterator(forms.models.ModelChoiceIterator):
+    """Renders a model choice field's options from a lookup instead of its queryset."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in get_lookup(self.field.lookup):
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(get_lookup(self.field.lookup)) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(get_lookup(self.field.lookup))
+
+
+def use_lookup(field, name):
+    """
+    Makes a ModelChoiceField or ModelMultipleChoiceField render its options
+    from the ``name`` lookup. Submitted values are still validated against
+    the database.
+    """
+    field.lookup = name
+    field.iterator = LookupChoiceIterator
+    field.queryset = get_lookup_queryset(name)
+    return field
+
+
+class LookupChoiceField(forms.ModelChoiceField):
+    iterator = LookupChoiceIterator
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(queryset=get_lookup_queryset(lookup), **kwargs)
+
+
+class LookupMultipleChoiceField(forms.ModelMultipleChoiceField):
+    iterator = LookupChoiceIterator
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(queryset=get_lookup_queryset(lookup), **kwargs)
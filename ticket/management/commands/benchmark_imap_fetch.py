@@ -0,0 +1,189 @@
+import imaplib
+import socketserver
+import threading
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from settings.models import UvMailbox
+
+
+class FakeImapMailbox:
+    """An in-memory inbox plus a log of the commands clients sent to it."""
+
+    def __init__(self, messages):
+        self.messages = [[uid, raw, set()] for uid, raw in enumerate(messages, 1)]
+        self.commands = []
+
+
+def _uid_set(spec, uids):
+    highest = uids[-1] if uids else 0
+    wanted = set()
+    for part in spec.split(','):
+        first, _, last = part.partition(':')
+        first = highest if first == '*' else int(first)
+        last = first if not last else highest if last == '*' else int(last)
+        wanted.update(range(min(first, last), max(first, last) + 1))
+    return wanted
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    """Answers the subset of IMAP4rev1 that fetch_emails uses, after ``latency`` seconds per command."""
+
+    disable_nagle_algorithm = True
+
+    def write(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode())
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.write('* OK Fake IMAP ready\r\n')
+        for line in self.rfile:
+            tag, _, command = line.decode().strip().partition(' ')
+            name, _, args = command.partition(' ')
+            name = name.upper()
+            mailbox.commands.append(command)
+            time.sleep(self.server.latency)
+            if name == 'UID':
+                name, _, args = args.partition(' ')
+                name = f'UID {name.upper()}'
+            if name == 'CAPABILITY':
+                self.write('* CAPABILITY IMAP4rev1\r\n')
+            elif name in ('SELECT', 'EXAMINE'):
+                self.write(f'* {len(mailbox.messages)} EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n')
+            elif name == 'SEARCH':
+                self.write('* SEARCH' + ''.join(f' {seq}' for seq in range(1, len(mailbox.messages) + 1)) + '\r\n')
+            elif name == 'UID SEARCH':
+                uids = [message[0] for message in mailbox.messages]
+                if args.upper().startswith('UID '):
+                    wanted = _uid_set(args[4:], uids)
+                    uids = [uid for uid in uids if uid in wanted]
+                self.write('* SEARCH' + ''.join(f' {uid}' for uid in uids) + '\r\n')
+            elif name in ('FETCH', 'UID FETCH'):
+                self.fetch(name, args)
+            elif name in ('STORE', 'UID STORE'):
+                self.store(name, args)
+            elif name in ('EXPUNGE', 'CLOSE'):
+                mailbox.messages = [message for message in mailbox.messages if '\\Deleted' not in message[2]]
+            elif name == 'LOGOUT':
+                self.write(f'* BYE\r\n{tag} OK LOGOUT completed\r\n')
+                return
+            self.write(f'{tag} OK {name} completed\r\n')
+
+    def _select(self, name, spec):
+        messages = self.server.mailbox.messages
+        if name.startswith('UID'):
+            wanted = _uid_set(spec, [message[0] for message in messages])
+            return [(seq, message) for seq, message in enumerate(messages, 1) if message[0] in wanted]
+        wanted = _uid_set(spec, list(range(1, len(messages) + 1)))
+        return [(seq, message) for seq, message in enumerate(messages, 1) if seq in wanted]
+
+    def fetch(self, name, args):
+        spec, _, items = args.partition(' ')
+        items = items.upper()
+        for seq, (uid, raw, flags) in self._select(name, spec):
+            fields = [f'UID {uid}']
+            if 'INTERNALDATE' in items:
+                fields.append('INTERNALDATE "01-Jan-2024 12:00:00 +0000"')
+            if 'RFC822.SIZE' in items:
+                fields.append(f'RFC822.SIZE {len(raw)}')
+            if 'BODY' in items or 'RFC822' in items.replace('RFC822.SIZE', ''):
+                label = 'BODY[]' if 'BODY' in items else 'RFC822'
+                self.write(f'* {seq} FETCH ({" ".join(fields)} {label} {{{len(raw)}}}\r\n')
+                self.write(raw)
+                self.write(')\r\n')
+            else:
+                self.write(f'* {seq} FETCH ({" ".join(fields)})\r\n')
+
+    def store(self, name, args):
+        spec, _, flags = args.partition(' ')
+        for seq, message in self._select(name, spec):
+            if '\\Deleted' in flags:
+                message[2].add('\\Deleted')
+            self.write(f'* {seq} FETCH (FLAGS ({" ".join(message[2])}))\r\n')
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox, latency):
+        super().__init__(('127.0.0.1', 0), FakeImapHandler)
+        self.mailbox = mailbox
+        self.latency = latency
+
+
+def _message(index):
+    return (
+        f'From: Benchmark Customer {index} <benchmark-{index}@example.com>\r\n'
+        f'To: support@example.com\r\nSubject: Benchmark message {index}\r\n'
+        f'Message-ID: <benchmark-{index}@example.com>\r\nContent-Type: text/plain\r\n\r\n'
+        f'Message body {index}\r\n'
+    ).encode()
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures IMAP round trips per message of fetch_emails against an in-process fake IMAP server, '
+        'compared with fetching and deleting each message separately. All created rows are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help='Number of messages in the fake inbox.')
+        parser.add_argument('--batch-size', type=int, default=50, help='fetch_emails batch size.')
+        parser.add_argument('--latency', type=float, default=5, help='Simulated round-trip time per IMAP command, in milliseconds.')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        latency = options['latency'] / 1000
+
+        per_message = self._serve(count, latency, self._fetch_per_message)
+        batched = self._serve(count, latency, lambda port: self._fetch_emails(port, count, options['batch_size']))
+
+        for label, (commands, elapsed) in (('Per message', per_message), ('fetch_emails', batched)):
+            self.stdout.write(self.style.SUCCESS(
+                f'{label + ":":<14}{len(commands):>6} commands, {len(commands) / count:.2f} round trips/message, '
+                f'{elapsed * 1000:.0f} ms'
+            ))
+
+    def _serve(self, count, latency, run):
+        mailbox = FakeImapMailbox([_message(index) for index in range(count)])
+        server = FakeImapServer(mailbox, latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            started = time.perf_counter()
+            run(server.server_address[1])
+            return mailbox.commands, time.perf_counter() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _fetch_per_message(self, port):
+        # The access pattern fetch_emails had before batching
+        mail = imaplib.IMAP4('127.0.0.1', port)
+        mail.login('benchmark', 'benchmark')
+        mail.select('inbox')
+        status, data = mail.search(None, 'ALL')
+        # Newest first, so expunging keeps the remaining sequence numbers valid
+        for email_id in reversed(data[0].split()):
+            mail.fetch(email_id, '(RFC822)')
+            mail.fetch(email_id, '(INTERNALDATE)')
+            mail.store(email_id, '+FLAGS', '\\Deleted')
+            mail.expunge()
+        mail.logout()
+
+    def _fetch_emails(self, port, count, batch_size):
+        with transaction.atomic():
+            UvMailbox.objects.update(is_enabled=False)
+            UvMailbox.objects.create(
+                name='Benchmark', email='support@example.com', imap_host='127.0.0.1', imap_port=port,
+                imap_encryption='null', imap_username='benchmark', imap_password='benchmark',
+                delete_after_fetch=True,
+            )
+            output = StringIO()
+            call_command('fetch_emails', batch_size=batch_size, initial_messages=count, stdout=output)
+            if 'Error' in output.getvalue():
+                self.stderr.write(output.getvalue())
+            transaction.set_rollback(True)
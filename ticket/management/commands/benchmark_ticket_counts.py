@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from authentication.models import User, UserInstance, SupportRole
+from ticket.models import Ticket, TicketStatus, SupportLabel, TicketLabelsThrough
+from ticket.services import bounded_counts, get_ticket_count_buckets
+
+
+class Command(BaseCommand):
+    help = 'Compares exact and bounded ticket sidebar counts on a seeded dataset. All seeded rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=20000, help='Number of tickets to seed.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per strategy.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            agent_user = self._seed(options['tickets'])
+            buckets = get_ticket_count_buckets(Ticket.objects.all(), agent_user)[2]
+
+            exact, exact_queries, exact_time = self._measure(
+                lambda: {key: queryset.count() for key, queryset in buckets.items()}, options['repeat']
+            )
+            bounded, bounded_queries, bounded_time = self._measure(lambda: bounded_counts(buckets), options['repeat'])
+
+            self.stdout.write(f"{'bucket':<20}{'exact':>10}{'bounded':>10}")
+            for key in buckets:
+                self.stdout.write(f'{key:<20}{exact[key]:>10}{bounded[key]:>10}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Exact counts:   {exact_time * 1000:.1f} ms/run, {exact_queries} queries/run'
+            ))
+            self.stdout.write(self.style.SUCCESS(
+                f'Bounded counts: {bounded_time * 1000:.1f} ms/run, {bounded_queries} queries/run'
+            ))
+
+            transaction.set_rollback(True)
+
+    def _seed(self, ticket_count):
+        agent_role, _ = SupportRole.objects.get_or_create(code='ROLE_AGENT')
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        agent_user = User.objects.create(email='benchmark-agent@example.com', firstName='Benchmark')
+        agent = UserInstance.objects.create(user=agent_user, source='benchmark', supportRole=agent_role)
+        customer_user = User.objects.create(email='benchmark-customer@example.com', firstName='Benchmark')
+        customer = UserInstance.objects.create(user=customer_user, source='benchmark', supportRole=customer_role)
+        label = SupportLabel.objects.create(name='Benchmark', user=agent)
+        statuses = list(TicketStatus.objects.all()) or [TicketStatus.objects.create(code='benchmark')]
+
+        rng = random.Random(0)
+        tickets = Ticket.objects.bulk_create([
+            Ticket(
+                subject=f'Benchmark ticket {i}',
+                source='benchmark',
+                customer=customer,
+                agent=agent if rng.random() < 0.3 else None,
+                status=rng.choice(statuses),
+                is_new=rng.random() < 0.2,
+                isReplied=rng.random() < 0.6,
+                isStarred=rng.random() < 0.05,
+                isTrashed=rng.random() < 0.01,
+            )
+            for i in range(ticket_count)
+        ], batch_size=1000)
+        TicketLabelsThrough.objects.bulk_create([
+            TicketLabelsThrough(ticket=ticket, label=label) for ticket in tickets if rng.random() < 0.1
+        ], batch_size=1000)
+
+        self.stdout.write(f'Seeded {ticket_count} tickets.')
+        return agent_user
+
+    def _measure(self, run, repeat):
+        result = run()  # Warm up caches before timing
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                result = run()
+            elapsed = time.perf_counter() - started
+        return result, len(queries.captured_queries) // repeat, elapsed / repeat
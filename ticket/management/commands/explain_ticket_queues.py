@@ -0,0 +1,87 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from authentication.models import User, UserInstance
+from ticket.constants import TICKET_SIDEBAR_FILTERS, TICKET_COUNT_THRESHOLD
+from ticket.models import Ticket, TicketStatus
+from ticket.services import get_ticket_filter_q, get_ticket_rows
+
+# PostgreSQL: "Index Scan using x", "Index Only Scan using x", "Bitmap Index Scan on x"
+# SQLite: "SEARCH uv_ticket USING INDEX x", "SCAN uv_ticket USING COVERING INDEX x"
+INDEX_PATTERN = re.compile(r'(?:Index(?: Only)? Scan using|Bitmap Index Scan on|USING (?:COVERING )?INDEX)\s+"?(\w+)')
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on every ticket queue query and reports whether it is served by an index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agent-email', help='Agent used for the "My Tickets" queue. Defaults to the first agent.')
+        parser.add_argument('--customer-id', type=int, help='Explain the queues as filtered for this customer user id.')
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (PostgreSQL only).')
+        parser.add_argument('--show-plans', action='store_true', help='Print the full plan of every query.')
+        parser.add_argument('--fail-on-seq-scan', action='store_true', help='Exit with an error if any query does not use an index.')
+
+    def handle(self, *args, **options):
+        agent_user = self._get_agent_user(options['agent_email'])
+
+        queues = {}
+        base = Ticket.objects.all()
+        if options['customer_id']:
+            base = base.filter(customer__user__id=options['customer_id'])
+        for key, _ in TICKET_SIDEBAR_FILTERS:
+            queues[key] = base.filter(get_ticket_filter_q(key, agent_user))
+        for status in TicketStatus.objects.all().order_by('sortOrder'):
+            queues[f'status:{status.code}'] = base.filter(status=status)
+            queues[f'not_trashed+status:{status.code}'] = base.filter(isTrashed=False, status=status)
+
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze is only supported on PostgreSQL.')
+            explain_options['analyze'] = True
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Ticket._meta.db_table)
+        ticket_indexes = {name for name, info in constraints.items() if info['index'] or info['primary_key']}
+
+        missing = []
+        for name, queryset in queues.items():
+            statements = {
+                'list': get_ticket_rows(queryset).order_by('-createdAt', '-id')[:100],
+                'count': queryset.order_by().values('pk')[:TICKET_COUNT_THRESHOLD + 1],
+            }
+            for kind, statement in statements.items():
+                plan = statement.explain(**explain_options)
+                # Only indexes on uv_ticket count; joined lookup tables are always indexed
+                indexes = sorted(set(INDEX_PATTERN.findall(plan)) & ticket_indexes)
+                label = f'{name} ({kind})'
+                if indexes:
+                    self.stdout.write(self.style.SUCCESS(f'{label:<45} index: {", ".join(indexes)}'))
+                else:
+                    missing.append(label)
+                    self.stdout.write(self.style.WARNING(f'{label:<45} no index scan'))
+                if options['show_plans']:
+                    self.stdout.write(plan)
+                    self.stdout.write('')
+
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f'{len(missing)} queue queries did not use an index. Small tables are often '
+                f'sequentially scanned by design; re-check after ANALYZE on production-sized data.'
+            ))
+            if options['fail_on_seq_scan']:
+                raise CommandError(f'Queries without an index scan: {", ".join(missing)}')
+        else:
+            self.stdout.write(self.style.SUCCESS('All ticket queue queries use an index.'))
+
+    def _get_agent_user(self, agent_email):
+        if agent_email:
+            try:
+                return User.objects.get(email=agent_email)
+            except User.DoesNotExist:
+                raise CommandError(f'No user with email {agent_email}.')
+        agent = UserInstance.objects.filter(supportRole__code='ROLE_AGENT').select_related('user').first()
+        if not agent:
+            raise CommandError('No agent found. Pass --agent-email.')
+        return agent.user
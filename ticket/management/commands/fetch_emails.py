@@ -1,311 +1,738 @@
 import imaplib
 import email
+import io
+import select
+import signal
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from settings.models import UvMailbox, WebsiteKnowledgebase
-from ticket.models import Ticket, Thread, TicketStatus, TicketPriority, TicketType
-from django.db import models
-from authentication.models import User, UserInstance, SupportRole
+from ticket.models import Ticket, Thread, Attachment, TicketStatus, TicketPriority, TicketType
+from ticket.email_parser import read_headers, parse_body
+from ticket.senders import SenderResolver, add_collaborators
+from ticket.message_ids import find_ticket_id, message_id_hash, parse_message_ids
+from ticket.ingestion import IngestionStats, StageFailed, dead_letter
+from ticket.constants import (
+  IMAP_FETCH_BATCH_SIZE, IMAP_FETCH_BATCH_BYTES, IMAP_INITIAL_MESSAGES, IMAP_MAILBOX_TIMEOUT, IMAP_IDLE_TIMEOUT,
+  IMAP_POLL_INTERVAL, IMAP_RECONNECT_DELAY, IMAP_MAX_RECONNECT_DELAY, IMAP_RELOAD_INTERVAL,
+)
+from django.db import IntegrityError, close_old_connections, connection, transaction
 from django.utils import timezone
 import re
 
 
+class MailboxTimeout(TimeoutError):
+  def __init__(self, fetched):
+    super().__init__(f'stopped after {fetched} messages; the rest is left for the next run')
+    self.fetched = fetched
+
+
+# UvMailbox fields a --daemon connection depends on; changing one reconnects the mailbox
+MAILBOX_CONNECTION_FIELDS = (
+  'email', 'delete_after_fetch', 'imap_host', 'imap_port', 'imap_encryption', 'imap_username', 'imap_password',
+)
+
+
 class Command(BaseCommand):
   help = 'Fetches emails from configured mailboxes and creates tickets.'
 
-  def _get_or_create_user_instance(self, email_address, full_name=None):
-    # Clean up email address
-    email_address = email_address.strip().lower()
-
-    # Try to find existing User
-    user, created_user = User.objects.get_or_create(
-      email=email_address,
-      defaults={
-        'firstName': full_name.split(' ')[0] if full_name else 'Unknown',
-        'lastName': ' '.join(full_name.split(' ')[1:]) if full_name and len(full_name.split(' ')) > 1 else '',
-        'isEnabled': True,
-        'is_active': True,
-      }
-    )
-    if created_user:
-      self.stdout.write(self.style.SUCCESS(f'Created new User: {user.email}'))
-
-    # Get or create ROLE_CUSTOMER SupportRole
-    customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
-
-    # Try to find existing UserInstance
-    user_instance, created_instance = UserInstance.objects.get_or_create(
-      user=user,
-      source='email',  # Assuming 'email' as source for fetched users
-      defaults={
-        'isActive': True,
-        'isVerified': True,
-        'supportRole': customer_role,
-      }
-    )
-    if created_instance:
-      self.stdout.write(self.style.SUCCESS(f'Created new UserInstance for: {user.email}'))
-
-    return user_instance
+  def _parse_sender(self, from_header):
+    """Returns the (name, email address) of a From header."""
+    from_name = None
+    from_email = None
+    if from_header:
+      # Fixed regex pattern - properly closed string
+      match = re.match(r'^(.*?)<(.*?)>', from_header)
+      if match:
+        from_name = match.group(1).strip().strip('"')
+        from_email = match.group(2).strip()
+      else:
+        from_email = from_header.strip()
+        from_name = from_email.split('@')[0]  # Fallback to local part of email
+    return from_name, from_email
+
+  def _prepare_batch(self, raw_messages, blacklist):
+    """
+    Looks up what the messages of a fetched batch need, in set-based
+    queries: the messageIdHash of each one that already has a thread, and
+    the UserInstance of every sender and Cc/Bcc address, created if missing.
+    """
+    hashes = set()
+    addresses = {}
+    for raw_message in raw_messages:
+      msg = read_headers(io.BytesIO(raw_message))
+      from_name, from_email = self._parse_sender(msg['from'])
+      if from_email and from_email.lower() in blacklist:
+        continue
+      hashes.add(message_id_hash(msg['Message-ID']))
+      if from_email:
+        addresses[from_email] = addresses.get(from_email) or from_name
+      for name, addr in email.utils.getaddresses(msg.get_all('Cc', []) + msg.get_all('Bcc', [])):
+        if addr:
+          addresses.setdefault(addr, None)
+    hashes.discard(None)
+
+    known_message_ids = set(Thread.objects.filter(messageIdHash__in=hashes).values_list('messageIdHash', flat=True))
+    user_instances, created = self.senders.resolve(addresses)
+    for address in created:
+      self.stdout.write(self.style.SUCCESS(f'Created new User: {address}'))
+    return {'known_message_ids': known_message_ids, 'user_instances': user_instances}
+
+  def _prepare_messages(self, raw_messages, blacklist):
+    """
+    Runs _prepare_batch() over a fetched batch and returns what it looked up
+    for each message. When a message makes the batch fail, every message is
+    prepared on its own instead, and each one that still fails gets a
+    StageFailed for the resolve stage in place of its lookups.
+    """
+    started = time.perf_counter()
+    try:
+      with transaction.atomic():
+        prepared = self._prepare_batch(raw_messages, blacklist)
+      return [prepared] * len(raw_messages)
+    except Exception as e:
+      if len(raw_messages) == 1:
+        self.stats.add('resolve', 0, 0, failures=1)
+        return [StageFailed('resolve', e)]
+      self.stdout.write(self.style.WARNING(f'Could not resolve a batch of {len(raw_messages)} messages ({e}); resolving them one at a time.'))
+    finally:
+      # Counted against the messages by the resolve stage of each one
+      self.stats.add('resolve', 0, time.perf_counter() - started)
+
+    results = []
+    for raw_message in raw_messages:
+      try:
+        with self.stats.stage('resolve', 0), transaction.atomic():
+          results.append(self._prepare_batch([raw_message], blacklist))
+      except Exception as e:
+        results.append(StageFailed('resolve', e))
+    return results
+
+  def _process_message(self, mailbox, raw_message, internaldate, defaults, blacklist, batch):
+    """
+    Turns one fetched message into a ticket or a reply thread, using what
+    _prepare_batch() looked up for its ``batch``, and times each stage.
+    Returns False when the message was skipped and should stay in the
+    mailbox; raises StageFailed when it could not be ingested.
+    """
+    stage = 'parse'
+    try:
+      with self.stats.stage('parse'):
+        message = self._parse_message(raw_message, internaldate, blacklist, batch)
+      if message is None:
+        return False
+      stage = 'resolve'
+      with self.stats.stage('resolve'):
+        self._resolve_message(message, batch)
+      stage = 'persist'
+      with self.stats.stage('persist'):
+        return self._persist_message(mailbox, message, defaults)
+    except Exception as e:
+      raise StageFailed(stage, e) from e
+
+  def _parse_message(self, raw_message, internaldate, blacklist, batch):
+    """
+    Parse stage: reads the message, attachments included. Returns None
+    when it is blacklisted or already has a thread.
+    """
+    # Only the headers are parsed up front; the body is streamed once the message is known to be wanted
+    fp = io.BytesIO(raw_message)
+    msg = read_headers(fp)
+
+    # Extract email details
+    subject = msg['subject'] if msg['subject'] else '(No Subject)'
+    from_header = msg['from']
+    message_id = msg['Message-ID'] if 'Message-ID' in msg else None
+
+    # Parse email date
+    received_at = None
+
+    # 1. Try to get INTERNALDATE from IMAP
+    if internaldate:
+        try:
+            date_str_match = re.search(r'INTERNALDATE "([^"]+)"', internaldate.decode())
+            if date_str_match:
+                date_str = date_str_match.group(1)
+                from email.utils import parsedate_to_datetime
+                parsed_date = parsedate_to_datetime(date_str)
+                if parsed_date:
+                    if parsed_date.tzinfo is None:
+                        # Assume local timezone if no tzinfo, then convert to UTC
+                        received_at = timezone.make_aware(parsed_date, timezone.get_current_timezone()).astimezone(timezone.utc)
+                    else:
+                        received_at = parsed_date.astimezone(timezone.utc)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Could not parse INTERNALDATE from "{internaldate.decode()}": {e}'))
+
+    # 2. If INTERNALDATE fails, fall back to 'Date' header
+    if not received_at:
+        date_header = msg['Date'] if 'Date' in msg else None
+        if date_header:
+            try:
+                from email.utils import parsedate_to_datetime
+                parsed_date = parsedate_to_datetime(date_header)
+                if parsed_date:
+                    if parsed_date.tzinfo is None:
+                        # Assume local timezone if no tzinfo, then convert to UTC
+                        received_at = timezone.make_aware(parsed_date, timezone.get_current_timezone()).astimezone(timezone.utc)
+                    else:
+                        received_at = parsed_date.astimezone(timezone.utc)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Could not parse Date header "{date_header}": {e}'))
+
+    # 3. If all else fails, use current time
+    if not received_at:
+        received_at = timezone.now()
+
+    from_name, from_email = self._parse_sender(from_header)
+
+    # --- Blacklist Check ---
+    if from_email:
+        from_email_lower = from_email.lower()
+        if from_email_lower in blacklist:
+            self.stdout.write(self.style.WARNING(f"'{from_email}' is in the blacklist. Skipping."))
+            return None
+    # --- End Blacklist Check ---
+
+    self.stdout.write(self.style.SUCCESS(f'Fetched email from {from_email} with subject: {subject}'))
+
+    # Check for duplicate thread using Message-ID
+    if message_id and message_id_hash(message_id) in batch['known_message_ids']:
+      self.stdout.write(self.style.WARNING(f'Skipping duplicate email with Message-ID: {message_id}'))
+      return None
+
+    # Extract email body; attachments are written to the attachment store as they are decoded
+    parsed = parse_body(msg, fp)
+
+    return {
+      'msg': msg,
+      'subject': subject,
+      'message_id': message_id,
+      'received_at': received_at,
+      'from_email': from_email,
+      'body': parsed.html or parsed.plain or "",
+      'attachments': parsed.attachments,
+    }
+
+  def _resolve_message(self, message, batch):
+    """Resolve stage: finds the ticket a reply belongs to, and the UserInstances of its sender and collaborators."""
+    msg = message['msg']
+
+    # --- Threading Logic for Incoming Emails ---
+    in_reply_to = msg['In-Reply-To'] if 'In-Reply-To' in msg else None
+    references = msg['References'] if 'References' in msg else None
+    message['references'] = references
+
+    # Try to find an existing ticket based on In-Reply-To or References,
+    # resolving every referenced Message-ID in one lookup
+    message['ticket'] = None
+    ticket_id = find_ticket_id(parse_message_ids(in_reply_to) + parse_message_ids(references)[::-1])
+    if ticket_id:
+        message['ticket'] = Ticket.objects.filter(pk=ticket_id).first()
+
+    # UserInstance of the sender, resolved with the rest of the batch
+    from_email = message['from_email']
+    message['customer'] = batch['user_instances'].get(from_email.strip().lower()) if from_email else None
+
+    # Extract CC/BCC collaborators
+    cc_headers = msg.get_all('Cc', [])
+    bcc_headers = msg.get_all('Bcc', [])
+
+    collaborators = set()
+    for header_value in cc_headers + bcc_headers:
+        for name, addr in email.utils.getaddresses([header_value]):
+            # Addresses too long to store resolve to nothing and are left out
+            if addr and addr.strip().lower() in batch['user_instances']:
+                collaborators.add(batch['user_instances'][addr.strip().lower()])
+    collaborators.discard(message['customer'])
+    message['collaborators'] = collaborators
+
+  def _persist_message(self, mailbox, message, defaults):
+    """
+    Persist stage: creates the ticket, collaborators, thread and attachments
+    of a resolved message. Returns False when another worker stored the
+    same message first.
+    """
+    subject, message_id, received_at = message['subject'], message['message_id'], message['received_at']
+    existing_ticket, customer_user_instance = message['ticket'], message['customer']
+    references = message['references']
 
-  def handle(self, *args, **options):
-    self.stdout.write(self.style.SUCCESS('Starting email fetching process...'))
+    try:
+        # A message becomes its ticket, collaborators and thread together, or not at all
+        with transaction.atomic():
+            if existing_ticket:
+                # If ticket found, add new thread to it
+                current_ticket = existing_ticket
+                self.stdout.write(self.style.SUCCESS(f'Found existing Ticket ID: {current_ticket.id} for reply.'))
+            else:
+                # No existing ticket found, create a new one
+                current_ticket = Ticket.objects.create(
+                    subject=subject,
+                    source='email',
+                    customer=customer_user_instance,
+                    mailboxEmail=mailbox.email,
+                    status=defaults['status'],
+                    priority=defaults['priority'],
+                    type=defaults['type'],
+                    createdAt=received_at,
+                    updatedAt=timezone.now(),
+                    reference_ids=references # Store references for future threading
+                )
+                self.stdout.write(self.style.SUCCESS(f'Created new Ticket: {current_ticket.subject} (ID: {current_ticket.id})'))
+
+            collaborators = message['collaborators']
+            if collaborators:
+                # One insert; existing collaborators are skipped by the (ticket, user) unique constraint
+                add_collaborators(current_ticket, collaborators)
+                self.stdout.write(self.style.SUCCESS(f'Added {len(collaborators)} CC/BCC collaborator(s) to Ticket ID: {current_ticket.id}'))
+
+            # Create Thread for the current_ticket
+            thread = Thread.objects.create(
+                ticket=current_ticket,
+                user=customer_user_instance,
+                source='email',
+                message=message['body'],
+                threadType='incoming_email',
+                messageId=message_id,
+                createdAt=received_at,
+                updatedAt=timezone.now(),
+            )
+            self.stdout.write(self.style.SUCCESS(f'Created new Thread for Ticket ID: {current_ticket.id}'))
+
+            attachments = message['attachments']
+            if attachments:
+                Attachment.objects.bulk_create([
+                    Attachment(thread=thread, **attachment._asdict()) for attachment in attachments
+                ])
+                self.stdout.write(self.style.SUCCESS(f'Saved {len(attachments)} attachment(s) for Ticket ID: {current_ticket.id}'))
+
+    except IntegrityError:
+        # Another worker created the thread for this Message-ID after the batch was checked;
+        # the unique messageIdHash rolled back this copy, including any new ticket
+        if message_id and Thread.objects.filter(messageIdHash=message_id_hash(message_id)).exists():
+            self.stdout.write(self.style.WARNING(f'Skipping duplicate email with Message-ID: {message_id}'))
+            return False
+        raise
+
+    return True
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=IMAP_FETCH_BATCH_SIZE, help='Messages fetched and recorded per batch.')
+    parser.add_argument('--batch-bytes', type=int, default=IMAP_FETCH_BATCH_BYTES, help='Most bytes of messages fetched at once; a larger message is fetched on its own.')
+    parser.add_argument('--initial-messages', type=int, default=IMAP_INITIAL_MESSAGES, help='Latest messages to process from a mailbox that is new or whose UIDVALIDITY changed.')
+    parser.add_argument('--workers', type=int, default=1, help='Mailboxes polled at the same time.')
+    parser.add_argument('--mailbox-timeout', type=float, default=IMAP_MAILBOX_TIMEOUT, help='Seconds a mailbox may take per run; also the IMAP socket timeout.')
+    parser.add_argument('--daemon', action='store_true', help='Keep a connection to every mailbox open and process mail as it arrives, until SIGTERM.')
+    parser.add_argument('--poll-interval', type=float, default=IMAP_POLL_INTERVAL, help='Seconds between NOOP polls of servers without IDLE, with --daemon.')
+    parser.add_argument('--reload-interval', type=float, default=IMAP_RELOAD_INTERVAL, help='Seconds between checks for changed mailbox settings, with --daemon.')
+
+  def _start_uid(self, mail, mailbox, initial_messages):
+    """
+    Returns the UID after which the selected mailbox has unprocessed mail.
+    When the mailbox is new or its UIDVALIDITY changed, UIDs from earlier
+    runs no longer identify the same messages, so the high-water mark is
+    reset to just before the latest ``initial_messages`` messages.
+    """
+    uidvalidity = mail.response('UIDVALIDITY')[1][0]
+    if uidvalidity is None:
+      status, data = mail.status('inbox', '(UIDVALIDITY)')
+      uidvalidity = re.search(rb'UIDVALIDITY (\d+)', data[0]).group(1)
+    uidvalidity = int(uidvalidity)
+
+    if uidvalidity != mailbox.imap_uidvalidity:
+      status, data = mail.uid('SEARCH', None, 'ALL')
+      uids = [int(uid) for uid in data[0].split()] if status == 'OK' else []
+      last_uid = uids[-initial_messages - 1] if len(uids) > initial_messages else 0
+      if mailbox.imap_uidvalidity is not None:
+        self.stdout.write(self.style.WARNING(f'UIDVALIDITY of {mailbox.email} changed; resyncing from the latest {initial_messages} messages.'))
+      self._save_sync_state(mailbox, uidvalidity, last_uid)
+    return mailbox.imap_last_uid
+
+  def _save_sync_state(self, mailbox, uidvalidity, last_uid):
+    # update() rather than save(): a mailbox save also resets outbound transports
+    UvMailbox.objects.filter(pk=mailbox.pk).update(imap_uidvalidity=uidvalidity, imap_last_uid=last_uid)
+    mailbox.imap_uidvalidity, mailbox.imap_last_uid = uidvalidity, last_uid
+
+  def _new_uids(self, mail, last_uid):
+    status, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+    if status != 'OK':
+      raise imaplib.IMAP4.error(f'UID SEARCH failed: {status}')
+    # "n:*" always matches the newest message, even when its UID is below n
+    return sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
+  def _fetch_sizes(self, mail, uids):
+    """Returns {uid: RFC822.SIZE} of ``uids``, in one round trip that transfers no message bodies."""
+    status, data = mail.uid('FETCH', ','.join(map(str, uids)), '(UID RFC822.SIZE)')
+    if status != 'OK':
+      raise imaplib.IMAP4.error(f'UID FETCH failed: {status}')
+    sizes = {}
+    for item in data:
+      if isinstance(item, tuple):
+        item = item[0]
+      uid = re.search(rb'UID (\d+)', item or b'')
+      size = re.search(rb'RFC822\.SIZE (\d+)', item or b'')
+      if uid and size:
+        sizes[int(uid.group(1))] = int(size.group(1))
+    return sizes
+
+  def _size_batches(self, uids, sizes, max_bytes):
+    """
+    Splits ``uids`` into runs of messages adding up to at most ``max_bytes``.
+    A message larger than that makes a run of its own, and one without a
+    size (expunged since) is counted as empty.
+    """
+    batch, total = [], 0
+    for uid in uids:
+      size = sizes.get(uid, 0)
+      if batch and total + size > max_bytes:
+        yield batch
+        batch, total = [], 0
+      batch.append(uid)
+      total += size
+    if batch:
+      yield batch
+
+  def _fetch_batch(self, mail, uids):
+    """
+    Fetches ``uids`` in one round trip. Returns (uid, metadata, raw message)
+    tuples in UID order; the metadata holds the INTERNALDATE. BODY.PEEK
+    leaves the \\Seen flag alone.
+    """
+    status, data = mail.uid('FETCH', ','.join(map(str, uids)), '(UID INTERNALDATE BODY.PEEK[])')
+    if status != 'OK':
+      raise imaplib.IMAP4.error(f'UID FETCH failed: {status}')
+    messages = []
+    for index, item in enumerate(data):
+      if not isinstance(item, tuple):
+        continue
+      metadata = item[0]
+      following = data[index + 1] if index + 1 < len(data) else None
+      if isinstance(following, bytes):
+        # Servers may send some items after the message literal
+        metadata += following
+      match = re.search(rb'UID (\d+)', metadata)
+      if match:
+        messages.append((int(match.group(1)), metadata, item[1]))
+    return sorted(messages, key=lambda message: message[0])
+
+  def _fetch_mailbox(self, mail, mailbox, defaults, blacklist, options, deadline=None):
+    """
+    Processes every message above the mailbox's high-water mark, in UID
+    order, until it is caught up or ``deadline`` passes. The sizes of each
+    --batch-size UIDs are fetched first, then their messages in runs of at
+    most --batch-bytes, so memory stays flat however large the attachments
+    are. Each run costs one FETCH and at most one STORE; deleted messages are
+    expunged once at the end of the pass. Returns the number of messages
+    fetched.
+    """
+    mail.select('inbox')  # Select the inbox
+    last_uid = self._start_uid(mail, mailbox, options['initial_messages'])
+    batch_size = max(options['batch_size'], 1)
+    deleted = False
+    fetched = 0
+
+    while True:
+      uids = self._new_uids(mail, last_uid)
+      if not uids:
+        break
+      for start in range(0, len(uids), batch_size):
+        batch_uids = uids[start:start + batch_size]
+        with self.stats.stage('fetch', 0):
+          sizes = self._fetch_sizes(mail, batch_uids)
+        for batch in self._size_batches(batch_uids, sizes, options['batch_bytes']):
+          if deadline and time.monotonic() > deadline:
+            # The rest is picked up by the next run, from the saved high-water mark
+            if deleted:
+              mail.expunge()
+            raise MailboxTimeout(fetched)
+          fetched += len(batch)
+          to_delete = []
+          with self.stats.stage('fetch', len(batch)):
+            messages = self._fetch_batch(mail, batch)
+          prepared = self._prepare_messages([raw_message for uid, metadata, raw_message in messages], blacklist)
+          for (uid, metadata, raw_message), message_prepared in zip(messages, prepared):
+            try:
+              if isinstance(message_prepared, StageFailed):
+                raise message_prepared
+              processed = self._process_message(mailbox, raw_message, metadata, defaults, blacklist, message_prepared)
+            except StageFailed as e:
+              # Kept for replay_failed_emails, so the message is done with as far as the mailbox goes
+              dead_letter(mailbox.email, raw_message, metadata, e)
+              self.stdout.write(self.style.ERROR(f'Could not ingest message {uid} of {mailbox.email} ({e}); kept as a failed email.'))
+              processed = True
+            if processed and mailbox.delete_after_fetch:
+              to_delete.append(uid)
+
+          with self.stats.stage('flag', len(batch)):
+            if to_delete:
+              mail.uid('STORE', ','.join(map(str, to_delete)), '+FLAGS', '(\\Deleted)')
+              deleted = True
+
+            # Messages up to here are done, even if a later batch fails
+            last_uid = batch[-1]
+            self._save_sync_state(mailbox, mailbox.imap_uidvalidity, last_uid)
+
+    if deleted:
+      with self.stats.stage('flag', 0):
+        mail.expunge()  # Permanently delete
+    return fetched
+
+  def _connect(self, mailbox, timeout):
+    # Connect to IMAP server; the timeout stops a hung server from blocking this worker forever
+    if mailbox.imap_encryption == 'ssl':
+      return imaplib.IMAP4_SSL(mailbox.imap_host, mailbox.imap_port, timeout=timeout)
+    # 'tls' or 'null' - for simplicity, using IMAP4 for non-SSL
+    return imaplib.IMAP4(mailbox.imap_host, mailbox.imap_port, timeout=timeout)
+
+  def _poll_mailbox(self, mailbox, defaults, blacklist, options):
+    """
+    Connects to one mailbox and processes its new mail. Errors are reported
+    in the returned (mailbox, status, messages, seconds) timing instead of
+    raised, so one failing server does not affect the others.
+    """
+    started = time.monotonic()
+    timeout = options['mailbox_timeout'] or None
+    fetched = 0
+    self.stdout.write(self.style.SUCCESS(f'Connecting to mailbox: {mailbox.name} ({mailbox.email})'))
+    try:
+      mail = self._connect(mailbox, timeout)
+      try:
+        mail.login(mailbox.imap_username, mailbox.imap_password)
+        fetched = self._fetch_mailbox(mail, mailbox, defaults, blacklist, options, started + timeout if timeout else None)
+        mail.close()
+        mail.logout()
+      except Exception:
+        mail.shutdown()
+        raise
+      self.stdout.write(self.style.SUCCESS(f'Successfully processed mailbox: {mailbox.email}'))
+      status = 'ok'
 
-    # Get or create default ticket status, priority, and type
-    default_status, _ = TicketStatus.objects.get_or_create(code='Open', defaults={'description': 'Open Ticket'})
-    default_priority, _ = TicketPriority.objects.get_or_create(code='Low', defaults={'description': 'Low Priority'})
-    default_type, _ = TicketType.objects.get_or_create(code='Question', defaults={'description': 'General Question'})
+    except Exception as e:
+      self.stdout.write(self.style.ERROR(f'Error processing mailbox {mailbox.email}: {e}'))
+      status = 'timeout' if isinstance(e, TimeoutError) else 'error'
+      fetched = getattr(e, 'fetched', fetched)
 
-    mailboxes = UvMailbox.objects.filter(is_enabled=True)
-
-    if not mailboxes.exists():
-      self.stdout.write(self.style.WARNING('No active mailboxes configured. Exiting.'))
-      return
+    return mailbox, status, fetched, time.monotonic() - started
 
+  def _poll_in_worker(self, *args):
+    try:
+      return self._poll_mailbox(*args)
+    finally:
+      # Worker threads each open their own database connection
+      connection.close()
+
+  def _idle(self, mail, timeout, stop, response_timeout):
+    """
+    Waits in IMAP IDLE (RFC 2177) until the server announces new mail,
+    ``timeout`` seconds pass or ``stop`` is set, and returns whether new mail
+    was announced. imaplib has no IDLE, so the responses are read off the
+    socket here without blocking, which lets ``stop`` end the wait within a
+    second.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    sock = mail.sock
+    sock_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+      try:
+        buffer = mail.file.read1(65536)  # Anything imaplib has read ahead
+      except (BlockingIOError, ssl.SSLWantReadError):
+        buffer = b''
+      idling = done = arrived = False
+      deadline = time.monotonic() + timeout
+      while True:
+        *lines, buffer = buffer.split(b'\r\n')
+        for line in lines:
+          if line.startswith(b'+'):
+            idling = True
+          elif line.startswith(tag + b' '):
+            if not line[len(tag) + 1:].upper().startswith(b'OK'):
+              raise imaplib.IMAP4.error(f'IDLE failed: {line.decode(errors="replace")}')
+            return arrived
+          elif line.startswith(b'* BYE'):
+            raise imaplib.IMAP4.abort(f'server closed the connection: {line.decode(errors="replace")}')
+          elif re.match(rb'\* \d+ EXISTS', line):
+            arrived = True
+        if idling and not done and (arrived or stop.is_set() or time.monotonic() > deadline):
+          mail.send(b'DONE\r\n')
+          done = True
+          deadline = time.monotonic() + response_timeout
+        elif done and time.monotonic() > deadline:
+          raise imaplib.IMAP4.abort('no response to DONE')
+        try:
+          data = sock.recv(65536)
+        except (BlockingIOError, ssl.SSLWantReadError):
+          select.select([sock], [], [], 1)
+          continue
+        if not data:
+          raise imaplib.IMAP4.abort('connection closed during IDLE')
+        buffer += data
+    finally:
+      sock.settimeout(sock_timeout)
+      mail.tagged_commands.pop(tag, None)
+
+  def _noop_wait(self, mail, interval, stop):
+    """The fallback of _idle() for servers without IDLE: sends NOOP every ``interval`` seconds until one reports new mail."""
+    mail.response('EXISTS')  # Discard counts reported before the last search
+    while not stop.wait(interval):
+      mail.noop()
+      if mail.response('EXISTS')[1][0] is not None:
+        return True
+    return False
+
+  def _serve_mailbox(self, mail, mailbox, defaults, stop, options):
+    status, data = mail.capability()
+    use_idle = b'IDLE' in data[0].upper().split()
+    self.stdout.write(self.style.SUCCESS(
+      f'Watching {mailbox.email} ' + ('with IDLE' if use_idle else f'with NOOP polling every {options["poll_interval"]:g}s')
+    ))
+    # Another process may have moved the high-water mark while this mailbox was disconnected
+    mailbox.refresh_from_db(fields=['imap_uidvalidity', 'imap_last_uid'])
+    fetch = True
+    while not stop.is_set():
+      if fetch:
+        close_old_connections()
+        # Mail that arrived while processed messages were being deleted may
+        # already have been announced, so a pass that found mail is followed by another
+        fetch = self._fetch_mailbox(mail, mailbox, defaults, self.blacklist, options) > 0
+      elif use_idle:
+        fetch = self._idle(mail, IMAP_IDLE_TIMEOUT, stop, options['mailbox_timeout'] or IMAP_MAILBOX_TIMEOUT)
+      else:
+        fetch = self._noop_wait(mail, options['poll_interval'], stop)
+
+  def _watch_mailbox(self, mailbox, defaults, stop, options):
+    """
+    Runs in its own thread for each mailbox with --daemon: keeps a logged-in
+    connection and processes mail as soon as the server announces it, until
+    ``stop`` is set. Lost connections and errors are retried with
+    exponential backoff.
+    """
+    delay = IMAP_RECONNECT_DELAY
+    try:
+      while not stop.is_set():
+        try:
+          mail = self._connect(mailbox, options['mailbox_timeout'] or None)
+          try:
+            mail.login(mailbox.imap_username, mailbox.imap_password)
+            delay = IMAP_RECONNECT_DELAY
+            self._serve_mailbox(mail, mailbox, defaults, stop, options)
+            if mail.state == 'SELECTED':
+              mail.close()
+            mail.logout()
+          except Exception:
+            mail.shutdown()
+            raise
+        except Exception as e:
+          self.stdout.write(self.style.ERROR(f'Error watching mailbox {mailbox.email}: {e}. Reconnecting in {delay}s.'))
+          stop.wait(delay)
+          delay = min(delay * 2, IMAP_MAX_RECONNECT_DELAY)
+    finally:
+      connection.close()
+    self.stdout.write(self.style.SUCCESS(f'Stopped watching mailbox: {mailbox.email}'))
+
+  def _run_daemon(self, defaults, options):
+    """
+    Watches every enabled mailbox in its own thread until SIGTERM or SIGINT.
+    Mailboxes are re-read every --reload-interval seconds: a mailbox whose
+    connection settings changed is reconnected, and enabled or disabled ones
+    are started or stopped. On shutdown each watcher finishes the message
+    pass it is on and logs out.
+    """
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+      signal.signal(signum, lambda signum, frame: stopping.set())
+
+    watchers = {}  # mailbox id -> (connection settings, thread, stop event)
+    while not stopping.is_set():
+      close_old_connections()
+      self.blacklist = self._load_blacklist()
+      mailboxes = {mailbox.pk: mailbox for mailbox in UvMailbox.objects.filter(is_enabled=True)}
+
+      for pk, (connection_settings, thread, stop) in list(watchers.items()):
+        mailbox = mailboxes.get(pk)
+        if mailbox is None or self._connection_settings(mailbox) != connection_settings:
+          self.stdout.write(self.style.WARNING(f'Mailbox {pk} was changed or disabled; stopping its watcher.'))
+          stop.set()
+          thread.join()
+          del watchers[pk]
+
+      for pk, mailbox in mailboxes.items():
+        if pk not in watchers:
+          stop = threading.Event()
+          thread = threading.Thread(
+            target=self._watch_mailbox, args=(mailbox, defaults, stop, options), name=f'mailbox-{pk}', daemon=True,
+          )
+          thread.start()
+          watchers[pk] = (self._connection_settings(mailbox), thread, stop)
+
+      stopping.wait(options['reload_interval'])
+
+    self.stdout.write(self.style.SUCCESS('Shutting down...'))
+    for connection_settings, thread, stop in watchers.values():
+      stop.set()
+    for connection_settings, thread, stop in watchers.values():
+      thread.join()
+
+  def _connection_settings(self, mailbox):
+    return tuple(getattr(mailbox, field) for field in MAILBOX_CONNECTION_FIELDS)
+
+  def _load_blacklist(self):
     # Get blacklist settings
     try:
         website_kb = WebsiteKnowledgebase.objects.first()
         if website_kb:
-            blacklist = website_kb.black_list or []
-        else:
-            blacklist = []
+            return website_kb.black_list or []
+        return []
     except Exception as e:
         self.stdout.write(self.style.ERROR(f"Could not load blacklist settings: {e}"))
-        blacklist = []
+        return []
 
-    for mailbox in mailboxes:
-      self.stdout.write(self.style.SUCCESS(f'Connecting to mailbox: {mailbox.name} ({mailbox.email})'))
-      try:
-        # Connect to IMAP server
-        if mailbox.imap_encryption == 'ssl':
-          mail = imaplib.IMAP4_SSL(mailbox.imap_host, mailbox.imap_port)
-        else:  # 'tls' or 'null' - for simplicity, using IMAP4 for non-SSL
-          mail = imaplib.IMAP4(mailbox.imap_host, mailbox.imap_port)
+  def _load_defaults(self):
+    # Get or create default ticket status, priority, and type
+    default_status, _ = TicketStatus.objects.get_or_create(code='Open', defaults={'description': 'Open Ticket'})
+    default_priority, _ = TicketPriority.objects.get_or_create(code='Low', defaults={'description': 'Low Priority'})
+    default_type, _ = TicketType.objects.get_or_create(code='Question', defaults={'description': 'General Question'})
+    return {'status': default_status, 'priority': default_priority, 'type': default_type}
 
-        mail.login(mailbox.imap_username, mailbox.imap_password)
-        mail.select('inbox')  # Select the inbox
+  def _write_stats(self):
+    for line in self.stats.report():
+      self.stdout.write(line)
 
-        status, email_ids = mail.search(None, 'ALL')  # Search for all emails (for testing)
-        if status != 'OK':
-          self.stdout.write(self.style.ERROR(f'Failed to search emails for {mailbox.email}: {status}'))
-          continue
+  def handle(self, *args, **options):
+    self.stdout.write(self.style.SUCCESS('Starting email fetching process...'))
 
-        email_ids = email_ids[0].split()
-        latest_email_ids = email_ids[-10:]
-        # latest_email_ids = email_ids
-        for email_id in latest_email_ids:
-          status, msg_data = mail.fetch(email_id, '(RFC822)')
-          if status != 'OK':
-            self.stdout.write(self.style.ERROR(f'Failed to fetch email {email_id} for {mailbox.email}: {status}'))
-            continue
-
-          msg = email.message_from_bytes(msg_data[0][1])
-
-          # Extract email details
-          subject = msg['subject'] if msg['subject'] else '(No Subject)'
-          from_header = msg['from']
-          message_id = msg['Message-ID'] if 'Message-ID' in msg else None
-
-          # Parse email date
-          received_at = None
-
-          # 1. Try to get INTERNALDATE from IMAP
-          status, date_data = mail.fetch(email_id, '(INTERNALDATE)')
-          if status == 'OK' and date_data and date_data[0]:
-              try:
-                  date_str_match = re.search(r'INTERNALDATE "([^"]+)"', date_data[0].decode())
-                  if date_str_match:
-                      date_str = date_str_match.group(1)
-                      from email.utils import parsedate_to_datetime
-                      parsed_date = parsedate_to_datetime(date_str)
-                      if parsed_date:
-                          if parsed_date.tzinfo is None:
-                              # Assume local timezone if no tzinfo, then convert to UTC
-                              received_at = timezone.make_aware(parsed_date, timezone.get_current_timezone()).astimezone(timezone.utc)
-                          else:
-                              received_at = parsed_date.astimezone(timezone.utc)
-              except Exception as e:
-                  self.stdout.write(self.style.WARNING(f'Could not parse INTERNALDATE from "{date_data[0].decode()}": {e}'))
-
-          # 2. If INTERNALDATE fails, fall back to 'Date' header
-          if not received_at:
-              date_header = msg['Date'] if 'Date' in msg else None
-              if date_header:
-                  try:
-                      from email.utils import parsedate_to_datetime
-                      parsed_date = parsedate_to_datetime(date_header)
-                      if parsed_date:
-                          if parsed_date.tzinfo is None:
-                              # Assume local timezone if no tzinfo, then convert to UTC
-                              received_at = timezone.make_aware(parsed_date, timezone.get_current_timezone()).astimezone(timezone.utc)
-                          else:
-                              received_at = parsed_date.astimezone(timezone.utc)
-                  except Exception as e:
-                      self.stdout.write(self.style.WARNING(f'Could not parse Date header "{date_header}": {e}'))
-
-          # 3. If all else fails, use current time
-          if not received_at:
-              received_at = timezone.now()
-
-          # Parse from_address to get name and email
-          from_name = None
-          from_email = None
-          if from_header:
-            # Fixed regex pattern - properly closed string
-            match = re.match(r'^(.*?)<(.*?)>
-, from_header)
-            if match:
-              from_name = match.group(1).strip().strip('"')
-              from_email = match.group(2).strip()
-            else:
-              from_email = from_header.strip()
-              from_name = from_email.split('@')[0]  # Fallback to local part of email
-
-          # --- Blacklist Check ---
-          if from_email:
-              from_email_lower = from_email.lower()
-              if from_email_lower in blacklist:
-                  self.stdout.write(self.style.WARNING(f"'{from_email}' is in the blacklist. Skipping."))
-                  continue
-          # --- End Blacklist Check ---
-
-          # Extract email body
-          html_body = None
-          plain_body = None
-
-          for part in msg.walk():
-              ctype = part.get_content_type()
-              cdispo = str(part.get('Content-Disposition'))
-
-              # skip attachments
-              if cdispo and 'attachment' in cdispo:
-                  continue
-
-              charset = part.get_content_charset() or 'utf-8'
-
-              if ctype == 'text/html':
-                  try:
-                      html_body = part.get_payload(decode=True).decode(charset)
-                  except Exception:
-                      html_body = part.get_payload(decode=True).decode('latin-1', errors='ignore')
-              elif ctype == 'text/plain':
-                  try:
-                      plain_body = part.get_payload(decode=True).decode(charset)
-                  except Exception:
-                      plain_body = part.get_payload(decode=True).decode('latin-1', errors='ignore')
-
-          body = html_body or plain_body
-
-          # Fallback for non-multipart messages that are not text/plain or text/html
-          if not body and not msg.is_multipart():
-              try:
-                  body = msg.get_payload(decode=True).decode(msg.get_content_charset() or 'utf-8')
-              except (UnicodeDecodeError, AttributeError):
-                  body = msg.get_payload(decode=True).decode('latin-1', errors='ignore')  # Fallback
-
-          body = body or ""
-
-          self.stdout.write(self.style.SUCCESS(f'Fetched email from {from_email} with subject: {subject}'))
-
-          # Check for duplicate thread using Message-ID
-          if message_id and Thread.objects.filter(messageId=message_id).exists():
-            self.stdout.write(self.style.WARNING(f'Skipping duplicate email with Message-ID: {message_id}'))
-            continue
-
-          # --- Threading Logic for Incoming Emails ---
-          in_reply_to = msg['In-Reply-To'] if 'In-Reply-To' in msg else None
-          references = msg['References'] if 'References' in msg else None
-
-          # Try to find an existing ticket based on In-Reply-To or References
-          existing_ticket = None
-          if in_reply_to:
-              existing_ticket = Ticket.objects.filter(
-                  threads__messageId=in_reply_to
-              ).first()
-
-          if not existing_ticket and references:
-              # Split references into individual message IDs
-              ref_ids = references.split()
-              for ref_id in ref_ids:
-                  existing_ticket = Ticket.objects.filter(
-                      models.Q(threads__messageId=ref_id) | models.Q(reference_ids__contains=ref_id)
-                  ).first()
-                  if existing_ticket:
-                      break # Found a matching ticket
-
-          # Get or create UserInstance for the sender
-          customer_user_instance = self._get_or_create_user_instance(from_email, from_name)
-
-          try: # Start of the try block for ticket/thread creation
-              if existing_ticket:
-                  # If ticket found, add new thread to it
-                  current_ticket = existing_ticket
-                  self.stdout.write(self.style.SUCCESS(f'Found existing Ticket ID: {current_ticket.id} for reply.'))
-              else:
-                  # No existing ticket found, create a new one
-                  current_ticket = Ticket.objects.create(
-                      subject=subject,
-                      source='email',
-                      customer=customer_user_instance,
-                      mailboxEmail=mailbox.email,
-                      status=default_status,
-                      priority=default_priority,
-                      type=default_type,
-                      createdAt=received_at,
-                      updatedAt=timezone.now(),
-                      reference_ids=references # Store references for future threading
-                  )
-                  self.stdout.write(self.style.SUCCESS(f'Created new Ticket: {current_ticket.subject} (ID: {current_ticket.id})'))
-
-              # Extract and add CC/BCC as collaborators (existing logic, ensure it uses current_ticket)
-              cc_headers = msg.get_all('Cc', [])
-              bcc_headers = msg.get_all('Bcc', [])
-
-              all_cc_bcc_emails = []
-              for header_value in cc_headers + bcc_headers:
-                  for name, addr in email.utils.getaddresses([header_value]):
-                      if addr:
-                          all_cc_bcc_emails.append(addr)
-
-              for cc_bcc_email in all_cc_bcc_emails:
-                  try:
-                      collaborator_user_instance = self._get_or_create_user_instance(cc_bcc_email)
-                      if collaborator_user_instance != customer_user_instance and \
-                         collaborator_user_instance not in current_ticket.collaborators.all():
-                          current_ticket.collaborators.add(collaborator_user_instance)
-                          self.stdout.write(self.style.SUCCESS(f'Added {cc_bcc_email} as collaborator to Ticket ID: {current_ticket.id}'))
-                  except Exception as collab_e:
-                      self.stdout.write(self.style.ERROR(f'Error adding CC/BCC {cc_bcc_email} as collaborator: {collab_e}'))
-
-              # Create Thread for the current_ticket
-              Thread.objects.create(
-                  ticket=current_ticket,
-                  user=customer_user_instance,
-                  source='email',
-                  message=body,
-                  threadType='incoming_email',
-                  messageId=message_id,
-                  createdAt=received_at,
-                  updatedAt=timezone.now(),
-              )
-              self.stdout.write(self.style.SUCCESS(f'Created new Thread for Ticket ID: {current_ticket.id}'))
-
-          except Exception as create_e:
-              self.stdout.write(self.style.ERROR(f'Error creating ticket/thread for {from_email}: {create_e}'))
-              # Optionally, mark email as unseen or move to error folder if ticket creation fails
-
-          # Mark email as seen (optional, depending on requirements)
-          # mail.store(email_id, '+FLAGS', '\Seen')
-
-          if mailbox.delete_after_fetch:
-            mail.store(email_id, '+FLAGS', '\Deleted')
-            mail.expunge()  # Permanently delete
+    defaults = self._load_defaults()
+    # Shared by every mailbox of the run, so the customer role is read once
+    self.senders = SenderResolver()
+    self.stats = IngestionStats()
 
-        mail.close()
-        mail.logout()
-        self.stdout.write(self.style.SUCCESS(f'Successfully processed mailbox: {mailbox.email}'))
+    if options['daemon']:
+      self._run_daemon(defaults, options)
+      self._write_stats()
+      return
 
-      except Exception as e:
-        self.stdout.write(self.style.ERROR(f'Error processing mailbox {mailbox.email}: {e}'))
+    mailboxes = UvMailbox.objects.filter(is_enabled=True)
+
+    if not mailboxes.exists():
+      self.stdout.write(self.style.WARNING('No active mailboxes configured. Exiting.'))
+      return
+
+    blacklist = self._load_blacklist()
+
+    if options['workers'] > 1:
+      with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+        timings = list(executor.map(
+          lambda mailbox: self._poll_in_worker(mailbox, defaults, blacklist, options), mailboxes
+        ))
+    else:
+      timings = [self._poll_mailbox(mailbox, defaults, blacklist, options) for mailbox in mailboxes]
 
+    for mailbox, status, fetched, elapsed in timings:
+      style = self.style.SUCCESS if status == 'ok' else self.style.ERROR
+      self.stdout.write(style(f'{mailbox.email:<40}{status:<9}{fetched:>6} messages{elapsed:>9.2f}s'))
+    self._write_stats()
     self.stdout.write(self.style.SUCCESS('Email fetching process completed.'))
@@ -0,0 +1,167 @@
+import glob
+import mailbox
+import os
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from ticket.ingestion import IngestionStats, StageFailed, dead_letter
+from ticket.management.commands.fetch_emails import Command as FetchEmailsCommand
+from ticket.senders import SenderResolver
+
+
+def _read_messages(path):
+    """
+    Yields (source, raw message) for every message under ``path``: a Maildir
+    directory, a directory or glob of .eml files, a single .eml file, or an
+    mbox file. Messages are read one at a time.
+    """
+    if glob.has_magic(path):
+        for eml_path in sorted(glob.glob(path, recursive=True)):
+            if os.path.isfile(eml_path):
+                yield from _read_messages(eml_path)
+    elif os.path.isdir(path):
+        if os.path.isdir(os.path.join(path, 'cur')):
+            maildir = mailbox.Maildir(path, factory=None, create=False)
+            for key in sorted(maildir.iterkeys()):
+                yield f'{path}:{key}', maildir.get_bytes(key)
+        else:
+            yield from _read_messages(os.path.join(glob.escape(path), '**', '*.eml'))
+    elif path.lower().endswith('.eml'):
+        with open(path, 'rb') as eml:
+            yield path, eml.read()
+    else:
+        mbox = mailbox.mbox(path, factory=None, create=False)
+        try:
+            for key in mbox.iterkeys():
+                yield f'{path}:{key}', mbox.get_bytes(key)
+        finally:
+            mbox.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports emails from mbox files, Maildir directories or .eml files through the same parse, resolve and '
+        'persist stages as fetch_emails, and reports the throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='mbox files, Maildir directories, directories of .eml files or .eml globs.')
+        parser.add_argument('--mailbox', help='Mailbox address recorded on the imported tickets.')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Batches imported in parallel. With more than one, a reply may be imported before the message it answers.',
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages imported per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Roll back every batch, to measure ingestion without keeping anything.')
+
+    def _import_batch(self, batch, defaults, blacklist, options):
+        """Imports ``batch`` in one transaction and returns how many messages were imported, skipped and failed."""
+        mailbox = SimpleNamespace(email=options['mailbox'])
+        counts = {'imported': 0, 'skipped': 0, 'failed': 0}
+        with transaction.atomic():
+            prepared = self.fetch._prepare_messages([raw_message for source, raw_message in batch], blacklist)
+            for (source, raw_message), message_prepared in zip(batch, prepared):
+                try:
+                    if isinstance(message_prepared, StageFailed):
+                        raise message_prepared
+                    # A failing message rolls back to here and the rest of the batch goes on
+                    with transaction.atomic():
+                        processed = self.fetch._process_message(mailbox, raw_message, None, defaults, blacklist, message_prepared)
+                except StageFailed as e:
+                    if not options['dry_run']:
+                        dead_letter(options['mailbox'], raw_message, None, e)
+                    self.stdout.write(self.style.ERROR(f'Could not import {source} ({e}); kept as a failed email.'))
+                    counts['failed'] += 1
+                else:
+                    counts['imported' if processed else 'skipped'] += 1
+            if options['dry_run']:
+                transaction.set_rollback(True)
+        return counts
+
+    def _work(self, batches, defaults, blacklist, options, totals):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count_query):
+                while True:
+                    batch = batches.get()
+                    if batch is None:
+                        break
+                    try:
+                        counts = self._import_batch(batch, defaults, blacklist, options)
+                    except Exception as e:
+                        # The whole batch was rolled back; keep taking batches so reading never stalls
+                        self.stdout.write(self.style.ERROR(f'Could not import a batch of {len(batch)} messages, importing again retries them: {e}'))
+                        counts = {'failed': len(batch)}
+                    with self.lock:
+                        for result, count in counts.items():
+                            totals[result] += count
+        finally:
+            with self.lock:
+                totals['queries'] += queries
+            # Worker threads each open their own database connection
+            connection.close()
+
+    def handle(self, *args, **options):
+        # Per-message output of the stages only at --verbosity 2 and above
+        output = self.stdout if options['verbosity'] > 1 else open(os.devnull, 'w')
+        self.fetch = FetchEmailsCommand(stdout=output, stderr=self.stderr, no_color=options['no_color'])
+        self.fetch.senders = SenderResolver()
+        self.fetch.stats = IngestionStats()
+        self.lock = threading.Lock()
+        defaults = self.fetch._load_defaults()
+        blacklist = self.fetch._load_blacklist()
+        batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
+
+        totals = {'imported': 0, 'skipped': 0, 'failed': 0, 'queries': 0}
+        # Bounded, so reading stays at most a few batches ahead of the workers
+        batches = queue.Queue(maxsize=workers * 2)
+        threads = [
+            threading.Thread(target=self._work, args=(batches, defaults, blacklist, options, totals), name=f'import-{index}')
+            for index in range(workers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        read = 0
+        try:
+            for path in options['paths']:
+                messages = _read_messages(path)
+                while True:
+                    reading = time.perf_counter()
+                    batch = [message for _, message in zip(range(batch_size), messages)]
+                    if not batch:
+                        break
+                    self.fetch.stats.add('fetch', len(batch), time.perf_counter() - reading)
+                    read += len(batch)
+                    batches.put(batch)
+        finally:
+            for thread in threads:
+                batches.put(None)
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+        if output is not self.stdout:
+            output.close()
+
+        for line in self.fetch.stats.report():
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {read} messages: imported {totals['imported']}, skipped {totals['skipped']}, failed {totals['failed']}"
+            + (' (rolled back).' if options['dry_run'] else '.')
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f'{elapsed:.2f}s, {read / elapsed if elapsed else 0:.1f} messages/s, '
+            f"{totals['queries'] / read if read else 0:.1f} queries/message with {workers} worker(s) "
+            f'and {batch_size} messages per transaction.'
+        ))
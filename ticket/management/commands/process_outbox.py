@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from ticket.constants import OUTBOX_MAX_ATTEMPTS
+from ticket.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued ticket emails from the outbox, retrying failed sends with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails sent over one SMTP connection per batch.')
+        parser.add_argument('--max-attempts', type=int, default=OUTBOX_MAX_ATTEMPTS, help='Give up on an email after this many failed sends.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is drained.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls of an empty outbox with --loop.')
+
+    def handle(self, *args, **options):
+        total = {'sent': 0, 'retrying': 0, 'failed': 0}
+        while True:
+            results = process_outbox(options['batch_size'], options['max_attempts'])
+            processed = sum(results.values())
+            if processed:
+                for status, count in results.items():
+                    total[status] += count
+                self.stdout.write(
+                    f"Sent {results['sent']}, rescheduled {results['retrying']}, failed {results['failed']}."
+                )
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Outbox drained: {total['sent']} sent, {total['retrying']} rescheduled, {total['failed']} failed."
+        ))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ticket.models import TicketChange
+
+
+class Command(BaseCommand):
+    help = 'Deletes ticket change feed entries that no open ticket event stream can still need.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Keep changes recorded within this many hours.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        deleted, _ = TicketChange.objects.filter(createdAt__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} ticket changes older than {options["hours"]} hours.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ticket.models import Ticket
+from ticket.search import index_ticket
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search document of every ticket. Needed once after migrating existing data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of tickets indexed per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ticket_ids = list(Ticket.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ticket_ids), batch_size):
+            batch = ticket_ids[start:start + batch_size]
+            with transaction.atomic():
+                for ticket in Ticket.objects.filter(id__in=batch).select_related('customer__user'):
+                    index_ticket(ticket)
+            self.stdout.write(f'Indexed {min(start + batch_size, len(ticket_ids))}/{len(ticket_ids)} tickets.')
+        self.stdout.write(self.style.SUCCESS('Ticket search index rebuilt.'))
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ticket.ingestion import IngestionStats, StageFailed, dead_letter
+from ticket.management.commands.fetch_emails import Command as FetchEmailsCommand
+from ticket.models import FailedEmail
+from ticket.senders import SenderResolver
+
+
+class Command(BaseCommand):
+    help = 'Runs failed emails kept by fetch_emails through ingestion again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, action='append', dest='ids', help='Replay only this failed email; may be repeated.')
+        parser.add_argument('--stage', help='Replay only emails that failed in this ingestion stage.')
+        parser.add_argument('--limit', type=int, default=100, help='Replay at most this many failed emails, oldest first.')
+
+    def handle(self, *args, **options):
+        failed_emails = FailedEmail.objects.filter(replayedAt__isnull=True).order_by('createdAt')
+        if options['ids']:
+            failed_emails = failed_emails.filter(pk__in=options['ids'])
+        if options['stage']:
+            failed_emails = failed_emails.filter(stage=options['stage'])
+
+        # The same parse, resolve and persist stages as fetch_emails, and its output
+        fetch = FetchEmailsCommand(stdout=self.stdout, stderr=self.stderr, no_color=options['no_color'])
+        fetch.senders = SenderResolver()
+        fetch.stats = IngestionStats()
+        defaults = fetch._load_defaults()
+        blacklist = fetch._load_blacklist()
+
+        total = {'replayed': 0, 'skipped': 0, 'failed': 0}
+        for failed_email in failed_emails[:options['limit']]:
+            raw_message = bytes(failed_email.rawMessage)
+            internaldate = failed_email.internalDate.encode() if failed_email.internalDate else None
+            # Only the address of the mailbox is stored on the ticket
+            mailbox = SimpleNamespace(email=failed_email.mailboxEmail)
+            try:
+                batch, = fetch._prepare_messages([raw_message], blacklist)
+                if isinstance(batch, StageFailed):
+                    raise batch
+                processed = fetch._process_message(mailbox, raw_message, internaldate, defaults, blacklist, batch)
+            except StageFailed as e:
+                dead_letter(failed_email.mailboxEmail, raw_message, internaldate, e, failed_email=failed_email)
+                self.stdout.write(self.style.ERROR(f'Failed email {failed_email.pk} failed again ({e}).'))
+                total['failed'] += 1
+                continue
+
+            # A blacklisted sender or an email that got in some other way leaves nothing to replay either
+            failed_email.replayedAt = timezone.now()
+            failed_email.save(update_fields=['replayedAt'])
+            total['replayed' if processed else 'skipped'] += 1
+
+        for line in fetch.stats.report():
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {total['replayed']}, skipped {total['skipped']}, failed {total['failed']}."
+        ))
@@ -0,0 +1,98 @@
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+from .models import TicketMessageChain, TicketMessageId
+
+
+def generate_message_id():
+    return f"<{uuid.uuid4()}@{settings.EMAIL_HOST.split(':')[-1]}>" # Use EMAIL_HOST for domain
+
+
+def message_id_hash(message_id):
+    """Returns the Thread.messageIdHash of ``message_id``, or None when it is empty."""
+    message_id = str(message_id or '').strip()
+    return hashlib.sha256(message_id.encode('utf-8', 'surrogateescape')).hexdigest() if message_id else None
+
+
+def parse_message_ids(value):
+    """Returns the Message-IDs in a Message-ID, In-Reply-To or References header, in order."""
+    if not value:
+        return []
+    message_ids = re.findall(r'<[^<>\s]+>', value)
+    if not message_ids:
+        # Some clients leave out the angle brackets
+        message_ids = [f'<{message_id.strip("<>")}>' for message_id in value.split()]
+    return message_ids
+
+
+def record_message_ids(ticket_id, message_ids):
+    """Maps ``message_ids`` to a ticket; ids already mapped to a ticket keep their first mapping."""
+    TicketMessageId.objects.bulk_create(
+        [TicketMessageId(messageId=message_id, ticket_id=ticket_id) for message_id in dict.fromkeys(message_ids)],
+        ignore_conflicts=True,
+    )
+
+
+def find_ticket_id(message_ids):
+    """
+    Returns the id of the ticket of the first of ``message_ids`` that is
+    known, resolving all of them with a single indexed IN query.
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return None
+    tickets = dict(TicketMessageId.objects.filter(messageId__in=message_ids).values_list('messageId', 'ticket_id'))
+    for message_id in message_ids:
+        if message_id in tickets:
+            return tickets[message_id]
+    return None
+
+
+def append_message_id(thread):
+    """
+    Appends a new thread's Message-ID to its ticket's chain and maps it to
+    the ticket. The chain is extended in the database, so concurrent inserts
+    on one ticket cannot overwrite each other.
+    """
+    if not thread.messageId:
+        return
+    record_message_ids(thread.ticket_id, parse_message_ids(thread.messageId)[:1])
+    changes = {'updatedAt': timezone.now()}
+    if thread.threadType == 'incoming_email':
+        changes['lastIncomingMessageId'] = thread.messageId
+    chain = TicketMessageChain.objects.filter(ticket_id=thread.ticket_id)
+    if chain.update(messageIds=Concat(F('messageIds'), Value(f' {thread.messageId}')), **changes):
+        return
+    try:
+        with transaction.atomic():
+            TicketMessageChain.objects.create(ticket_id=thread.ticket_id, messageIds=thread.messageId, **changes)
+    except IntegrityError:
+        # Another thread of this ticket created the chain first
+        chain.update(messageIds=Concat(F('messageIds'), Value(f' {thread.messageId}')), **changes)
+
+
+def get_reply_headers(ticket, message_id=None):
+    """
+    Returns the In-Reply-To and References headers of a new message on
+    ``ticket``, read from its message chain in a single query. ``message_id``
+    is the new message's own Message-ID, left out of its References.
+    """
+    chain = TicketMessageChain.objects.filter(ticket_id=ticket.id).values_list('messageIds', 'lastIncomingMessageId').first()
+    headers = {}
+    if message_id:
+        headers['Message-ID'] = message_id
+    if not chain:
+        return headers
+    message_ids, last_incoming = chain
+    references = ' '.join(reference for reference in message_ids.split() if reference != message_id)
+    if last_incoming:
+        headers['In-Reply-To'] = last_incoming
+    if references:
+        headers['References'] = references
+    return headers
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:15
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    # CREATE INDEX CONCURRENTLY is PostgreSQL-only; other databases build the index normally
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without blocking writes to uv_ticket, which a transaction would prevent
+    atomic = False
+
+    dependencies = [
+        ('ticket', '0010_tag_colorcode'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(fields=['-createdAt', '-id'], name='uv_ticket_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(fields=['isTrashed', 'status', '-createdAt'], name='uv_ticket_trash_status_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(fields=['status', '-createdAt'], name='uv_ticket_status_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(fields=['agent', '-createdAt'], name='uv_ticket_agent_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(fields=['customer', '-createdAt'], name='uv_ticket_cust_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('agent__isnull', True)), fields=['-createdAt'], name='uv_ticket_unassigned_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_new', True)), fields=['-createdAt'], name='uv_ticket_new_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('isReplied', False)), fields=['-createdAt'], name='uv_ticket_unanswered_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('isStarred', True)), fields=['-createdAt'], name='uv_ticket_starred_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('isTrashed', True)), fields=['-createdAt'], name='uv_ticket_trashed_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POSTGRESQL_FORWARD = [
+    """ALTER TABLE uv_ticket_search ADD COLUMN search_vector tsvector
+       GENERATED ALWAYS AS (to_tsvector('english', document)) STORED""",
+    "CREATE INDEX uv_ticket_search_vector_idx ON uv_ticket_search USING GIN (search_vector)",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS uv_ticket_search_vector_idx",
+    "ALTER TABLE uv_ticket_search DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE uv_ticket_search_fts USING fts5(
+       document, content='uv_ticket_search', content_rowid='ticket_id', tokenize='porter unicode61')""",
+    """CREATE TRIGGER uv_ticket_search_ai AFTER INSERT ON uv_ticket_search BEGIN
+       INSERT INTO uv_ticket_search_fts(rowid, document) VALUES (new.ticket_id, new.document);
+       END""",
+    """CREATE TRIGGER uv_ticket_search_ad AFTER DELETE ON uv_ticket_search BEGIN
+       INSERT INTO uv_ticket_search_fts(uv_ticket_search_fts, rowid, document) VALUES ('delete', old.ticket_id, old.document);
+       END""",
+    """CREATE TRIGGER uv_ticket_search_au AFTER UPDATE ON uv_ticket_search BEGIN
+       INSERT INTO uv_ticket_search_fts(uv_ticket_search_fts, rowid, document) VALUES ('delete', old.ticket_id, old.document);
+       INSERT INTO uv_ticket_search_fts(rowid, document) VALUES (new.ticket_id, new.document);
+       END""",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS uv_ticket_search_au",
+    "DROP TRIGGER IF EXISTS uv_ticket_search_ad",
+    "DROP TRIGGER IF EXISTS uv_ticket_search_ai",
+    "DROP TABLE IF EXISTS uv_ticket_search_fts",
+]
+
+
+def _run_for_vendor(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_full_text_index = _run_for_vendor({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD})
+drop_full_text_index = _run_for_vendor({'postgresql': POSTGRESQL_REVERSE, 'sqlite': SQLITE_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0011_ticket_queue_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSearchDocument',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='ticket.ticket')),
+                ('document', models.TextField(blank=True, default='')),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Ticket Search Document',
+                'verbose_name_plural': 'Ticket Search Documents',
+                'db_table': 'uv_ticket_search',
+            },
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
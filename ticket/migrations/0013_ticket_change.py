@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0012_ticket_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changeType', models.CharField(choices=[('created', 'New ticket'), ('status', 'Status change'), ('assigned', 'Assignment')], max_length=20)),
+                ('previousValue', models.BigIntegerField(blank=True, null=True)),
+                ('newValue', models.BigIntegerField(blank=True, null=True)),
+                ('createdAt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='ticket.ticket')),
+            ],
+            options={
+                'verbose_name': 'Ticket Change',
+                'verbose_name_plural': 'Ticket Changes',
+                'db_table': 'uv_ticket_change',
+            },
+        ),
+    ]
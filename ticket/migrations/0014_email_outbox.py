@@ -0,0 +1,41 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0013_ticket_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.TextField()),
+                ('body', models.TextField(blank=True, default='')),
+                ('fromEmail', models.CharField(max_length=191)),
+                ('to', models.JSONField(default=list)),
+                ('cc', models.JSONField(blank=True, default=list)),
+                ('bcc', models.JSONField(blank=True, default=list)),
+                ('headers', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('lastError', models.TextField(blank=True, null=True)),
+                ('nextAttemptAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sentAt', models.DateTimeField(blank=True, null=True)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='ticket.thread')),
+            ],
+            options={
+                'verbose_name': 'Email Outbox',
+                'verbose_name_plural': 'Email Outbox',
+                'db_table': 'uv_email_outbox',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['nextAttemptAt'], name='uv_outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+from itertools import groupby
+
+
+def build_message_chains(apps, schema_editor):
+    Thread = apps.get_model('ticket', 'Thread')
+    TicketMessageChain = apps.get_model('ticket', 'TicketMessageChain')
+
+    threads = Thread.objects.exclude(messageId__isnull=True).exclude(messageId='')
+    rows = threads.order_by('ticket_id', 'createdAt', 'id').values_list('ticket_id', 'messageId', 'threadType').iterator()
+    chains = []
+    for ticket_id, ticket_threads in groupby(rows, key=lambda row: row[0]):
+        ticket_threads = list(ticket_threads)
+        incoming = [message_id for _, message_id, thread_type in ticket_threads if thread_type == 'incoming_email']
+        chains.append(TicketMessageChain(
+            ticket_id=ticket_id,
+            messageIds=' '.join(message_id for _, message_id, _ in ticket_threads),
+            lastIncomingMessageId=incoming[-1] if incoming else None,
+        ))
+        if len(chains) >= 1000:
+            TicketMessageChain.objects.bulk_create(chains)
+            chains = []
+    TicketMessageChain.objects.bulk_create(chains)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0014_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketMessageChain',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='message_chain', serialize=False, to='ticket.ticket')),
+                ('messageIds', models.TextField(blank=True, default='')),
+                ('lastIncomingMessageId', models.TextField(blank=True, null=True)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Ticket Message Chain',
+                'verbose_name_plural': 'Ticket Message Chains',
+                'db_table': 'uv_ticket_message_chain',
+            },
+        ),
+        migrations.RunPython(build_message_chains, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import re
+
+
+def map_message_ids(apps, schema_editor):
+    Thread = apps.get_model('ticket', 'Thread')
+    Ticket = apps.get_model('ticket', 'Ticket')
+    TicketMessageId = apps.get_model('ticket', 'TicketMessageId')
+
+    def rows():
+        threads = Thread.objects.exclude(messageId__isnull=True).exclude(messageId='').order_by('createdAt', 'id')
+        for ticket_id, message_id in threads.values_list('ticket_id', 'messageId').iterator():
+            yield from ((ticket_id, found) for found in re.findall(r'<[^<>\s]+>', message_id)[:1])
+        tickets = Ticket.objects.exclude(reference_ids__isnull=True).exclude(reference_ids='').order_by('id')
+        for ticket_id, references in tickets.values_list('id', 'reference_ids').iterator():
+            yield from ((ticket_id, found) for found in re.findall(r'<[^<>\s]+>', references))
+
+    batch = []
+    for ticket_id, message_id in rows():
+        batch.append(TicketMessageId(ticket_id=ticket_id, messageId=message_id))
+        if len(batch) >= 1000:
+            TicketMessageId.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TicketMessageId.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0015_ticket_message_chain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketMessageId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('messageId', models.TextField(unique=True)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_ids', to='ticket.ticket')),
+            ],
+            options={
+                'verbose_name': 'Ticket Message ID',
+                'verbose_name_plural': 'Ticket Message IDs',
+                'db_table': 'uv_ticket_message_id',
+            },
+        ),
+        migrations.RunPython(map_message_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:52
+
+from django.db import migrations, models
+import hashlib
+
+
+def hash_message_ids(apps, schema_editor):
+    # Earlier duplicates of a Message-ID keep a NULL hash, so the unique index can be built
+    Thread = apps.get_model('ticket', 'Thread')
+    threads = Thread.objects.exclude(messageId__isnull=True).exclude(messageId='').order_by('id')
+    seen = set()
+    batch = []
+    for thread in threads.only('id', 'messageId').iterator():
+        message_id = thread.messageId.strip()
+        if not message_id:
+            continue
+        digest = hashlib.sha256(message_id.encode()).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        thread.messageIdHash = digest
+        batch.append(thread)
+        if len(batch) >= 1000:
+            Thread.objects.bulk_update(batch, ['messageIdHash'])
+            batch = []
+    Thread.objects.bulk_update(batch, ['messageIdHash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0016_ticket_message_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='messageIdHash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_message_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0017_thread_message_id_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='thread',
+            name='messageIdHash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
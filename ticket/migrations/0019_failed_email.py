@@ -0,0 +1,36 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0018_thread_message_id_hash_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mailboxEmail', models.CharField(blank=True, max_length=191, null=True)),
+                ('messageId', models.TextField(blank=True, null=True)),
+                ('subject', models.TextField(blank=True, null=True)),
+                ('stage', models.CharField(choices=[('fetch', 'Fetch'), ('parse', 'Parse'), ('resolve', 'Resolve'), ('persist', 'Persist'), ('flag', 'Flag')], max_length=20)),
+                ('error', models.TextField()),
+                ('rawMessage', models.BinaryField()),
+                ('internalDate', models.TextField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=1)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lastAttemptAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('replayedAt', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Failed Email',
+                'verbose_name_plural': 'Failed Emails',
+                'db_table': 'uv_failed_email',
+            },
+        ),
+    ]
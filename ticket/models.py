@@ -1,5 +1,6 @@
 from django.db import models
 from django.utils import timezone
+from .constants import TICKET_CHANGE_TYPES, OUTBOX_STATUSES, INGESTION_STAGES
 
 
 class Ticket(models.Model):
@@ -40,10 +41,71 @@ class Ticket(models.Model):
         verbose_name = "Ticket"
         verbose_name_plural = "Tickets"
         db_table = "uv_ticket"
+        # Shaped after the ticket queue filters, which always sort by -createdAt
+        indexes = [
+            models.Index(fields=['-createdAt', '-id'], name='uv_ticket_created_idx'),
+            models.Index(fields=['isTrashed', 'status', '-createdAt'], name='uv_ticket_trash_status_idx'),
+            models.Index(fields=['status', '-createdAt'], name='uv_ticket_status_created_idx'),
+            models.Index(fields=['agent', '-createdAt'], name='uv_ticket_agent_created_idx'),
+            models.Index(fields=['customer', '-createdAt'], name='uv_ticket_cust_created_idx'),
+            models.Index(fields=['-createdAt'], name='uv_ticket_unassigned_idx', condition=models.Q(agent__isnull=True)),
+            models.Index(fields=['-createdAt'], name='uv_ticket_new_idx', condition=models.Q(is_new=True)),
+            models.Index(fields=['-createdAt'], name='uv_ticket_unanswered_idx', condition=models.Q(isReplied=False)),
+            models.Index(fields=['-createdAt'], name='uv_ticket_starred_idx', condition=models.Q(isStarred=True)),
+            models.Index(fields=['-createdAt'], name='uv_ticket_trashed_idx', condition=models.Q(isTrashed=True)),
+        ]
 
     def __str__(self):
         return self.subject or f"Ticket #{self.id}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so post_save receivers can tell which fields changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Refreshed after the post_save receivers have compared against the old values
+        update_fields = kwargs.get('update_fields')
+        fields = self._meta.concrete_fields if update_fields is None else [self._meta.get_field(name) for name in update_fields]
+        loaded = getattr(self, '_loaded_values', {})
+        loaded.update((field.attname, self.__dict__[field.attname]) for field in fields if field.attname in self.__dict__)
+        self._loaded_values = loaded
+
+
+class TicketSearchDocument(models.Model):
+    # Subject, customer email and HTML-stripped thread text, full-text indexed by ticket.search
+    ticket = models.OneToOneField(Ticket, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = models.TextField(blank=True, default='')
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Ticket Search Document"
+        verbose_name_plural = "Ticket Search Documents"
+        db_table = "uv_ticket_search"
+
+    def __str__(self):
+        return f"Search document for ticket #{self.ticket_id}"
+
+
+class TicketChange(models.Model):
+    # Append-only feed of ticket queue changes, read by the ticket event stream
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='changes')
+    changeType = models.CharField(max_length=20, choices=TICKET_CHANGE_TYPES)
+    previousValue = models.BigIntegerField(null=True, blank=True)
+    newValue = models.BigIntegerField(null=True, blank=True)
+    createdAt = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Ticket Change"
+        verbose_name_plural = "Ticket Changes"
+        db_table = "uv_ticket_change"
+
+    def __str__(self):
+        return f"{self.get_changeType_display()} on ticket #{self.ticket_id}"
+
 
 class TicketCollaboratorsThrough(models.Model):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE)
@@ -74,6 +136,8 @@ class Thread(models.Model):
     user = models.ForeignKey('authentication.UserInstance', on_delete=models.SET_NULL, null=True, blank=True)
     source = models.CharField(max_length=191)
     messageId = models.TextField(null=True, blank=True)
+    # SHA-256 of messageId, set on save; the unique index keeps one email from becoming two threads
+    messageIdHash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     threadType = models.CharField(max_length=191)
     createdBy = models.CharField(max_length=191)
     cc = models.JSONField(null=True, blank=True)
@@ -96,6 +160,86 @@ class Thread(models.Model):
     def __str__(self):
         return f"Thread for {self.ticket.subject} by {self.user.user.email if self.user and self.user.user else 'N/A'}"
 
+class TicketMessageChain(models.Model):
+    # Message-IDs of a ticket's email threads in the order they were added, read to build threading headers
+    ticket = models.OneToOneField(Ticket, on_delete=models.CASCADE, primary_key=True, related_name='message_chain')
+    messageIds = models.TextField(blank=True, default='')
+    lastIncomingMessageId = models.TextField(null=True, blank=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Ticket Message Chain"
+        verbose_name_plural = "Ticket Message Chains"
+        db_table = "uv_ticket_message_chain"
+
+    def __str__(self):
+        return f"Message chain for ticket #{self.ticket_id}"
+
+class TicketMessageId(models.Model):
+    # Message-ID -> ticket, for threading incoming replies: thread Message-IDs and the References of a ticket's first email
+    messageId = models.TextField(unique=True)
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='message_ids')
+    createdAt = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Ticket Message ID"
+        verbose_name_plural = "Ticket Message IDs"
+        db_table = "uv_ticket_message_id"
+
+    def __str__(self):
+        return f"{self.messageId} -> ticket #{self.ticket_id}"
+
+class EmailOutbox(models.Model):
+    # Outgoing email of a thread, written with the thread and delivered by the process_outbox command
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='outbox')
+    subject = models.TextField()
+    body = models.TextField(blank=True, default='')
+    fromEmail = models.CharField(max_length=191)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=OUTBOX_STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    lastError = models.TextField(null=True, blank=True)
+    nextAttemptAt = models.DateTimeField(default=timezone.now)
+    createdAt = models.DateTimeField(default=timezone.now)
+    sentAt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email Outbox"
+        verbose_name_plural = "Email Outbox"
+        db_table = "uv_email_outbox"
+        indexes = [
+            models.Index(fields=['nextAttemptAt'], name='uv_outbox_pending_idx', condition=models.Q(status='pending')),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+class FailedEmail(models.Model):
+    # Raw email whose ingestion failed, kept until the replay_failed_emails command gets it in
+    mailboxEmail = models.CharField(max_length=191, null=True, blank=True)
+    messageId = models.TextField(null=True, blank=True)
+    subject = models.TextField(null=True, blank=True)
+    stage = models.CharField(max_length=20, choices=INGESTION_STAGES)
+    error = models.TextField()
+    rawMessage = models.BinaryField()
+    # The IMAP INTERNALDATE the message was fetched with, its received time on replay
+    internalDate = models.TextField(null=True, blank=True)
+    attempts = models.IntegerField(default=1)
+    createdAt = models.DateTimeField(default=timezone.now)
+    lastAttemptAt = models.DateTimeField(default=timezone.now)
+    replayedAt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Failed Email"
+        verbose_name_plural = "Failed Emails"
+        db_table = "uv_failed_email"
+
+    def __str__(self):
+        return f"{self.subject or self.messageId} ({self.stage} failed)"
+
 class Attachment(models.Model):
     thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='attachments')
     name = models.TextField(null=True, blank=True)
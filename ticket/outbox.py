@@ -0,0 +1,143 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from settings.email_backend import get_mailbox_transport_id
+from .constants import OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, OUTBOX_MAX_RETRY_DELAY, OUTBOX_CLAIM_TIMEOUT, OUTBOX_MAX_WORKERS
+from .models import EmailOutbox, Thread
+
+
+def queue_email(thread, message):
+    """
+    Stores ``message`` in the outbox for delivery by the process_outbox
+    command. Call it in the transaction that saves ``thread`` so the thread
+    and its email are committed, or rolled back, together.
+    """
+    entry = EmailOutbox.objects.create(
+        thread=thread,
+        subject=message.subject,
+        body=message.body,
+        fromEmail=message.from_email,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        headers=dict(message.extra_headers),
+    )
+    Thread.objects.filter(pk=thread.pk).update(deliveryStatus='queued')
+    thread.deliveryStatus = 'queued'
+    return entry
+
+
+def build_message(entry, email_connection=None):
+    message = EmailMessage(
+        entry.subject,
+        entry.body,
+        entry.fromEmail,
+        entry.to,
+        bcc=entry.bcc,
+        cc=entry.cc,
+        headers=entry.headers,
+        connection=email_connection,
+    )
+    message.content_subtype = "html"
+    return message
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after ``attempts`` failed sends."""
+    return min(OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Returns up to ``batch_size`` due outbox entries and pushes their next
+    attempt past OUTBOX_CLAIM_TIMEOUT, so other workers skip them and a
+    worker that dies mid-batch only delays them. On databases without
+    SKIP LOCKED, run a single worker.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = EmailOutbox.objects.filter(status='pending', nextAttemptAt__lte=now).order_by('nextAttemptAt', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True, of=('self',))
+        queryset = queryset.annotate(mailboxEmail=F('thread__ticket__mailboxEmail'))
+        entries = list(queryset[:batch_size])
+        if entries:
+            EmailOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                nextAttemptAt=now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)
+            )
+    return entries
+
+
+def _deliver(entries, transport_id, max_attempts, in_thread=False):
+    """Sends ``entries`` over one connection to their transport and records each outcome on the entry."""
+    now = timezone.now()
+    email_connection = get_connection(fail_silently=False, transport_id=transport_id)
+    try:
+        for entry in entries:
+            entry.attempts += 1
+            try:
+                email_connection.open()
+                email_connection.send_messages([build_message(entry, email_connection)])
+            except Exception as e:
+                # The connection may be unusable after an error; the next entry reopens it
+                email_connection.close()
+                entry.lastError = str(e) or e.__class__.__name__
+                if entry.attempts >= max_attempts:
+                    entry.status = 'failed'
+                else:
+                    entry.nextAttemptAt = now + timedelta(seconds=retry_delay(entry.attempts))
+            else:
+                entry.status = 'sent'
+                entry.sentAt = timezone.now()
+    finally:
+        email_connection.close()
+        if in_thread:
+            connection.close()
+
+
+def process_outbox(batch_size=100, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """
+    Sends one batch of due outbox entries and records the outcome on the
+    entries and their threads. Each entry goes out through the transport of
+    the mailbox its ticket arrived on; entries for different transports are
+    sent in parallel, each group over a single connection. Failed sends are
+    retried with exponential backoff until ``max_attempts`` is reached.
+    Returns the number of entries sent, rescheduled and given up on.
+    """
+    results = {'sent': 0, 'retrying': 0, 'failed': 0}
+    entries = claim_outbox_batch(batch_size)
+    if not entries:
+        return results
+
+    by_transport = defaultdict(list)
+    for entry in entries:
+        by_transport[get_mailbox_transport_id(entry.mailboxEmail)].append(entry)
+    if len(by_transport) == 1:
+        transport_id, group = by_transport.popitem()
+        _deliver(group, transport_id, max_attempts)
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(by_transport), OUTBOX_MAX_WORKERS)) as executor:
+            futures = [
+                executor.submit(_deliver, group, transport_id, max_attempts, in_thread=True)
+                for transport_id, group in by_transport.items()
+            ]
+            for future in futures:
+                future.result()
+
+    outcomes = {'sent': [], 'retrying': [], 'failed': []}
+    for entry in entries:
+        outcomes['retrying' if entry.status == 'pending' else entry.status].append(entry)
+    with transaction.atomic():
+        EmailOutbox.objects.bulk_update(
+            entries, ['status', 'attempts', 'lastError', 'nextAttemptAt', 'sentAt']
+        )
+        for status, group in outcomes.items():
+            if group:
+                Thread.objects.filter(pk__in={entry.thread_id for entry in group}).update(deliveryStatus=status)
+            results[status] = len(group)
+    return results
@@ -0,0 +1,122 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """A page of results read with keyset pagination, plus opaque cursors to its neighbours."""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def encode_cursor(values, direction):
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    payload = json.dumps({'v': values, 'd': direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values, direction = payload['v'], payload['d']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("Malformed cursor.")
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor("Malformed cursor.")
+    return values, direction
+
+
+def _keyset_q(fields, values, descending):
+    # (a, b) < (x, y)  ==  a < x OR (a = x AND b < y)
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for index, field in enumerate(fields):
+        term = Q(**{f'{field}__{lookup}': values[index]})
+        for previous_field, previous_value in zip(fields[:index], values[:index]):
+            term &= Q(**{previous_field: previous_value})
+        condition |= term
+    return condition
+
+
+def _cursor_value(model, field, value):
+    if field == 'pk':
+        model_field = model._meta.pk
+    else:
+        try:
+            model_field = model._meta.get_field(field)
+        except FieldDoesNotExist:
+            # Annotations such as a search rank are compared with their JSON value
+            return value
+    return model_field.to_python(value)
+
+
+def _item_value(item, field):
+    return item[field] if isinstance(item, dict) else getattr(item, field)
+
+
+def paginate_keyset(queryset, cursor=None, per_page=100, ordering=('-createdAt', '-id')):
+    """
+    Returns a KeysetPage of ``queryset`` ordered by ``ordering``.
+
+    ``ordering`` must end with a unique field and use one direction for every
+    field; annotations such as a search rank may be used as well. Instead of
+    an OFFSET, each page filters on the position of the last row seen, so
+    reading page 1000 costs the same as reading page 1 and no COUNT(*) is
+    needed. Raises InvalidCursor for cursors that cannot be read.
+    """
+    descending = ordering[0].startswith('-')
+    fields = [field.lstrip('-') for field in ordering]
+    reversed_ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+    direction = 'next'
+    if cursor:
+        values, direction = decode_cursor(cursor)
+        if len(values) != len(fields):
+            raise InvalidCursor("Cursor does not match the ordering.")
+        try:
+            values = [_cursor_value(queryset.model, field, value) for field, value in zip(fields, values)]
+        except ValidationError:
+            raise InvalidCursor("Cursor does not match the ordering.")
+        queryset = queryset.filter(_keyset_q(fields, values, descending if direction == 'next' else not descending))
+
+    rows = list(queryset.order_by(*(ordering if direction == 'next' else reversed_ordering))[:per_page + 1])
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    if direction == 'next':
+        has_next, has_previous = has_more, bool(cursor)
+    else:
+        has_next, has_previous = True, has_more
+
+    next_cursor = None
+    previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor([_item_value(rows[-1], field) for field in fields], 'next')
+    if rows and has_previous:
+        previous_cursor = encode_cursor([_item_value(rows[0], field) for field in fields], 'prev')
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,100 @@
+import html
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Concat, Length, Right, Substr
+from django.utils.html import strip_tags
+from .models import TicketSearchDocument
+
+# Must match the configuration used by the tsvector column in migration 0012
+SEARCH_CONFIG = 'english'
+# PostgreSQL rejects tsvectors over 1MB, so very long conversations keep only their latest text
+SEARCH_DOCUMENT_MAX_LENGTH = 500000
+
+
+def html_to_text(value):
+    """Strips tags and entities from an HTML message and collapses whitespace."""
+    text = html.unescape(strip_tags(value or ''))
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _document_header(ticket):
+    customer_email = ticket.customer.user.email if ticket.customer and ticket.customer.user else ''
+    return f"{html_to_text(ticket.subject)}\n{customer_email or ''}\n"
+
+
+def build_ticket_document(ticket):
+    messages = ticket.threads.order_by('createdAt', 'id').values_list('message', flat=True)
+    text = ' '.join(filter(None, (html_to_text(message) for message in messages)))
+    header = _document_header(ticket)
+    # The oldest text goes first; the latest replies are the likeliest to be searched for
+    return header + text[max(len(text) - (SEARCH_DOCUMENT_MAX_LENGTH - len(header)), 0):]
+
+
+def index_ticket(ticket):
+    """(Re)builds the search document of a ticket from its subject, customer and threads."""
+    TicketSearchDocument.objects.update_or_create(ticket=ticket, defaults={'document': build_ticket_document(ticket)})
+
+
+def index_ticket_subject(ticket):
+    """Refreshes the search document after a ticket save, rebuilding it only when the header changed."""
+    header = _document_header(ticket)
+    current = TicketSearchDocument.objects.filter(ticket=ticket).annotate(
+        header=Substr('document', 1, len(header))
+    ).values_list('header', flat=True).first()
+    if current != header:
+        index_ticket(ticket)
+
+
+def index_thread(thread):
+    """
+    Appends a new thread's text to its ticket's search document in a single
+    UPDATE, so the document is neither read back nor locked beyond the
+    statement. Past SEARCH_DOCUMENT_MAX_LENGTH the oldest thread text is
+    dropped and the header kept.
+    """
+    text = html_to_text(thread.message)
+    if not text:
+        return
+    documents = TicketSearchDocument.objects.filter(ticket_id=thread.ticket_id)
+    appended = Concat('document', Value(f' {text}'))
+    updated = documents.alias(length=Length('document')).filter(
+        length__lte=SEARCH_DOCUMENT_MAX_LENGTH - len(text) - 1
+    ).update(document=appended)
+    if not updated:
+        header = _document_header(thread.ticket)
+        updated = documents.update(document=Concat(Value(header), Right(appended, SEARCH_DOCUMENT_MAX_LENGTH - len(header))))
+    if not updated:
+        index_ticket(thread.ticket)
+
+
+def _fts5_query(query):
+    # Quote every term so user input cannot use FTS5 operators; terms are ANDed
+    return ' '.join('"%s"' % term.replace('"', '""') for term in query.split())
+
+
+def search_ticket_documents(query):
+    """
+    Returns the TicketSearchDocument queryset matching ``query``, annotated
+    with a ``rank`` where higher is more relevant. Uses the tsvector/GIN index
+    on PostgreSQL and FTS5 on SQLite, with a substring match elsewhere.
+    """
+    documents = TicketSearchDocument.objects.only('ticket')
+    if connection.vendor == 'postgresql':
+        tsquery = f"plainto_tsquery('{SEARCH_CONFIG}', %s)"
+        # float8 so the rank survives a round trip through a pagination cursor unchanged
+        return documents.annotate(
+            rank=RawSQL(f'ts_rank("uv_ticket_search"."search_vector", {tsquery})::float8', [query], output_field=FloatField())
+        ).filter(RawSQL(f'"uv_ticket_search"."search_vector" @@ {tsquery}', [query], output_field=BooleanField()))
+    elif connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        return documents.annotate(
+            rank=RawSQL(
+                'SELECT -bm25(uv_ticket_search_fts) FROM uv_ticket_search_fts '
+                'WHERE uv_ticket_search_fts MATCH %s AND uv_ticket_search_fts.rowid = "uv_ticket_search"."ticket_id"',
+                [match], output_field=FloatField()
+            )
+        ).filter(pk__in=RawSQL('SELECT rowid FROM uv_ticket_search_fts WHERE uv_ticket_search_fts MATCH %s', [match]))
+    return documents.filter(document__icontains=query).annotate(rank=Value(0.0, output_field=FloatField()))
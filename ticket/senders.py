@@ -0,0 +1,85 @@
+from authentication.models import User, UserInstance, SupportRole
+from .models import TicketCollaboratorsThrough
+
+
+def split_name(full_name):
+    """Returns (first name, last name) the way fetched senders are named, cut to the lengths User stores."""
+    parts = full_name.split(' ') if full_name else []
+    first_name = parts[0] if parts else 'Unknown'
+    last_name = ' '.join(parts[1:])
+    return (
+        first_name[:User._meta.get_field('firstName').max_length],
+        last_name[:User._meta.get_field('lastName').max_length],
+    )
+
+
+class SenderResolver:
+    """
+    Resolves the addresses of fetched emails to the UserInstances they
+    create tickets and collaborations as, a whole batch of messages at a
+    time. The ROLE_CUSTOMER role given to new instances is read once per
+    resolver, so one resolver should serve a whole fetch run.
+    """
+
+    def __init__(self):
+        self._customer_role = None
+
+    @property
+    def customer_role(self):
+        if self._customer_role is None:
+            self._customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        return self._customer_role
+
+    def resolve(self, addresses):
+        """
+        Takes {email address: full name or None} and returns
+        ({lowercased address: email UserInstance}, [addresses of new users]).
+        Users and instances that do not exist yet are bulk-created; this
+        takes four queries however many addresses there are. Addresses too
+        long for User.email are left out rather than failing the batch.
+        """
+        max_length = User._meta.get_field('email').max_length
+        names = {}
+        for address, full_name in addresses.items():
+            address = address.strip().lower()
+            if address and len(address) <= max_length and not names.get(address):
+                names[address] = full_name
+
+        users = {user.email: user for user in User.objects.filter(email__in=names)}
+        new_emails = [address for address in names if address not in users]
+        if new_emails:
+            new_users = []
+            # In address order, so concurrent transactions inserting the same users cannot deadlock
+            for address in sorted(new_emails):
+                first_name, last_name = split_name(names[address])
+                new_users.append(User(email=address, firstName=first_name, lastName=last_name, isEnabled=True, is_active=True))
+            # A concurrent fetch may create some of them first; the re-read picks up either copy
+            User.objects.bulk_create(new_users, ignore_conflicts=True)
+            users.update((user.email, user) for user in User.objects.filter(email__in=new_emails))
+
+        instances = {}
+        # The oldest instance wins if a race ever created two for a user
+        for instance in UserInstance.objects.filter(user__in=users.values(), source='email').order_by('-id'):
+            instances[instance.user_id] = instance
+        new_instances = [
+            UserInstance(user=user, source='email', isActive=True, isVerified=True, supportRole=self.customer_role)
+            for user in users.values() if user.id not in instances
+        ]
+        if new_instances:
+            for instance in UserInstance.objects.bulk_create(new_instances):
+                instances[instance.user_id] = instance
+
+        resolved = {}
+        for address, user in users.items():
+            instance = instances[user.id]
+            instance.user = user
+            resolved[address] = instance
+        return resolved, new_emails
+
+
+def add_collaborators(ticket, user_instances):
+    """Adds ``user_instances`` to the ticket's collaborators in one insert, skipping existing ones."""
+    TicketCollaboratorsThrough.objects.bulk_create(
+        [TicketCollaboratorsThrough(ticket=ticket, user=user_instance) for user_instance in user_instances],
+        ignore_conflicts=True,
+    )
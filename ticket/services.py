@@ -1,5 +1,13 @@
-from authentication.models import User, UserInstance, SupportRole
+from authentication.models import User, UserInstance, SupportRole, SupportGroup, SupportTeam
+from django.db import connections, transaction
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
+from .lookups import get_lookup
+from .pagination import paginate_keyset, InvalidCursor
+from .constants import TICKET_SIDEBAR_FILTERS, TICKET_COUNT_THRESHOLD, THREAD_WINDOW_SIZE, TICKET_CHANGE_GAP_WINDOW
+from .models import Ticket, TicketChange, TicketStatus, TicketPriority, TicketType, Tag, TicketTagsThrough, SupportLabel, TicketLabelsThrough, AgentActivity
 import re
 
 def get_or_create_user_instance(email_address, full_name=None):
@@ -30,4 +38,423 @@ def get_or_create_user_instance(email_address, full_name=None):
             'supportRole': customer_role,
         }
     )
-    return user_instance
\ No newline at end of file
+    return user_instance
+
+def format_count(count):
+    if 100 <= count <= 199:
+        return "100+"
+    elif 600 <= count <= 699:
+        return "600+"
+    elif count >= TICKET_COUNT_THRESHOLD:
+        return "1000+"
+    else:
+        return str(count)
+
+def get_ticket_rows(tickets):
+    """
+    Projects a ticket queryset down to the columns shown in the ticket list.
+    The customer, agent, status and priority are joined into the same query
+    so rendering a page of rows costs one query instead of one per row.
+    """
+    return tickets.select_related('customer__user', 'agent__user', 'status', 'priority').only(
+        'id', 'subject', 'createdAt',
+        'customer__user__email', 'agent__user__email',
+        'status__description', 'priority__description',
+    )
+
+def serialize_ticket_row(ticket):
+    return {
+        'id': ticket.id,
+        'subject': ticket.subject,
+        'customer_email': ticket.customer.user.email if ticket.customer and ticket.customer.user else 'N/A',
+        'status_description': ticket.status.description if ticket.status else 'N/A',
+        'priority_description': ticket.priority.description if ticket.priority else 'N/A',
+        'agent_email': ticket.agent.user.email if ticket.agent and ticket.agent.user else 'Unassigned',
+        'created_at': ticket.createdAt.strftime("%b %d, %Y %H:%M"),
+    }
+
+def get_ticket_filter_q(filter_type, user):
+    """
+    Returns the Q object for a sidebar filter key. Unknown keys and 'all'
+    match every ticket.
+    """
+    if filter_type == 'new':
+        return Q(is_new=True)
+    elif filter_type == 'unassigned':
+        return Q(agent__isnull=True)
+    elif filter_type == 'unanswered':
+        return Q(isReplied=False)
+    elif filter_type == 'my_tickets':
+        return Q(agent__in=UserInstance.objects.filter(user=user).values('id'))
+    elif filter_type == 'starred':
+        return Q(isStarred=True)
+    elif filter_type == 'trashed':
+        return Q(isTrashed=True)
+    return Q()
+
+def bounded_counts(querysets, limit=TICKET_COUNT_THRESHOLD + 1):
+    """
+    Counts each queryset of a {key: queryset} dict, stopping at ``limit`` rows.
+
+    Every count runs over a ``LIMIT`` subquery so a bucket never scans more
+    than ``limit`` rows, and all buckets are sent as one SELECT so the whole
+    dict costs a single round trip. Counts of ``limit`` or more only mean
+    "at least ``limit``", which is all format_count needs.
+    """
+    if not querysets:
+        return {}
+
+    connection = connections[next(iter(querysets.values())).db]
+    columns = []
+    params = []
+    for index, queryset in enumerate(querysets.values()):
+        sql, queryset_params = queryset.order_by().values('pk')[:limit].query.sql_with_params()
+        columns.append(f'(SELECT COUNT(*) FROM ({sql}) bounded_{index})')
+        params.extend(queryset_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns), params)
+        row = cursor.fetchone()
+    return dict(zip(querysets.keys(), row))
+
+def get_ticket_count_buckets(tickets, user):
+    """
+    Builds the querysets behind every sidebar, status and label count.
+    Returns (statuses, labels, buckets) where buckets maps a count key to
+    the queryset it counts.
+    """
+    tickets = tickets.order_by()
+    statuses = get_lookup('statuses')
+
+    # Only show labels associated with the current agent's user instance
+    labels = []
+    current_agent_user_instance = user.user_instances.first()
+    if current_agent_user_instance:
+        labels = list(SupportLabel.objects.filter(user=current_agent_user_instance).order_by('name'))
+
+    buckets = {key: tickets.filter(get_ticket_filter_q(key, user)) for key, _ in TICKET_SIDEBAR_FILTERS}
+    for status in statuses:
+        buckets[f'status_{status.id}'] = tickets.filter(status_id=status.id)
+    for label in labels:
+        buckets[f'label_{label.id}'] = TicketLabelsThrough.objects.filter(label_id=label.id, ticket__in=tickets.values('id'))
+    return statuses, labels, buckets
+
+def get_ticket_counts(tickets, user):
+    """
+    Computes the sidebar, status and label counts for a ticket queryset.
+
+    All buckets are read with bounded_counts, so each one stops scanning once
+    it passes the "1000+" display threshold and the whole sidebar costs one
+    query on top of loading the statuses and labels.
+    Returns (sidebar_filters, status_counts, label_counts) ready for the
+    ticket list template and the ticket API.
+    """
+    statuses, labels, buckets = get_ticket_count_buckets(tickets, user)
+    totals = bounded_counts(buckets)
+
+    sidebar_filters = {
+        key: {'label': label, 'count': format_count(totals[key])}
+        for key, label in TICKET_SIDEBAR_FILTERS
+    }
+    status_counts = {
+        status.code: {'label': status.description, 'count': format_count(totals[f'status_{status.id}'])}
+        for status in statuses
+    }
+    label_counts = {
+        label.id: {'label': label.name, 'count': format_count(totals[f'label_{label.id}'])}
+        for label in labels
+    }
+    return sidebar_filters, status_counts, label_counts
+
+class TicketChangeCursor:
+    """
+    Position of a reader in the TicketChange feed: the highest id it has
+    read, plus the lower ids that were not visible yet when it read past
+    them. Ids are taken when a row is inserted but rows only become visible
+    when their transaction commits, so a higher id can be read first; the
+    gaps are read again until they show up, or are dropped once they are
+    more than TICKET_CHANGE_GAP_WINDOW ids behind (rolled back inserts).
+
+    str() is the form the event stream uses as its event id and the ticket
+    list as its count snapshot, e.g. "120:100-110,113".
+    """
+
+    def __init__(self, last_id=0, gaps=()):
+        self.last_id = last_id
+        self.gaps = set(gaps)
+
+    @classmethod
+    def parse(cls, value):
+        """Reads a cursor from its str() form; raises ValueError if it is malformed."""
+        last_id, _, ranges = str(value).partition(':')
+        last_id = int(last_id)
+        gaps = set()
+        for part in ranges.split(',') if ranges else []:
+            first, _, last = part.partition('-')
+            # Clipped to the window, so a crafted range cannot grow the set
+            first = max(int(first), last_id - TICKET_CHANGE_GAP_WINDOW + 1)
+            gaps.update(range(first, min(int(last or first), last_id - 1) + 1))
+        return cls(last_id, gaps)
+
+    @classmethod
+    def current(cls):
+        """A cursor at the latest change, with the gaps the feed has right now."""
+        # The window holds at most TICKET_CHANGE_GAP_WINDOW ids, so the newest that many rows cover it
+        visible = list(TicketChange.objects.order_by('-id').values_list('id', flat=True)[:TICKET_CHANGE_GAP_WINDOW])
+        last_id = visible[0] if visible else 0
+        floor = max(last_id - TICKET_CHANGE_GAP_WINDOW, 0)
+        return cls(last_id, set(range(floor + 1, last_id + 1)).difference(visible))
+
+    def advance(self, change_id):
+        """Records that the change ``change_id`` was read."""
+        if change_id <= self.last_id:
+            self.gaps.discard(change_id)
+            return
+        self.gaps.update(range(self.last_id + 1, change_id))
+        self.last_id = change_id
+        floor = self.last_id - TICKET_CHANGE_GAP_WINDOW
+        if self.gaps and min(self.gaps) <= floor:
+            self.gaps = {gap for gap in self.gaps if gap > floor}
+
+    def _ranges(self):
+        ranges = []
+        for gap in sorted(self.gaps):
+            if ranges and ranges[-1][1] == gap - 1:
+                ranges[-1][1] = gap
+            else:
+                ranges.append([gap, gap])
+        return ranges
+
+    def unread(self):
+        """Q of the changes after this cursor: the ids above ``last_id`` and those in its gaps."""
+        q = Q(id__gt=self.last_id)
+        for first, last in self._ranges():
+            q |= Q(id__range=(first, last))
+        return q
+
+    def __str__(self):
+        ranges = ','.join(str(first) if first == last else f'{first}-{last}' for first, last in self._ranges())
+        return f'{self.last_id}:{ranges}' if ranges else str(self.last_id)
+
+def get_ticket_changes(cursor, limit=100):
+    """
+    Returns the ticket queue changes after ``cursor`` as compact deltas for
+    the ticket event stream, lowest id first, and advances ``cursor`` past
+    them. Each delta's ``cursor`` is where a reader that stopped after it
+    resumes.
+
+    Each delta carries the current ticket row so the ticket list can patch it
+    in place, plus the previous and new status code or agent email so the
+    sidebar counters can be adjusted without recounting. A batch costs at
+    most four queries whatever its size.
+    """
+    changes = list(TicketChange.objects.filter(cursor.unread()).order_by('id')[:limit])
+    if not changes:
+        return []
+
+    rows = get_ticket_rows(Ticket.objects.all()).in_bulk({change.ticket_id for change in changes})
+    status_codes = {status.id: status.code for status in get_lookup('statuses')}
+    agent_ids = {
+        value for change in changes if change.changeType == 'assigned'
+        for value in (change.previousValue, change.newValue) if value
+    }
+    agent_emails = dict(UserInstance.objects.filter(id__in=agent_ids).values_list('id', 'user__email')) if agent_ids else {}
+
+    deltas = []
+    for change in changes:
+        cursor.advance(change.id)
+        ticket = rows.get(change.ticket_id)
+        if ticket is None:
+            continue
+        lookup = agent_emails if change.changeType == 'assigned' else status_codes
+        deltas.append({
+            'id': change.id,
+            'type': change.changeType,
+            'ticket': serialize_ticket_row(ticket),
+            'from': lookup.get(change.previousValue),
+            'to': lookup.get(change.newValue),
+            'cursor': str(cursor),
+        })
+    return deltas
+
+def _resolve_bulk_action(action, value):
+    """
+    Returns (fields to update, activity type) for a bulk ticket action,
+    using the same activity types as the single-ticket endpoints. Raises
+    ObjectDoesNotExist for unknown target ids.
+    """
+    unassign = value in (None, '', '0', 0)
+    if action == 'status':
+        status = TicketStatus.objects.get(id=value)
+        return {'status': status}, f"status_changed_to_{status.code}"
+    elif action == 'priority':
+        priority = TicketPriority.objects.get(id=value)
+        return {'priority': priority}, f"priority_changed_to_{priority.code}"
+    elif action == 'type':
+        ticket_type = TicketType.objects.get(id=value)
+        return {'type': ticket_type}, f"type_changed_to_{ticket_type.code}"
+    elif action == 'agent':
+        if unassign:
+            return {'agent': None}, "agent_unassigned"
+        agent = UserInstance.objects.select_related('user').get(id=value)
+        return {'agent': agent}, f"agent_assigned_to_{agent.user.email}"
+    elif action == 'group':
+        if unassign:
+            return {'supportGroup': None}, "group_unassigned"
+        group = SupportGroup.objects.get(id=value)
+        return {'supportGroup': group}, f"group_changed_to_{group.name}"
+    elif action == 'team':
+        if unassign:
+            return {'supportTeam': None}, "team_unassigned"
+        team = SupportTeam.objects.get(id=value)
+        return {'supportTeam': team}, f"team_changed_to_{team.name}"
+    elif action == 'trash':
+        return {'isTrashed': True}, "ticket_trashed"
+    elif action == 'restore':
+        return {'isTrashed': False}, "ticket_restored"
+    raise ValueError(f"Unknown bulk action: {action}")
+
+def apply_bulk_ticket_action(ticket_ids, action, value, agent):
+    """
+    Applies one action to many tickets and returns the number affected.
+
+    Field changes are written with a single UPDATE and tags with a single
+    INSERT for the tickets that do not have the tag yet, followed by one bulk_create of AgentActivity rows and of
+    TicketChange rows for the ticket event stream, so the cost does not
+    grow with the number of tickets. Signals are not sent for the updated
+    tickets.
+    """
+    with transaction.atomic():
+        rows = list(Ticket.objects.filter(id__in=ticket_ids).values_list(
+            'id', 'status_id', 'agent_id', 'customer__user__firstName', 'customer__user__lastName'
+        ))
+        ticket_ids = [row[0] for row in rows]
+        if not ticket_ids:
+            return 0
+
+        changes = []
+        if action == 'tag':
+            tag = Tag.objects.get(id=value)
+            # Tickets that already have the tag are left out, activity included
+            tagged = set(TicketTagsThrough.objects.filter(tag=tag, ticket_id__in=ticket_ids).values_list('ticket_id', flat=True))
+            rows = [row for row in rows if row[0] not in tagged]
+            TicketTagsThrough.objects.bulk_create(
+                [TicketTagsThrough(ticket_id=row[0], tag=tag) for row in rows], ignore_conflicts=True
+            )
+            activity_type = f"tag_added_{tag.name}"
+        else:
+            fields, activity_type = _resolve_bulk_action(action, value)
+            Ticket.objects.filter(id__in=ticket_ids).update(updatedAt=timezone.now(), **fields)
+            for ticket_id, status_id, agent_id, _, _ in rows:
+                if 'status' in fields and status_id != fields['status'].id:
+                    changes.append(TicketChange(ticket_id=ticket_id, changeType='status', previousValue=status_id, newValue=fields['status'].id))
+                if 'agent' in fields and agent_id != (fields['agent'].id if fields['agent'] else None):
+                    changes.append(TicketChange(
+                        ticket_id=ticket_id, changeType='assigned', previousValue=agent_id,
+                        newValue=fields['agent'].id if fields['agent'] else None
+                    ))
+
+        agent_name = agent.user.get_full_name()
+        AgentActivity.objects.bulk_create([
+            AgentActivity(
+                agent=agent,
+                ticket_id=ticket_id,
+                agentName=agent_name,
+                customerName=f"{first_name} {last_name}".strip(),
+                threadType=activity_type,
+            )
+            for ticket_id, _, _, first_name, last_name in rows
+        ])
+        TicketChange.objects.bulk_create(changes)
+    return len(rows)
+
+def get_thread_window(ticket, cursor=None, limit=THREAD_WINDOW_SIZE):
+    """
+    Returns up to ``limit`` threads of a ticket, oldest first, together with
+    a cursor for the threads before them (None when there are none).
+
+    Without a cursor this is the latest window. Windows are read with keyset
+    pagination on (createdAt, id), so loading the oldest messages of a
+    5000-thread ticket costs the same as loading the newest ones. Raises
+    InvalidCursor for unreadable cursors.
+    """
+    threads = ticket.threads.select_related('user__user').prefetch_related('attachments')
+    page = paginate_keyset(threads, cursor, limit, ordering=('-createdAt', '-id'))
+    return list(reversed(page.items)), page.next_cursor
+
+def group_threads_by_type(threads):
+    threads_by_type = {'reply': [], 'forward': [], 'note': []}
+    for thread in threads:
+        threads_by_type.setdefault(thread.threadType, []).append(thread)
+    return threads_by_type
+
+def thread_window_response(request, ticket, template_name, group_by_type=False):
+    """
+    Returns an older window of a ticket's threads for the "Load older
+    messages" button of the agent and customer ticket pages: rendered HTML
+    fragments, the thread data, and the cursor for the window before it.
+    """
+    try:
+        threads, older_cursor = get_thread_window(ticket, request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    html = {'all': render_to_string(template_name, {'ticket': ticket, 'threads': threads}, request)}
+    if group_by_type:
+        for thread_type, typed_threads in group_threads_by_type(threads).items():
+            html[thread_type] = render_to_string(template_name, {'ticket': ticket, 'threads': typed_threads}, request)
+
+    return JsonResponse({
+        'threads': [{
+            'id': thread.id,
+            'threadType': thread.threadType,
+            'createdBy': thread.createdBy,
+            'user_email': thread.user.user.email if thread.user and thread.user.user else None,
+            'message': thread.message,
+            'createdAt': thread.createdAt.isoformat(),
+        } for thread in threads],
+        'html': html,
+        'older_cursor': older_cursor,
+    })
+
+def get_ticket_view_bundle(ticket, agent_instance):
+    """
+    Loads everything ticket_view.html renders for ``ticket`` up front.
+
+    The latest window of threads comes with its users and attachments, the
+    ticket with its tags, labels and collaborators, and every lookup list is
+    evaluated here or served from the lookup cache, so the page costs the
+    same number of queries however long the conversation is. Threads are
+    grouped by type in a single pass.
+    """
+    ticket = Ticket.objects.select_related(
+        'customer__user', 'agent__user', 'status', 'priority', 'type', 'supportGroup', 'supportTeam'
+    ).prefetch_related(
+        'supportTags',
+        'supportLabels',
+        Prefetch('collaborators', queryset=UserInstance.objects.select_related('user')),
+    ).get(pk=ticket.pk)
+
+    threads, older_threads_cursor = get_thread_window(ticket)
+    threads_by_type = group_threads_by_type(threads)
+
+    return {
+        'ticket': ticket,
+        'threads': threads,
+        'thread_count': ticket.threads.count(),
+        'older_threads_cursor': older_threads_cursor,
+        'reply_threads': threads_by_type['reply'],
+        'forward_threads': threads_by_type['forward'],
+        'note_threads': threads_by_type['note'],
+        'ticket_tags': list(ticket.supportTags.all()),
+        'ticket_labels': list(ticket.supportLabels.all()),
+        'collaborators': list(ticket.collaborators.all()),
+        'statuses': get_lookup('statuses'),
+        'priorities': get_lookup('priorities'),
+        'agents': get_lookup('agents'),
+        'ticket_types': get_lookup('ticket_types'),
+        'groups': get_lookup('groups'),
+        'teams': get_lookup('teams'),
+        'tags': get_lookup('tags'),
+        'labels': list(SupportLabel.objects.filter(user=agent_instance)),
+    }
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .lookups import LOOKUPS, invalidate_lookups_for
+from .message_ids import append_message_id, message_id_hash, parse_message_ids, record_message_ids
+from .models import Ticket, TicketChange, Thread
+from .search import index_thread, index_ticket, index_ticket_subject
+
+
+@receiver(post_save, sender=Ticket)
+def update_ticket_search_document(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        index_ticket(instance)
+        return
+    # Only the subject and customer are in the document header; status or agent saves leave it alone
+    if update_fields is not None and not {'subject', 'customer', 'customer_id'} & set(update_fields):
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(attname in loaded and loaded[attname] == getattr(instance, attname) for attname in ('subject', 'customer_id')):
+        return
+    index_ticket_subject(instance)
+
+
+@receiver(post_save, sender=Thread)
+def update_thread_search_document(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        index_thread(instance)
+    elif update_fields is None or 'message' in update_fields:
+        index_ticket(instance.ticket)
+
+
+@receiver(pre_save, sender=Thread)
+def set_thread_message_id_hash(sender, instance, **kwargs):
+    instance.messageIdHash = message_id_hash(instance.messageId)
+
+
+@receiver(post_save, sender=Thread)
+def update_ticket_message_chain(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        append_message_id(instance)
+
+
+@receiver(post_save, sender=Ticket)
+def record_ticket_references(sender, instance, created, raw=False, **kwargs):
+    # Replies to any message the first email referenced belong to this ticket
+    if created and not raw and instance.reference_ids:
+        record_message_ids(instance.id, parse_message_ids(instance.reference_ids))
+
+
+@receiver(post_delete, sender=Thread)
+def remove_thread_search_document(sender, instance, **kwargs):
+    ticket_id = instance.ticket_id
+
+    def rebuild():
+        # Skipped when the thread went away because its ticket was deleted
+        ticket = Ticket.objects.filter(pk=ticket_id).first()
+        if ticket:
+            index_ticket(ticket)
+
+    transaction.on_commit(rebuild)
+
+
+@receiver(post_save, sender=Ticket)
+def record_ticket_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        changes = [TicketChange(ticket=instance, changeType='created', newValue=instance.status_id)]
+    else:
+        loaded = getattr(instance, '_loaded_values', {})
+        changes = []
+        for change_type, attname in (('status', 'status_id'), ('assigned', 'agent_id')):
+            # Fields that were deferred or never loaded have no known previous value
+            previous = loaded.get(attname, DEFERRED)
+            if previous is not DEFERRED and previous != getattr(instance, attname):
+                changes.append(TicketChange(
+                    ticket=instance, changeType=change_type, previousValue=previous, newValue=getattr(instance, attname)
+                ))
+    if changes:
+        TicketChange.objects.bulk_create(changes)
+
+
+def invalidate_lookup_cache(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no lookup exposes
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    # After commit, or another process could reload the old rows under the new version
+    transaction.on_commit(lambda: invalidate_lookups_for(sender))
+
+
+for lookup_model in {model for _, models in LOOKUPS.values() for model in models}:
+    post_save.connect(invalidate_lookup_cache, sender=lookup_model, dispatch_uid=f'lookup_save_{lookup_model.__name__}')
+    post_delete.connect(invalidate_lookup_cache, sender=lookup_model, dispatch_uid=f'lookup_delete_{lookup_model.__name__}')
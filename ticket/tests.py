@@ -1,3 +1,571 @@
-from django.test import TestCase
+import base64
+import email
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from authentication.models import User, UserInstance, SupportRole
+from settings.models import UvMailbox
+from .attachments import attachment_path
+from .constants import OUTBOX_CLAIM_TIMEOUT
+from .email_parser import parse_body, read_headers
+from .management.commands.fetch_emails import Command as FetchEmailsCommand
+from .models import Ticket, Thread, Tag, TicketStatus, TicketPriority, TicketChange, FailedEmail, TicketSearchDocument, EmailOutbox
+from .outbox import claim_outbox_batch, process_outbox, queue_email, retry_delay
+from .search import index_ticket, search_ticket_documents
+from .senders import SenderResolver
+from .services import TicketChangeCursor, get_ticket_changes
+
+
+class TicketViewQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        agent_role, _ = SupportRole.objects.get_or_create(code='ROLE_AGENT')
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        cls.agent_user = User.objects.create_user('agent@example.com', 'password', firstName='Agent')
+        cls.agent = UserInstance.objects.create(user=cls.agent_user, supportRole=agent_role, source='website', isActive=True)
+        customer_user = User.objects.create_user('customer@example.com', 'password', firstName='Customer')
+        cls.customer = UserInstance.objects.create(user=customer_user, supportRole=customer_role, source='website', isActive=True)
+        cls.ticket = Ticket.objects.create(subject='Printer on fire', source='website', customer=cls.customer, agent=cls.agent)
+        cls.ticket.supportTags.add(Tag.objects.create(name='hardware'))
+        cls.ticket.collaborators.add(cls.agent)
+
+    def setUp(self):
+        self.client.force_login(self.agent_user)
+
+    def add_threads(self, count):
+        for i in range(count):
+            user, created_by = (self.agent, 'agent') if i % 2 else (self.customer, 'customer')
+            Thread.objects.create(
+                ticket=self.ticket, user=user, source='website', createdBy=created_by,
+                threadType=('reply', 'note', 'forward')[i % 3], message=f'<p>Message {i}</p>'
+            )
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('ticket_view', args=[self.ticket.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_query_count_does_not_grow_with_threads(self):
+        self.add_threads(3)
+        self.count_queries()  # Warm the lookup cache
+        baseline = self.count_queries()
+        self.add_threads(30)
+        self.assertEqual(self.count_queries(), baseline)
+
+
+class TicketListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        agent_role, _ = SupportRole.objects.get_or_create(code='ROLE_AGENT')
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        cls.agent_user = User.objects.create_user('agent@example.com', 'password', firstName='Agent')
+        agents = [
+            UserInstance.objects.create(user=cls.agent_user, supportRole=agent_role, source='website', isActive=True)
+        ] + [
+            UserInstance.objects.create(
+                user=User.objects.create_user(f'agent{i}@example.com', 'password', firstName='Agent'),
+                supportRole=agent_role, source='website', isActive=True,
+            )
+            for i in range(4)
+        ]
+        customers = [
+            UserInstance.objects.create(
+                user=User.objects.create_user(f'customer{i}@example.com', 'password', firstName='Customer'),
+                supportRole=customer_role, source='website', isActive=True,
+            )
+            for i in range(20)
+        ]
+        statuses = [TicketStatus.objects.get_or_create(code=code)[0] for code in ('Open', 'Pending', 'Closed')]
+        priorities = [TicketPriority.objects.get_or_create(code=code)[0] for code in ('Low', 'Medium', 'High')]
+        # Every row has its own mix of customer, agent, status and priority, so a per-row lookup would show up
+        Ticket.objects.bulk_create([
+            Ticket(
+                subject=f'Ticket {i}', source='website', customer=customers[i % 20], agent=agents[i % 5],
+                status=statuses[i % 3], priority=priorities[i % 3],
+            )
+            for i in range(100)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.agent_user)
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    # Session, user, permission and count queries plus one for the rows, however many rows the page has
+    def test_ticket_api_page_mode(self):
+        self.get('get_filtered_tickets_and_counts')  # Warm the lookup cache
+        with self.assertNumQueries(11):
+            response = self.get('get_filtered_tickets_and_counts')
+        self.assertEqual(len(response.json()['tickets']), 100)
+
+    def test_ticket_api_cursor_mode(self):
+        self.get('get_filtered_tickets_and_counts', pagination='cursor')
+        with self.assertNumQueries(10):
+            response = self.get('get_filtered_tickets_and_counts', pagination='cursor')
+        self.assertEqual(len(response.json()['tickets']), 100)
+
+    def test_ticket_list_render(self):
+        self.get('ticket_list')
+        with self.assertNumQueries(15):
+            self.get('ticket_list')
+
+
+class TicketChangeCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        customer_user = User.objects.create_user('customer@example.com', 'password', firstName='Customer')
+        customer = UserInstance.objects.create(user=customer_user, supportRole=customer_role, source='website', isActive=True)
+        cls.tickets = [Ticket.objects.create(subject=f'Ticket {i}', source='website', customer=customer) for i in range(3)]
+
+    def test_change_committed_out_of_id_order_is_streamed(self):
+        # The middle change is still uncommitted when the stream reads past it
+        first = TicketChange.objects.get(ticket=self.tickets[0])
+        late_id = TicketChange.objects.get(ticket=self.tickets[1]).id
+        TicketChange.objects.filter(id=late_id).delete()
+        cursor = TicketChangeCursor(first.id - 1)
+        self.assertEqual([delta['ticket']['id'] for delta in get_ticket_changes(cursor)], [self.tickets[0].id, self.tickets[2].id])
+        self.assertEqual(cursor.gaps, {late_id})
+
+        # It commits later; a stream resumed from the last event id still gets it, once
+        TicketChange.objects.create(id=late_id, ticket=self.tickets[1], changeType='created')
+        resumed = TicketChangeCursor.parse(str(cursor))
+        self.assertEqual([delta['ticket']['id'] for delta in get_ticket_changes(resumed)], [self.tickets[1].id])
+        self.assertEqual(get_ticket_changes(resumed), [])
+        self.assertEqual(str(resumed), str(TicketChangeCursor.current()))
+
+
+def make_email(number, sender=None, extra=''):
+    sender = sender or f'customer{number}@example.com'
+    return (
+        f'From: Customer {number} <{sender}>\r\nTo: support@example.com\r\nSubject: Issue {number}\r\n'
+        f'Message-ID: <message{number}@example.com>\r\n{extra}Content-Type: text/plain\r\n\r\nHello {number}\r\n'
+    ).encode()
+
+
+class FakeIMAP:
+    """The imaplib calls fetch_emails makes, answered from ``messages`` ({uid: raw message})."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.fetches = []
+
+    def login(self, username, password):
+        return 'OK', [b'Logged in']
+
+    def select(self, mailbox):
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [b'1' if code == 'UIDVALIDITY' else None]
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            return 'OK', [' '.join(map(str, sorted(self.messages))).encode()]
+        if command == 'FETCH':
+            uids, items = [int(uid) for uid in args[0].split(',')], args[1]
+            self.fetches.append((uids, 'BODY' in items))
+            if 'BODY' not in items:
+                return 'OK', [f'{uid} (UID {uid} RFC822.SIZE {len(self.messages[uid])})'.encode() for uid in uids]
+            data = []
+            for uid in uids:
+                data.append((f'{uid} (UID {uid} BODY[] {{{len(self.messages[uid])}}}'.encode(), self.messages[uid]))
+                data.append(b')')
+            return 'OK', data
+        return 'OK', [None]
+
+    def expunge(self):
+        return 'OK', [None]
+
+    def close(self):
+        return 'OK', [None]
+
+    def logout(self):
+        return 'BYE', [None]
+
+
+class FetchEmailsTests(TestCase):
+    def setUp(self):
+        self.mailbox = UvMailbox.objects.create(
+            name='Support', email='support@example.com', imap_host='imap.example.com', imap_port=143,
+            imap_encryption='null', imap_username='support', imap_password='password',
+        )
+
+    def fetch(self, messages, **options):
+        imap = FakeIMAP(messages)
+        with mock.patch.object(FetchEmailsCommand, '_connect', return_value=imap):
+            call_command('fetch_emails', stdout=io.StringIO(), **options)
+        self.mailbox.refresh_from_db()
+        return imap
+
+    def test_poison_message_is_kept_and_the_rest_of_the_batch_is_saved(self):
+        resolve = SenderResolver.resolve
+
+        def failing_resolve(resolver, addresses):
+            if 'poison@example.com' in addresses:
+                raise DatabaseError('value too long for type character varying(191)')
+            return resolve(resolver, addresses)
+
+        messages = {uid: make_email(uid, 'poison@example.com' if uid == 2 else None) for uid in range(1, 5)}
+        with mock.patch.object(SenderResolver, 'resolve', failing_resolve):
+            self.fetch(messages)
+
+        self.assertEqual(self.mailbox.imap_last_uid, 4)
+        self.assertEqual(
+            sorted(Thread.objects.values_list('messageId', flat=True)),
+            ['<message1@example.com>', '<message3@example.com>', '<message4@example.com>'],
+        )
+        failed_email = FailedEmail.objects.get()
+        self.assertEqual((failed_email.stage, failed_email.messageId), ('resolve', '<message2@example.com>'))
+        self.assertEqual(bytes(failed_email.rawMessage), messages[2])
+
+    def test_duplicate_message_is_stored_once(self):
+        # The copy in the same batch passes the batch lookup and is stopped by the unique messageIdHash
+        self.fetch({1: make_email(1), 2: make_email(1), 3: make_email(3)})
+        self.assertEqual(self.mailbox.imap_last_uid, 3)
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(sorted(Thread.objects.values_list('messageId', flat=True)), ['<message1@example.com>', '<message3@example.com>'])
+
+        # A later copy is skipped by the batch lookup
+        self.fetch({1: make_email(1), 2: make_email(1), 3: make_email(3), 4: make_email(1)})
+        self.assertEqual(self.mailbox.imap_last_uid, 4)
+        self.assertEqual((Ticket.objects.count(), Thread.objects.count()), (2, 2))
+        self.assertFalse(FailedEmail.objects.exists())
+
+    def test_batches_are_capped_by_size(self):
+        messages = {uid: make_email(uid) for uid in range(1, 6)}
+        messages[3] = make_email(3, extra='X-Padding: ' + 'x' * 2000 + '\r\n')
+        imap = self.fetch(messages, batch_bytes=600)
+
+        # Sizes first, then runs of messages within 600 bytes; the large message goes alone
+        self.assertEqual(imap.fetches, [([1, 2, 3, 4, 5], False), ([1, 2], True), ([3], True), ([4, 5], True)])
+        self.assertEqual(Thread.objects.count(), 5)
+        self.assertEqual(self.mailbox.imap_last_uid, 5)
+
+
+class TicketSearchDocumentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        customer_user = User.objects.create_user('customer@example.com', 'password', firstName='Customer')
+        customer = UserInstance.objects.create(user=customer_user, supportRole=customer_role, source='website', isActive=True)
+        cls.ticket = Ticket.objects.create(subject='Printer on fire', source='website', customer=customer)
+
+    def add_thread(self, message):
+        Thread.objects.create(ticket=self.ticket, source='website', threadType='reply', message=message)
+
+    def document(self):
+        return TicketSearchDocument.objects.get(ticket=self.ticket).document
+
+    @mock.patch('ticket.search.SEARCH_DOCUMENT_MAX_LENGTH', 120)
+    def test_long_conversation_keeps_header_and_latest_text(self):
+        header = 'Printer on fire\ncustomer@example.com\n'
+        for i in range(10):
+            self.add_thread(f'<p>Reply number {i} about the toner</p>')
+        self.add_thread('<p>Latest extinguisher update</p>')
+
+        document = self.document()
+        self.assertLessEqual(len(document), 120)
+        self.assertTrue(document.startswith(header))
+        self.assertTrue(document.endswith('Latest extinguisher update'))
+        self.assertNotIn('Reply number 0 ', document)
+        self.assertEqual(list(search_ticket_documents('extinguisher').values_list('ticket_id', flat=True)), [self.ticket.id])
+
+        # A full rebuild keeps the same text
+        index_ticket(self.ticket)
+        self.assertEqual(self.document(), document)
+
+
+class BulkUpdateTicketsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        agent_role, _ = SupportRole.objects.get_or_create(code='ROLE_AGENT')
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        cls.agent_user = User.objects.create_user('agent@example.com', 'password', firstName='Agent')
+        UserInstance.objects.create(user=cls.agent_user, supportRole=agent_role, source='website', isActive=True)
+        customer_user = User.objects.create_user('customer@example.com', 'password', firstName='Customer')
+        customer = UserInstance.objects.create(user=customer_user, supportRole=customer_role, source='website', isActive=True)
+        cls.low, _ = TicketPriority.objects.get_or_create(code='Low')
+        cls.high, _ = TicketPriority.objects.get_or_create(code='High')
+        cls.tickets = [
+            Ticket.objects.create(subject=f'Ticket {i}', source='website', customer=customer, priority=cls.low)
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.agent_user)
+
+    def post(self, payload):
+        return self.client.post(reverse('bulk_update_tickets'), json.dumps(payload), content_type='application/json')
+
+    def high_priority_ids(self):
+        return set(Ticket.objects.filter(priority=self.high).values_list('id', flat=True))
+
+    def test_updates_listed_tickets(self):
+        ids = [self.tickets[0].id, self.tickets[2].id]
+        response = self.post({'action': 'priority', 'value': self.high.id, 'ticket_ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 2)
+        self.assertEqual(self.high_priority_ids(), set(ids))
+
+    def test_ticket_ids_string_is_rejected(self):
+        ticket_ids = ''.join(str(ticket.id) for ticket in self.tickets[:3])
+        response = self.post({'action': 'priority', 'value': self.high.id, 'ticket_ids': ticket_ids})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.high_priority_ids(), set())
+
+    def test_non_numeric_filter_ids_are_rejected(self):
+        for name in ('label_id', 'customer_id'):
+            response = self.post({'action': 'priority', 'value': self.high.id, 'filter': {name: 'abc'}})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.high_priority_ids(), set())
+
+    def test_body_that_is_not_an_object_is_rejected(self):
+        for payload in ([self.tickets[0].id], 'priority', 3, None):
+            self.assertEqual(self.post(payload).status_code, 400)
+
+
+NESTED_EMAIL = b'''From: Customer <customer@example.com>
+Subject: Nested
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+This preamble is not part of any part.
+--outer
+Content-Type: multipart/alternative; boundary="outer-alt"
+
+--outer-alt
+Content-Type: text/plain; charset=utf-8
+Content-Transfer-Encoding: quoted-printable
+
+Caf=C3=A9 order, a soft =
+break, and a line that mentions --outer-alt in passing.
+--outer-alt is not a delimiter either
+--outer-alt
+Content-Type: text/html; charset=utf-8
+Content-Transfer-Encoding: base64
+
+PHA+Q2Fmw6kgb3JkZXI8L3A+
+--outer-alt--
+Epilogue of the alternative part.
+--outer
+Content-Type: application/pdf; name="invoice.pdf"
+Content-Disposition: attachment; filename="invoice.pdf"
+Content-Transfer-Encoding: base64
+
+JVBERi0xLjQKJcOkw7zDtsOfCjIgMCBvYmoKPDwvTGVuZ3RoIDMgMCBSPj4Kc3RyZWFtCnhyZWYK
+dHJhaWxlcgo8PC9TaXplIDE+PgpzdGFydHhyZWYKMAolJUVPRgo=
+--outer
+Content-Type: message/rfc822
+
+From: Someone <someone@example.com>
+Subject: Forwarded question
+Content-Type: text/plain
+
+The forwarded body.
+--outer
+Content-Type: text/csv; name="rows.csv"
+Content-Transfer-Encoding: quoted-printable
+
+a,b=0Ac,d
+--outer--
+This epilogue is ignored.
+'''
+
+# The closing delimiter never comes; the last part runs to the end of the message
+UNCLOSED_EMAIL = b'''From: Customer <customer@example.com>
+Subject: Unclosed
+Content-Type: multipart/mixed; boundary=abc
+
+--abc
+Content-Type: text/plain
+
+First part
+--abc
+Content-Type: application/octet-stream
+Content-Transfer-Encoding: base64
+
+AAECAwQFBgc=
+'''
+
+SINGLE_PART_EMAIL = b'''From: Customer <customer@example.com>
+Subject: Plain
+Content-Type: text/plain; charset=iso-8859-1
+Content-Transfer-Encoding: quoted-printable
+
+Gr=FC=DFe
+--not-a-boundary
+'''
+
+
+class EmailParserTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def parse(self, raw):
+        fp = io.BytesIO(raw)
+        return parse_body(read_headers(fp), fp)
+
+    def stored(self, attachment):
+        with open(os.path.join(self.media_root, attachment.path), 'rb') as stored_file:
+            return stored_file.read()
+
+    def summary(self, raw):
+        """The text parts and attachments parse_body() found in ``raw``; embedded messages by their subject."""
+        parsed = self.parse(raw)
+        attachments = []
+        for attachment in parsed.attachments:
+            content = self.stored(attachment)
+            if attachment.contentType == 'message/rfc822':
+                content = email.message_from_bytes(content)['Subject']
+            attachments.append((attachment.contentType, attachment.name, content))
+        return parsed.plain, parsed.html, attachments
+
+    def stdlib_summary(self, raw):
+        """The same, as read by the standard library parser."""
+        body = {'plain': None, 'html': None, 'attachments': []}
+
+        def walk(part):
+            content_type = part.get_content_type()
+            if content_type == 'message/rfc822':
+                body['attachments'].append((content_type, part.get_filename(), part.get_payload(0)['Subject']))
+            elif part.is_multipart():
+                for subpart in part.get_payload():
+                    walk(subpart)
+            elif content_type in ('text/plain', 'text/html') and 'attachment' not in str(part.get('Content-Disposition')):
+                body['html' if content_type == 'text/html' else 'plain'] = part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8')
+            else:
+                body['attachments'].append((content_type, part.get_filename(), part.get_payload(decode=True)))
+
+        walk(email.message_from_bytes(raw))
+        return body['plain'], body['html'], body['attachments']
+
+    def test_matches_the_standard_library(self):
+        for name, raw in (('nested', NESTED_EMAIL), ('unclosed', UNCLOSED_EMAIL), ('single part', SINGLE_PART_EMAIL)):
+            for line_ending in (b'\n', b'\r\n'):
+                raw_message = raw.replace(b'\n', line_ending)
+                with self.subTest(name, line_ending=line_ending):
+                    self.assertEqual(self.summary(raw_message), self.stdlib_summary(raw_message))
+
+    def test_nested_message_parts(self):
+        plain, html, attachments = self.summary(NESTED_EMAIL)
+        self.assertEqual(plain, 'Café order, a soft break, and a line that mentions --outer-alt in passing.\n--outer-alt is not a delimiter either')
+        self.assertEqual(html, '<p>Café order</p>')
+        self.assertEqual([(content_type, name) for content_type, name, content in attachments], [
+            ('application/pdf', 'invoice.pdf'), ('message/rfc822', None), ('text/csv', 'rows.csv'),
+        ])
+        self.assertEqual(attachments[1][2], 'Forwarded question')
+
+    def test_attachments_are_stored_once_by_sha256(self):
+        content = b'The same report, sent twice.\n' * 100
+        encoded = base64.encodebytes(content)
+        raw = (
+            b'Content-Type: multipart/mixed; boundary=b\n\n'
+            b'--b\nContent-Type: application/octet-stream; name="one.txt"\nContent-Transfer-Encoding: base64\n\n' + encoded +
+            b'--b\nContent-Type: application/octet-stream; name="two.txt"\nContent-Transfer-Encoding: base64\n\n' + encoded +
+            b'--b--\n'
+        )
+        first, second = self.parse(raw).attachments
+        again, _ = self.parse(raw).attachments
+
+        expected_path = attachment_path(hashlib.sha256(content).hexdigest())
+        self.assertEqual({first.path, second.path, again.path}, {expected_path})
+        self.assertEqual((first.name, second.name, first.size), ('one.txt', 'two.txt', len(content)))
+        self.assertEqual(self.stored(first), content)
+        stored_files = [name for directory, _, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(stored_files, [os.path.basename(expected_path)])
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer_role, _ = SupportRole.objects.get_or_create(code='ROLE_CUSTOMER')
+        customer_user = User.objects.create_user('customer@example.com', 'password', firstName='Customer')
+        customer = UserInstance.objects.create(user=customer_user, supportRole=customer_role, source='website', isActive=True)
+        cls.ticket = Ticket.objects.create(subject='Printer on fire', source='website', customer=customer)
+
+    def setUp(self):
+        self.thread = Thread.objects.create(ticket=self.ticket, source='website', threadType='reply', message='<p>On it</p>')
+
+    def queue(self):
+        return queue_email(self.thread, EmailMessage('Printer on fire', '<p>On it</p>', 'support@example.com', ['customer@example.com']))
+
+    def make_due(self):
+        EmailOutbox.objects.update(nextAttemptAt=timezone.now())
+
+    def assert_state(self, entry, status, attempts, delivery_status):
+        entry.refresh_from_db()
+        self.thread.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, self.thread.deliveryStatus), (status, attempts, delivery_status))
+
+    def test_send(self):
+        entry = self.queue()
+        self.assert_state(entry, 'pending', 0, 'queued')
+        self.assertEqual(process_outbox(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assert_state(entry, 'sent', 1, 'sent')
+        self.assertEqual([message.to for message in mail.outbox], [['customer@example.com']])
+        self.assertEqual(process_outbox(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+    def test_failed_send_is_retried_after_backoff(self):
+        entry = self.queue()
+        before = timezone.now()
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('421 try later')):
+            self.assertEqual(process_outbox(), {'sent': 0, 'retrying': 1, 'failed': 0})
+        self.assert_state(entry, 'pending', 1, 'retrying')
+        self.assertEqual(entry.lastError, '421 try later')
+        self.assertGreaterEqual(entry.nextAttemptAt, before + timedelta(seconds=retry_delay(1)))
+
+        # Not due yet, then sent on the next attempt
+        self.assertEqual(process_outbox(), {'sent': 0, 'retrying': 0, 'failed': 0})
+        self.make_due()
+        self.assertEqual(process_outbox(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assert_state(entry, 'sent', 2, 'sent')
+
+    def test_send_gives_up_after_max_attempts(self):
+        entry = self.queue()
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('550 rejected')):
+            self.assertEqual(process_outbox(max_attempts=2), {'sent': 0, 'retrying': 1, 'failed': 0})
+            self.make_due()
+            self.assertEqual(process_outbox(max_attempts=2), {'sent': 0, 'retrying': 0, 'failed': 1})
+        self.assert_state(entry, 'failed', 2, 'failed')
+        self.make_due()
+        self.assertEqual(process_outbox(max_attempts=2), {'sent': 0, 'retrying': 0, 'failed': 0})
+        self.assertEqual(mail.outbox, [])
+
+    def test_claimed_entries_are_skipped_by_other_workers(self):
+        entry = self.queue()
+        self.assertEqual(claim_outbox_batch(10), [entry])
+        self.assertEqual(claim_outbox_batch(10), [])
+        entry.refresh_from_db()
+        self.assertGreater(entry.nextAttemptAt, timezone.now() + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT - 60))
+
+    def test_rolled_back_transaction_queues_nothing(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            self.queue()
+            raise DatabaseError('the reply could not be saved')
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(process_outbox(), {'sent': 0, 'retrying': 0, 'failed': 0})
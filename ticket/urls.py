@@ -10,6 +10,7 @@ urlpatterns = [
     path('tickets/<int:ticket_id>/update_group/', views.update_ticket_group, name='update_ticket_group'),
     path('tickets/<int:ticket_id>/update_team/', views.update_ticket_team, name='update_ticket_team'),
     path('tickets/<int:ticket_id>/', views.ticket_view, name='ticket_view'),
+    path('tickets/<int:ticket_id>/threads/', views.ticket_threads, name='ticket_threads'),
     path('workflows/', views.workflow_list, name='workflow_list'),
     path('workflows/create/', views.workflow_create, name='workflow_create'),
     path('workflows/<int:workflow_id>/edit/', views.workflow_edit, name='workflow_edit'),
@@ -52,6 +53,9 @@ urlpatterns = [
 
     # API endpoints
     path('api/tickets/', views.get_filtered_tickets_and_counts, name='get_filtered_tickets_and_counts'),
+    path('api/tickets/search/', views.search_tickets, name='search_tickets'),
+    path('api/tickets/events/', views.ticket_events, name='ticket_events'),
+    path('api/tickets/bulk/', views.bulk_update_tickets, name='bulk_update_tickets'),
     path('api/agents/', views.get_agents, name='get_agents'),
     path('api/groups/', views.get_groups, name='get_groups'),
     path('api/teams/', views.get_teams, name='get_teams'),
@@ -2,15 +2,24 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+import asyncio
 import json
-from django.http import JsonResponse
-from django.db import models
+import time
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db import models, transaction
 from .models import Workflow, TicketType, Tag, SavedReplies, PreparedResponse, Ticket, TicketStatus, TicketPriority, Thread, SupportLabel, AgentActivity
 from .forms import WorkflowForm, TicketTypeForm, TagForm, SavedReplyForm, PreparedResponseForm, ThreadForm, NoteForm, ForwardForm, CollaboratorForm, TicketForm, SupportLabelForm
-from .services import get_or_create_user_instance
+from .services import get_or_create_user_instance, get_ticket_counts, get_ticket_filter_q, get_ticket_rows, serialize_ticket_row, get_ticket_changes, TicketChangeCursor, apply_bulk_ticket_action, get_ticket_view_bundle, thread_window_response
+from .pagination import paginate_keyset, InvalidCursor
+from .search import search_ticket_documents
+from .lookups import get_lookup
+from .message_ids import generate_message_id
 from authentication.models import User, UserInstance, SupportGroup, SupportTeam
-from .constants import PREPARED_RESPONSE_ACTIONS, EMAIL_TEMPLATES, PRIORITIES, STATUSES
-from authentication.decorators import admin_login_required, permission_required
+from .constants import PREPARED_RESPONSE_ACTIONS, EMAIL_TEMPLATES, PRIORITIES, STATUSES, TICKET_EVENT_POLL_INTERVAL, TICKET_EVENT_KEEPALIVE_INTERVAL, TICKET_EVENT_STREAM_DURATION, TICKET_BULK_ACTIONS, TICKET_BULK_ACTION_LIMIT
+from authentication.decorators import admin_login_required, permission_required, has_permission
 
 def create_agent_activity(agent, ticket, activity_type):
     AgentActivity.objects.create(
@@ -21,16 +30,6 @@ def create_agent_activity(agent, ticket, activity_type):
         threadType=activity_type
     )
 
-def format_count(count):
-    if 100 <= count <= 199:
-        return "100+"
-    elif 600 <= count <= 699:
-        return "600+"
-    elif count >= 1000:
-        return "1000+"
-    else:
-        return str(count)
-
 @admin_login_required
 @permission_required('ROLE_AGENT_VIEW_AGENT_ACTIVITY') # Assuming a new permission is needed
 def agent_activity_list(request):
@@ -104,7 +103,7 @@ def ticket_list(request):
 
     # Set up Paginator
     tickets_per_page = 10  # You can adjust this number
-    paginator = Paginator(all_tickets, tickets_per_page)
+    paginator = Paginator(get_ticket_rows(all_tickets), tickets_per_page)
 
     page = request.GET.get('page')
     try:
@@ -116,41 +115,11 @@ def ticket_list(request):
         # If page is out of range (e.g. 9999), deliver last page of results.
         tickets = paginator.page(paginator.num_pages)
 
-    # Calculate sidebar counts
-    all_count = all_tickets.count()
-    new_count = all_tickets.filter(is_new=True).count()
-    unassigned_count = all_tickets.filter(agent__isnull=True).count()
-    unanswered_count = all_tickets.filter(isReplied=False).count()
-    my_tickets_count = all_tickets.filter(agent__user=request.user).count() # Assuming request.user is the agent
-    starred_count = all_tickets.filter(isStarred=True).count()
-    trashed_count = all_tickets.filter(isTrashed=True).count()
-
-    sidebar_filters = {
-        'all': {'label': 'All', 'count': format_count(all_count)},
-        'new': {'label': 'New', 'count': format_count(new_count)},
-        'unassigned': {'label': 'Unassigned', 'count': format_count(unassigned_count)},
-        'unanswered': {'label': 'Unanswered', 'count': format_count(unanswered_count)},
-        'my_tickets': {'label': 'My Tickets', 'count': format_count(my_tickets_count)},
-        'starred': {'label': 'Starred', 'count': format_count(starred_count)},
-        'trashed': {'label': 'Trashed', 'count': format_count(trashed_count)},
-    }
+    # Read before counting so the event stream replays anything that happens while counting
+    last_event_id = str(TicketChangeCursor.current())
 
-    # Calculate sub-filter (status) counts for 'All' tickets initially
-    status_counts = {}
-    statuses = TicketStatus.objects.all().order_by('sortOrder') # Assuming sortOrder exists
-    for status in statuses:
-        count = all_tickets.filter(status=status).count()
-        status_counts[status.code] = {'label': status.description, 'count': format_count(count)}
-
-    # Calculate sub-filter (label) counts
-    label_counts = {}
-    # Only show labels associated with the current agent's user instance
-    current_agent_user_instance = request.user.user_instances.first()
-    if current_agent_user_instance:
-        labels = SupportLabel.objects.filter(user=current_agent_user_instance).order_by('name')
-        for label in labels:
-            count = all_tickets.filter(supportLabels=label).count()
-            label_counts[label.id] = {'label': label.name, 'count': format_count(count)}
+    # Calculate sidebar, status and label counts
+    sidebar_filters, status_counts, label_counts = get_ticket_counts(all_tickets, request.user)
 
     context = {
         "view": "Tickets",
@@ -162,6 +131,7 @@ def ticket_list(request):
         "customer": customer,
         "customer_id": customer_id,
         "selected_label_id": label_id, # Pass selected label ID to template
+        "last_event_id": last_event_id,
     }
     return render(request, "ticket_list.html", context)
 
@@ -185,18 +155,7 @@ def get_filtered_tickets_and_counts(request):
             pass
 
     # Apply primary filter
-    if filter_type == 'new':
-        tickets_queryset = tickets_queryset.filter(is_new=True)
-    elif filter_type == 'unassigned':
-        tickets_queryset = tickets_queryset.filter(agent__isnull=True)
-    elif filter_type == 'unanswered':
-        tickets_queryset = tickets_queryset.filter(isReplied=False)
-    elif filter_type == 'my_tickets':
-        tickets_queryset = tickets_queryset.filter(agent__user=request.user)
-    elif filter_type == 'starred':
-        tickets_queryset = tickets_queryset.filter(isStarred=True)
-    elif filter_type == 'trashed':
-        tickets_queryset = tickets_queryset.filter(isTrashed=True)
+    tickets_queryset = tickets_queryset.filter(get_ticket_filter_q(filter_type, request.user))
 
     # Apply status sub-filter if provided
     if status_code:
@@ -210,17 +169,43 @@ def get_filtered_tickets_and_counts(request):
         except (ValueError, TypeError):
             pass
 
-    # Set up Paginator for the filtered queryset
     tickets_per_page = 100  # Consistent with ticket_list view
-    paginator = Paginator(tickets_queryset, tickets_per_page)
+    cursor = request.GET.get('cursor')
+    if cursor is not None or request.GET.get('pagination') == 'cursor':
+        # Keyset mode: constant cost per page and no COUNT(*)
+        try:
+            tickets_page_obj = paginate_keyset(get_ticket_rows(tickets_queryset), cursor, tickets_per_page)
+        except InvalidCursor as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        pagination = {
+            'mode': 'cursor',
+            'has_next': tickets_page_obj.has_next(),
+            'has_previous': tickets_page_obj.has_previous(),
+            'next_cursor': tickets_page_obj.next_cursor,
+            'previous_cursor': tickets_page_obj.previous_cursor,
+        }
+    else:
+        # Set up Paginator for the filtered queryset
+        paginator = Paginator(get_ticket_rows(tickets_queryset), tickets_per_page)
 
-    page = request.GET.get('page')
-    try:
-        tickets_page_obj = paginator.page(page)
-    except PageNotAnInteger:
-        tickets_page_obj = paginator.page(1)
-    except EmptyPage:
-        tickets_page_obj = paginator.page(paginator.num_pages)
+        page = request.GET.get('page')
+        try:
+            tickets_page_obj = paginator.page(page)
+        except PageNotAnInteger:
+            tickets_page_obj = paginator.page(1)
+        except EmptyPage:
+            tickets_page_obj = paginator.page(paginator.num_pages)
+
+        pagination = {
+            'mode': 'page',
+            'num_pages': tickets_page_obj.paginator.num_pages,
+            'current_page': tickets_page_obj.number,
+            'has_next': tickets_page_obj.has_next(),
+            'has_previous': tickets_page_obj.has_previous(),
+            'next_page_number': tickets_page_obj.next_page_number() if tickets_page_obj.has_next() else None,
+            'previous_page_number': tickets_page_obj.previous_page_number() if tickets_page_obj.has_previous() else None,
+            'page_range': list(tickets_page_obj.paginator.page_range),
+        }
 
     # Recalculate sidebar counts based on the current primary filter (before status and label filter)
     # This is important because the sidebar counts should reflect the primary category
@@ -235,74 +220,177 @@ def get_filtered_tickets_and_counts(request):
         except (ValueError, TypeError):
             pass # Ignore filter if customer_id is invalid
 
-    if filter_type == 'new':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(is_new=True)
-    elif filter_type == 'unassigned':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(agent__isnull=True)
-    elif filter_type == 'unanswered':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(isReplied=False)
-    elif filter_type == 'my_tickets':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(agent__user=request.user)
-    elif filter_type == 'starred':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(isStarred=True)
-    elif filter_type == 'trashed':
-        all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(isTrashed=True)
-
-    sidebar_filters_updated = {
-        'all': {'label': 'All', 'count': format_count(all_tickets_for_primary_filter.count())},
-        'new': {'label': 'New', 'count': format_count(all_tickets_for_primary_filter.filter(is_new=True).count())},
-        'unassigned': {'label': 'Unassigned', 'count': format_count(all_tickets_for_primary_filter.filter(agent__isnull=True).count())},
-        'unanswered': {'label': 'Unanswered', 'count': format_count(all_tickets_for_primary_filter.filter(isReplied=False).count())},
-        'my_tickets': {'label': 'My Tickets', 'count': format_count(all_tickets_for_primary_filter.filter(agent__user=request.user).count())},
-        'starred': {'label': 'Starred', 'count': format_count(all_tickets_for_primary_filter.filter(isStarred=True).count())},
-        'trashed': {'label': 'Trashed', 'count': format_count(all_tickets_for_primary_filter.filter(isTrashed=True).count())},
-    }
+    all_tickets_for_primary_filter = all_tickets_for_primary_filter.filter(get_ticket_filter_q(filter_type, request.user))
 
-    # Recalculate status counts based on the current primary filter
-    status_counts_updated = {}
-    statuses = TicketStatus.objects.all().order_by('sortOrder')
-    for status in statuses:
-        count = all_tickets_for_primary_filter.filter(status=status).count()
-        status_counts_updated[status.code] = {'label': status.description, 'count': format_count(count)}
-
-    # Recalculate label counts based on the current primary filter
-    label_counts_updated = {}
-    current_agent_user_instance = request.user.user_instances.first()
-    if current_agent_user_instance:
-        labels = SupportLabel.objects.filter(user=current_agent_user_instance).order_by('name')
-        for label in labels:
-            count = all_tickets_for_primary_filter.filter(supportLabels=label).count()
-            label_counts_updated[label.id] = {'label': label.name, 'count': format_count(count)}
+    last_event_id = str(TicketChangeCursor.current())
+    sidebar_filters_updated, status_counts_updated, label_counts_updated = get_ticket_counts(
+        all_tickets_for_primary_filter, request.user
+    )
 
     # Serialize tickets
-    tickets_data = []
-    for ticket in tickets_page_obj:
-        tickets_data.append({
-            'id': ticket.id,
-            'subject': ticket.subject,
-            'customer_email': ticket.customer.user.email if ticket.customer and ticket.customer.user else 'N/A',
-            'status_description': ticket.status.description if ticket.status else 'N/A',
-            'priority_description': ticket.priority.description if ticket.priority else 'N/A',
-            'agent_email': ticket.agent.user.email if ticket.agent and ticket.agent.user else 'Unassigned',
-            'created_at': ticket.createdAt.strftime("%b %d, %Y %H:%M"),
-        })
+    tickets_data = [serialize_ticket_row(ticket) for ticket in tickets_page_obj]
 
     return JsonResponse({
         'tickets': tickets_data,
         'sidebar_filters': sidebar_filters_updated,
         'status_counts': status_counts_updated,
         'label_counts': label_counts_updated,
+        'pagination': pagination,
+        'last_event_id': last_event_id,
+    })
+
+@admin_login_required
+@permission_required('ROLE_AGENT_EDIT_TICKET')
+def search_tickets(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'success': False, 'error': 'Search query is required.'}, status=400)
+    filter_type = request.GET.get('filter_type', 'all')
+
+    documents = search_ticket_documents(query).filter(
+        ticket__in=Ticket.objects.filter(get_ticket_filter_q(filter_type, request.user)).values('id')
+    )
+    try:
+        page = paginate_keyset(documents.values('pk', 'rank'), request.GET.get('cursor'), 50, ordering=('-rank', '-pk'))
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    # Load the page's rows in one query, then restore the rank order
+    tickets = get_ticket_rows(Ticket.objects.all()).in_bulk([document['pk'] for document in page])
+    tickets_data = []
+    for document in page:
+        if document['pk'] in tickets:
+            tickets_data.append(dict(serialize_ticket_row(tickets[document['pk']]), rank=document['rank']))
+
+    return JsonResponse({
+        'tickets': tickets_data,
         'pagination': {
-            'num_pages': tickets_page_obj.paginator.num_pages,
-            'current_page': tickets_page_obj.number,
-            'has_next': tickets_page_obj.has_next(),
-            'has_previous': tickets_page_obj.has_previous(),
-            'next_page_number': tickets_page_obj.next_page_number() if tickets_page_obj.has_next() else None,
-            'previous_page_number': tickets_page_obj.previous_page_number() if tickets_page_obj.has_previous() else None,
-            'page_range': list(tickets_page_obj.paginator.page_range),
-        }
+            'mode': 'cursor',
+            'has_next': page.has_next(),
+            'has_previous': page.has_previous(),
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+        },
     })
 
+@admin_login_required
+@permission_required('ROLE_AGENT_EDIT_TICKET')
+def bulk_update_tickets(request):
+    """
+    Applies one action to many tickets. Expects a JSON body such as
+    {"action": "status", "value": 3, "ticket_ids": [1, 2]}, or a "filter"
+    object with the ticket API's filter_type/status_code/label_id/customer_id
+    parameters instead of "ticket_ids".
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method.'}, status=405)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON body.'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'success': False, 'error': 'The JSON body must be an object.'}, status=400)
+
+    action = payload.get('action')
+    if action not in TICKET_BULK_ACTIONS:
+        return JsonResponse({'success': False, 'error': f'Unknown action: {action}'}, status=400)
+    user_instance = request.user.user_instances.first()
+    if not has_permission(user_instance, TICKET_BULK_ACTIONS[action]):
+        return JsonResponse({'success': False, 'error': 'Permission denied.'}, status=403)
+
+    tickets = Ticket.objects.all()
+    if 'ticket_ids' in payload:
+        try:
+            # A string is iterable too, and "123" would otherwise mean tickets 1, 2 and 3
+            if not isinstance(payload['ticket_ids'], list):
+                raise TypeError
+            tickets = tickets.filter(id__in=[int(ticket_id) for ticket_id in payload['ticket_ids']])
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'ticket_ids must be a list of ids.'}, status=400)
+    elif isinstance(payload.get('filter'), dict):
+        filters = payload['filter']
+        try:
+            tickets = tickets.filter(get_ticket_filter_q(filters.get('filter_type', 'all'), request.user))
+            if filters.get('status_code'):
+                tickets = tickets.filter(status__code=filters['status_code'])
+            if filters.get('label_id'):
+                tickets = tickets.filter(supportLabels__id=int(filters['label_id']))
+            if filters.get('customer_id'):
+                tickets = tickets.filter(customer__user__id=int(filters['customer_id']))
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'label_id and customer_id must be ids.'}, status=400)
+    else:
+        return JsonResponse({'success': False, 'error': 'Provide ticket_ids or filter.'}, status=400)
+
+    ticket_ids = list(tickets.order_by().values_list('id', flat=True)[:TICKET_BULK_ACTION_LIMIT + 1])
+    if len(ticket_ids) > TICKET_BULK_ACTION_LIMIT:
+        return JsonResponse({'success': False, 'error': f'Bulk actions are limited to {TICKET_BULK_ACTION_LIMIT} tickets.'}, status=400)
+
+    try:
+        updated = apply_bulk_ticket_action(ticket_ids, action, payload.get('value'), user_instance)
+    except (ObjectDoesNotExist, ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': f'Invalid value for {action}.'}, status=400)
+    return JsonResponse({'success': True, 'updated': updated})
+
+def _ticket_event(delta):
+    return f"id: {delta['cursor']}\nevent: {delta['type']}\ndata: {json.dumps(delta)}\n\n"
+
+def _sync_ticket_events(cursor):
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < TICKET_EVENT_STREAM_DURATION:
+        deltas = get_ticket_changes(cursor)
+        for delta in deltas:
+            yield _ticket_event(delta)
+        if deltas:
+            last_sent = time.monotonic()
+            continue
+        if time.monotonic() - last_sent >= TICKET_EVENT_KEEPALIVE_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        time.sleep(TICKET_EVENT_POLL_INTERVAL)
+
+async def _async_ticket_events(cursor):
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < TICKET_EVENT_STREAM_DURATION:
+        deltas = await sync_to_async(get_ticket_changes)(cursor)
+        for delta in deltas:
+            yield _ticket_event(delta)
+        if deltas:
+            last_sent = time.monotonic()
+            continue
+        if time.monotonic() - last_sent >= TICKET_EVENT_KEEPALIVE_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        await asyncio.sleep(TICKET_EVENT_POLL_INTERVAL)
+
+@admin_login_required
+@permission_required('ROLE_AGENT_EDIT_TICKET')
+def ticket_events(request):
+    """
+    Server-sent events stream of ticket queue changes (new ticket, status
+    change, assignment), read from the TicketChange feed.
+
+    Event ids are TicketChangeCursor positions, so changes committed out of
+    id order are not skipped. Browsers resume from the Last-Event-ID header
+    after a reconnect; the ticket list passes ``last_event_id`` on the first
+    connection so nothing recorded after the page was rendered is missed. Served without blocking
+    a worker when the project runs under uvdesk.asgi.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        cursor = TicketChangeCursor.parse(last_event_id)
+    except (TypeError, ValueError):
+        cursor = TicketChangeCursor.current()
+
+    if isinstance(request, ASGIRequest):
+        events = _async_ticket_events(cursor)
+    else:
+        events = _sync_ticket_events(cursor)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_WORKFLOW_AUTOMATIC')
 def workflow_list(request):
@@ -376,31 +464,29 @@ def ticket_create(request):
     if request.method == 'POST':
         form = TicketForm(request.POST)
         if form.is_valid():
-            ticket = form.save(commit=False) # Save ticket instance but don't commit yet
+            from .email_utils import send_initial_ticket_email
+            # The ticket, its first thread and the queued email are committed together
+            with transaction.atomic():
+                ticket = form.save(commit=False) # Save ticket instance but don't commit yet
 
-            # The customer is already set by form.save() in TicketForm's save method
-            # Now save the ticket to the database
-            ticket.save()
+                # The customer is already set by form.save() in TicketForm's save method
+                # Now save the ticket to the database
+                ticket.save()
 
-            # Create the initial thread for the ticket
-            initial_thread = Thread.objects.create(
-                ticket=ticket,
-                user=ticket.customer, # The customer is the initial sender
-                source='web', # Assuming web creation
-                message=form.cleaned_data['initial_message'],
-                threadType='initial_message', # Custom type for initial message
-                createdBy='agent', # Agent created it
-            )
-
-            # Send initial ticket email
-            from .email_utils import send_initial_ticket_email
-            try:
-                generated_message_id = send_initial_ticket_email(ticket, initial_thread)
-                initial_thread.messageId = generated_message_id # Save the generated Message-ID
-                initial_thread.save() # Save the thread with the Message-ID
-                messages.success(request, "Ticket created successfully and initial email sent.")
-            except Exception as e:
-                messages.error(request, f"Ticket created, but failed to send initial email: {e}")
+                # Create the initial thread for the ticket
+                initial_thread = Thread.objects.create(
+                    ticket=ticket,
+                    user=ticket.customer, # The customer is the initial sender
+                    source='web', # Assuming web creation
+                    message=form.cleaned_data['initial_message'],
+                    threadType='initial_message', # Custom type for initial message
+                    createdBy='agent', # Agent created it
+                    messageId=generate_message_id(), # Sent as the email's Message-ID
+                )
+
+                # Queue initial ticket email
+                send_initial_ticket_email(ticket, initial_thread)
+            messages.success(request, "Ticket created successfully and initial email queued.")
 
             return redirect('ticket_view', ticket_id=ticket.id)
         else:
@@ -891,32 +977,32 @@ def prepared_response_delete(request, prepared_response_id):
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_AGENT')
 def get_agents(request):
-    agents = UserInstance.objects.filter(supportRole__code='ROLE_AGENT').values('id', name=models.F('user__firstName'))
-    return JsonResponse(list(agents), safe=False)
+    agents = [{'id': agent.id, 'name': agent.user.firstName} for agent in get_lookup('agents')]
+    return JsonResponse(agents, safe=False)
 
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_GROUP')
 def get_groups(request):
-    groups = SupportGroup.objects.all().values('id', 'name')
-    return JsonResponse(list(groups), safe=False)
+    groups = [{'id': group.id, 'name': group.name} for group in get_lookup('groups')]
+    return JsonResponse(groups, safe=False)
 
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_SUB_GROUP')
 def get_teams(request):
-    teams = SupportTeam.objects.all().values('id', 'name')
-    return JsonResponse(list(teams), safe=False)
+    teams = [{'id': team.id, 'name': team.name} for team in get_lookup('teams')]
+    return JsonResponse(teams, safe=False)
 
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_TAG')
 def get_tags(request):
-    tags = Tag.objects.all().values('id', 'name')
-    return JsonResponse(list(tags), safe=False)
+    tags = [{'id': tag.id, 'name': tag.name} for tag in get_lookup('tags')]
+    return JsonResponse(tags, safe=False)
 
 @admin_login_required
 @permission_required('ROLE_AGENT_MANAGE_TICKET_TYPE')
 def get_ticket_types(request):
-    ticket_types = TicketType.objects.all().values('id', name=models.F('code'))
-    return JsonResponse(list(ticket_types), safe=False)
+    ticket_types = [{'id': ticket_type.id, 'name': ticket_type.code} for ticket_type in get_lookup('ticket_types')]
+    return JsonResponse(ticket_types, safe=False)
 
 @admin_login_required
 @permission_required('ROLE_AGENT_EDIT_TICKET')
@@ -1067,11 +1153,16 @@ def update_ticket_team(request, ticket_id):
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
     return JsonResponse({'success': False, 'error': 'Invalid request method.'}, status=405)
 
+@admin_login_required
+@permission_required('ROLE_AGENT_EDIT_TICKET')
+def ticket_threads(request, ticket_id):
+    ticket = get_object_or_404(Ticket.objects.select_related('customer__user'), id=ticket_id)
+    return thread_window_response(request, ticket, 'ticket_threads.html', group_by_type=True)
+
 @admin_login_required
 @permission_required('ROLE_AGENT_EDIT_TICKET')
 def ticket_view(request, ticket_id):
     ticket = get_object_or_404(Ticket, id=ticket_id)
-    threads = ticket.threads.all().order_by('createdAt')
 
     if request.method == 'POST':
         agent_instance = request.user.user_instances.first()
@@ -1117,15 +1208,17 @@ def ticket_view(request, ticket_id):
                 if not reply_form.cleaned_data['message']:
                     messages.error(request, 'Reply message cannot be empty.')
                 else:
-                    thread = reply_form.save(commit=False)
-                    thread.ticket = ticket
-                    thread.user = agent_instance
-                    thread.threadType = 'reply'
-                    thread.createdBy = 'agent'
-                    thread.save()
-                    create_agent_activity(agent_instance, ticket, 'agent_replied')
                     from .email_utils import send_reply_email
-                    send_reply_email(ticket, thread, reply_form.cleaned_data.get('send_to_collaborators_cc_bcc'))
+                    with transaction.atomic():
+                        thread = reply_form.save(commit=False)
+                        thread.ticket = ticket
+                        thread.user = agent_instance
+                        thread.threadType = 'reply'
+                        thread.createdBy = 'agent'
+                        thread.messageId = generate_message_id()
+                        thread.save()
+                        send_reply_email(ticket, thread, reply_form.cleaned_data.get('send_to_collaborators_cc_bcc'))
+                    create_agent_activity(agent_instance, ticket, 'agent_replied')
                     if reply_form.cleaned_data['status']:
                         ticket.status = reply_form.cleaned_data['status']
                         ticket.save()
@@ -1159,28 +1252,26 @@ def ticket_view(request, ticket_id):
                 if not forward_form.cleaned_data['message']:
                     messages.error(request, 'Forward message cannot be empty.')
                 else:
-                    thread = Thread.objects.create(
-                        ticket=ticket,
-                        user=agent_instance,
-                        threadType='forward',
-                        createdBy='agent',
-                        message=forward_form.cleaned_data['message']
-                    )
-                    create_agent_activity(agent_instance, ticket, 'agent_forwarded_ticket')
-                    if forward_form.cleaned_data['status']:
-                        ticket.status = forward_form.cleaned_data['status']
-                        ticket.save()
                     from .email_utils import send_forward_email
-                    try:
+                    with transaction.atomic():
+                        thread = Thread.objects.create(
+                            ticket=ticket,
+                            user=agent_instance,
+                            threadType='forward',
+                            createdBy='agent',
+                            message=forward_form.cleaned_data['message']
+                        )
                         send_forward_email(
                             ticket,
-                            thread, 
+                            thread,
                             forward_form.cleaned_data['to'],
                             forward_form.cleaned_data['subject']
                         )
-                        messages.success(request, 'Ticket forwarded successfully and email sent.')
-                    except Exception as e:
-                        messages.error(request, f'Ticket forwarded, but failed to send email: {e}')
+                    create_agent_activity(agent_instance, ticket, 'agent_forwarded_ticket')
+                    if forward_form.cleaned_data['status']:
+                        ticket.status = forward_form.cleaned_data['status']
+                        ticket.save()
+                    messages.success(request, 'Ticket forwarded successfully and email queued.')
 
                     return redirect('ticket_view', ticket_id=ticket.id)
             else:
@@ -1225,31 +1316,13 @@ def ticket_view(request, ticket_id):
     forward_form = ForwardForm()
     collaborator_form = CollaboratorForm()
 
-    statuses = TicketStatus.objects.all()
-    priorities = TicketPriority.objects.all()
-    agents = UserInstance.objects.filter(supportRole__code='ROLE_AGENT')
-    ticket_types = TicketType.objects.all()
-    groups = SupportGroup.objects.all()
-    teams = SupportTeam.objects.all()
-    tags = Tag.objects.all()
-    labels = SupportLabel.objects.filter(user=request.user.user_instances.first())
-
     context = {
         'view': 'Ticket View',
         'user': request.user,
-        'ticket': ticket,
-        'threads': threads,
         'reply_form': reply_form,
         'note_form': note_form,
         'forward_form': forward_form,
         'collaborator_form': collaborator_form,
-        'statuses': statuses,
-        'priorities': priorities,
-        'agents': agents,
-        'ticket_types': ticket_types,
-        'groups': groups,
-        'teams': teams,
-        'tags': tags,
-        'labels': labels,
+        **get_ticket_view_bundle(ticket, request.user.user_instances.first()),
     }
     return render(request, 'ticket_view.html', context)
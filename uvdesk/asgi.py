@@ -3,6 +3,10 @@ ASGI config for uvdesk project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project with it (e.g. ``uvicorn uvdesk.asgi:application``) so the
+ticket event stream at /member/api/tickets/events/ holds an open connection
+per browser tab without tying up a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -95,6 +95,20 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The lookup cache (ticket.lookups) invalidates through this cache, so when
+# running several worker processes point it at a shared backend such as
+# django.core.cache.backends.redis.RedisCache or memcached.
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default=""),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -146,6 +160,15 @@ AUTH_USER_MODEL = 'authentication.User'
 # Email settings
 EMAIL_BACKEND = 'settings.email_backend.UvSwiftmailerEmailBackend'
 DEFAULT_FROM_EMAIL = 'noreply@example.com'
+# Authenticated SMTP connections are pooled per process and transport: at most
+# EMAIL_POOL_MAX_CONNECTIONS in use (senders wait up to EMAIL_POOL_WAIT_TIMEOUT
+# seconds for one) and EMAIL_POOL_MAX_IDLE idle ones, checked with NOOP after
+# EMAIL_POOL_NOOP_AFTER idle seconds and dropped after EMAIL_POOL_IDLE_TIMEOUT
+EMAIL_POOL_MAX_CONNECTIONS = config("EMAIL_POOL_MAX_CONNECTIONS", default=4, cast=int)
+EMAIL_POOL_WAIT_TIMEOUT = config("EMAIL_POOL_WAIT_TIMEOUT", default=60, cast=int)
+EMAIL_POOL_MAX_IDLE = config("EMAIL_POOL_MAX_IDLE", default=4, cast=int)
+EMAIL_POOL_NOOP_AFTER = config("EMAIL_POOL_NOOP_AFTER", default=30, cast=int)
+EMAIL_POOL_IDLE_TIMEOUT = config("EMAIL_POOL_IDLE_TIMEOUT", default=300, cast=int)
 
 LOGIN_REDIRECT_URL = '/member/'
 LOGIN_URL = '/member/login/'